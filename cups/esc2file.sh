@@ -58,6 +58,36 @@ echo "DEBUG:  DEST_FILENAME=${DEST_FILENAME}" 1>&2
 echo "DEBUG:  LOG_FILENAME=${LOG_FILENAME}" 1>&2
 echo "esc2file - Debug mode: ${ESCPOS_DEBUG}" 1>${TMPDIR}/${LOG_FILENAME}
 
+# The local socket of the netprinter:  the prints handed to it are converted and published like the JetDirect prints,
+# each with its own reception file, so concurrent jobs never share a file.
+HANDOFF_SOCKET=${ESCPOS_CUPS_SOCKET:-/home/escpos-emu/web/tmp/cups.sock}
+
+# Exit status of esc2handoff.py when the socket is left by a stopped netprinter:  the backend then converts the print itself
+HANDOFF_UNAVAILABLE=2
+
+# Hand a print to the netprinter, and wait until its receipt is published.
+# Usage:  handoff_receipt [<ESC/POS file>]   (stdin if there is no file)
+handoff_receipt() {
+   /usr/bin/python3 /home/escpos-emu/cups/esc2handoff.py --socket "${HANDOFF_SOCKET}" --debug "${ESCPOS_DEBUG}" \
+      --job-id "${jobid}" --user "${cupsuser}" --title "${jobtitle}" ${1:+"${1}"}
+}
+
+# Without the handoff socket (previous versions of the netprinter, or the netprinter is stopped), convert a print to HTML:  post it to the web app so it goes through the resident PHP converters,
+# and start PHP directly only if the web app does not answer.
+# Usage:  convert_receipt <ESC/POS file> <HTML file>
+convert_receipt() {
+   /usr/bin/curl -s -f --data-binary @${1} -o ${2} "http://localhost:${FLASK_RUN_PORT}/convert?debug=${ESCPOS_DEBUG}"
+   if [ "$?" -eq "0" ]; then
+      echo "esc2file - Converted by the web app" 1>>${TMPDIR}/${LOG_FILENAME}
+      return 0
+   fi
+   if [ "${ESCPOS_DEBUG}" == "True" ]; then
+      /usr/local/bin/php /home/escpos-emu/esc2html.php --debug ${1} 1>${2} 2>>${TMPDIR}/${LOG_FILENAME}
+   else
+      /usr/local/bin/php /home/escpos-emu/esc2html.php ${1} 1>${2} 2>>${TMPDIR}/${LOG_FILENAME}
+   fi
+}
+
 # Now do the real work:
 case ${#} in
       0)
@@ -69,51 +99,59 @@ case ${#} in
          # backend needs to read from stdin if number of arguments is 5
          # NOTE: the CUPS backend programming directives state that temporary files should be created in the directory specified by the "TMPDIR" environment variable
          echo "DEBUG:  Printing from stdin"     1>&2
-         # read from stdin and write to receipt.bin
-         cat - > ${TMPDIR}/receipt.bin
-         if [ "$?" -ne "0" ]; 
+         # read from stdin and write to receipt.bin, so the job can still be converted here if the netprinter is not there to take it
+         if ! cat - > ${TMPDIR}/receipt.bin; 
          then
             echo "ERROR:   Cannot write to ${TMPDIR}/receipt.bin"  1>&2
             exit 51 #Send an error to CUPS to signal printing failure
-         else 
-            if [ "${ESCPOS_DEBUG}" == "True" ]; then
-               /usr/local/bin/php /home/escpos-emu/esc2html.php --debug ${TMPDIR}/receipt.bin 1>${TMPDIR}/${DEST_FILENAME} 2>>${TMPDIR}/${LOG_FILENAME}
-            else
-               #/usr/local/bin/php /home/escpos-emu/esc2html.php ${TMPDIR}/receipt.bin 1>${TMPDIR}/esc2html.html 2>>${TMPDIR}/esc2html_log
-               /usr/local/bin/php /home/escpos-emu/esc2html.php ${TMPDIR}/receipt.bin 1>${TMPDIR}/${DEST_FILENAME} 2>>${TMPDIR}/${LOG_FILENAME}
-            fi
+         fi
+         handoff_status=${HANDOFF_UNAVAILABLE}
+         if [ -S "${HANDOFF_SOCKET}" ]; then
+            handoff_receipt ${TMPDIR}/receipt.bin
+            handoff_status=$?
+         fi
+         if [ "${handoff_status}" -eq "${HANDOFF_UNAVAILABLE}" ]; then
+            convert_receipt ${TMPDIR}/receipt.bin ${TMPDIR}/${DEST_FILENAME}
             if [ "$?" -ne "0" ]; then
                echo "ERROR:   Error $? while printing ${TMPDIR}/receipt.bin to ${TMPDIR}/${DEST_FILENAME}"  1>&2
                exit 52  #Send an error to CUPS to signal printing failure
             fi
+         elif [ "${handoff_status}" -ne "0" ]; then
+            echo "ERROR:   Error while handing job ${jobid} to the netprinter"  1>&2
+            exit 53 #Send an error to CUPS to signal printing failure
          fi
          ;;
       6)
          # backend needs to read from file if number of arguments is 6
          echo "DEBUG:  Printing from file ${6}"     1>&2
-         if [ "${ESCPOS_DEBUG}" == "True" ]; then
-            /usr/local/bin/php /home/escpos-emu/esc2html.php --debug ${6} 1>${TMPDIR}/${DEST_FILENAME} 2>>${TMPDIR}/${LOG_FILENAME}
-         else
-            #/usr/local/bin/php /home/escpos-emu/esc2html.php ${6} 1>${TMPDIR}/esc2html.html 2>>${TMPDIR}/esc2html_log
-            /usr/local/bin/php /home/escpos-emu/esc2html.php ${6} 1>${TMPDIR}/${DEST_FILENAME} 2>>${TMPDIR}/${LOG_FILENAME}
-         fi
-         if [ "$?" -ne "0" ]; then
-            echo "ERROR:  Error $? while printing ${6} to ${TMPDIR}/${DEST_FILENAME}"  1>&2
-            #echo "ERROR:  Error $? while printing ${6} to ${TMPDIR}/test.html"  1>&2
-            exit 61 #Send an error to CUPS to signal printing failure
+         handoff_status=${HANDOFF_UNAVAILABLE}
+         if [ -S "${HANDOFF_SOCKET}" ]; then
+            handoff_receipt "${6}"
+            handoff_status=$?
          fi
-         #Call the web app to move the html file to the web directory
-         response=$(/usr/bin/curl -s http://localhost:${FLASK_RUN_PORT}/newReceipt)
-         if [ "$?" -eq "0" ]; then
-            if echo "$response" | grep -q "OK"; then
-               echo "DEBUG:  File copy returned OK" 1>&2
+         if [ "${handoff_status}" -eq "${HANDOFF_UNAVAILABLE}" ]; then
+            convert_receipt ${6} ${TMPDIR}/${DEST_FILENAME}
+            if [ "$?" -ne "0" ]; then
+               echo "ERROR:  Error $? while printing ${6} to ${TMPDIR}/${DEST_FILENAME}"  1>&2
+               #echo "ERROR:  Error $? while printing ${6} to ${TMPDIR}/test.html"  1>&2
+               exit 61 #Send an error to CUPS to signal printing failure
+            fi
+            #Call the web app to move the html file to the web directory
+            response=$(/usr/bin/curl -s -G --data-urlencode "html=${DEST_FILENAME}" --data-urlencode "log=${LOG_FILENAME}" http://localhost:${FLASK_RUN_PORT}/newReceipt)
+            if [ "$?" -eq "0" ]; then
+               if echo "$response" | grep -q "OK"; then
+                  echo "DEBUG:  File copy returned OK" 1>&2
+               else
+                  echo "ERROR:  File copy did not return OK" 1>&2
+                  exit 62 #Send an error to CUPS to signal printing failure
+               fi
             else
-               echo "ERROR:  File copy did not return OK" 1>&2
-               exit 62 #Send an error to CUPS to signal printing failure
+               echo "ERROR:  Error $? while calling the web app to move ${TMPDIR}/${DEST_FILENAME} to the web directory"  1>&2
+               exit 63 #Send an error to CUPS to signal printing failure
             fi
-         else
-            echo "ERROR:  Error $? while calling the web app to move ${TMPDIR}/${DEST_FILENAME} to the web directory"  1>&2
-            exit 63 #Send an error to CUPS to signal printing failure
+         elif [ "${handoff_status}" -ne "0" ]; then
+            echo "ERROR:  Error while handing ${6} to the netprinter"  1>&2
+            exit 64 #Send an error to CUPS to signal printing failure
          fi
          ;;
       1|2|3|4|*)
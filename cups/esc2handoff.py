@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# /home/escpos-emu/cups/esc2handoff.py
+#
+# Hands a CUPS print job to ESCPOS-netprinter on its local handoff socket (ESCPOS_CUPS_SOCKET),
+# so the job is converted and published like a JetDirect job.  Called by the esc2file backend.
+#
+# License: AGPL-3.0
+#
+# Exit status:  0 when the receipt is published, 1 when the netprinter could not convert it,
+#               2 when the handoff socket is not available (the backend then uses the web app instead).
+
+import argparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+HANDOFF_UNAVAILABLE = 2
+
+#get the job and its metadata from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--socket', help='Handoff socket of the netprinter',
+                    default=os.environ.get('ESCPOS_CUPS_SOCKET', '/home/escpos-emu/web/tmp/cups.sock'))
+parser.add_argument('--debug', help='True (case-sensitive) to convert in debug mode', default='false')
+parser.add_argument('--job-id', help='CUPS job ID', default='-')
+parser.add_argument('--user', help='CUPS user', default='-')
+parser.add_argument('--title', help='CUPS job title', default='')
+parser.add_argument('file', help='ESC/POS job, or stdin if absent', nargs='?')
+args = parser.parse_args()
+
+
+def send_job(job, length:int) -> str:
+    # One job per connection:  the header, the job, then wait for the response once the receipt is published
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(args.socket)
+        except (FileNotFoundError, ConnectionRefusedError) as err:
+            print(f"DEBUG:  Handoff socket {args.socket} not available: {err}", file=sys.stderr)
+            sys.exit(HANDOFF_UNAVAILABLE)
+        user = '_'.join(args.user.split()) or '-'  # One word
+        title = ' '.join(args.title.split())  # On one line
+        s.sendall(f"PRINT {args.debug} {length} {'_'.join(args.job_id.split()) or '-'} {user} {title}\n".encode('utf-8'))
+        while (chunk := job.read(65536)):
+            s.sendall(chunk)
+        with s.makefile('rb') as response:
+            return response.readline().decode('utf-8').strip()
+
+
+if args.file is not None:
+    with open(args.file, mode='rb') as job:
+        response = send_job(job, os.path.getsize(args.file))
+else:
+    # The length comes first:  spool stdin in a temporary file, in memory for the usual receipts
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as job:
+        shutil.copyfileobj(sys.stdin.buffer, job)
+        length = job.tell()
+        job.seek(0)
+        response = send_job(job, length)
+
+if not response.startswith('OK'):
+    print(f"ERROR:  ESCPOS-netprinter did not publish the receipt: {response or 'no response'}", file=sys.stderr)
+    sys.exit(1)
+print(f"INFO:  Receipt {response[3:]} published", file=sys.stderr)
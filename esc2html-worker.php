@@ -0,0 +1,76 @@
+<?php
+/**
+ * Resident ESC/POS to HTML converter.
+ *
+ * Started once by escpos-netprinter.py, it converts jobs read from stdin until stdin is closed,
+ * so the interpreter startup, the autoloader and the stylesheet are paid once per worker instead of once per receipt.
+ *
+ * Request:   "CONVERT <debug 0|1> <length> [<stylesheet URL>]\n" followed by <length> bytes of ESC/POS data.
+ *            With a stylesheet URL, the receipt links to it instead of inlining esc2html.css.
+ * Response:  "OK <html length> <log length>\n" or "ERROR <html length> <log length>\n",
+ *            followed by the HTML, then by the log of the conversion (what esc2html.php writes on stderr)
+ */
+require_once __DIR__ . '/esc2html.php';
+
+// The log of each job goes to its own file, and is sent back with the response
+$logFilename = tempnam(sys_get_temp_dir(), "esc2html-worker-");
+ini_set('log_errors', '1');
+ini_set('display_errors', '0');
+ini_set('error_log', $logFilename);
+
+$stdin = fopen('php://stdin', 'rb');
+$stdout = fopen('php://stdout', 'wb');
+
+while (($header = fgets($stdin)) !== false) {
+    $fields = explode(" ", trim($header));
+    if (count($fields) < 3 || count($fields) > 4 || $fields[0] !== "CONVERT") {
+        error_log("esc2html-worker: bad request '" . trim($header) . "'", 0);
+        break;  // The framing is lost, let the pool start a new worker
+    }
+    $debugMode = ($fields[1] === "1");
+    $length = intval($fields[2]);
+    $cssHref = $fields[3] ?? null;
+
+    // Read the whole job
+    $data = "";
+    while (strlen($data) < $length) {
+        $chunk = fread($stdin, $length - strlen($data));
+        if ($chunk === false || $chunk === "") {
+            break 2;  // stdin closed in the middle of a job
+        }
+        $data .= $chunk;
+    }
+
+    if ($debugMode) {
+        error_reporting(E_ALL);
+        error_log("\nDebug mode enabled\n", 0);
+    } else {
+        error_reporting(E_ERROR | E_PARSE);  //Deprecation warnings are unwanted except for debugging
+    }
+
+    $fp = fopen('php://memory', 'w+b');
+    fwrite($fp, $data);
+    rewind($fp);
+    try {
+        $html = esc2html($fp, $debugMode, $cssHref);
+        $status = "OK";
+        error_log("Job of " . $length . " bytes converted to HTML", 0);
+    } catch (Throwable $err) {
+        $html = "";
+        $status = "ERROR";
+        error_log("Conversion failed: " . $err, 0);
+    }
+    fclose($fp);
+
+    // Collect the log of this job, and empty the log file for the next one
+    clearstatcache();
+    $log = file_get_contents($logFilename);
+    file_put_contents($logFilename, "");
+
+    fwrite($stdout, $status . " " . strlen($html) . " " . strlen($log) . "\n");
+    fwrite($stdout, $html);
+    fwrite($stdout, $log);
+    fflush($stdout);
+}
+
+unlink($logFilename);
@@ -1,18 +1,60 @@
 import os
-from flask import Flask, redirect, render_template, request, url_for
+from flask import Flask, Response, jsonify, make_response, render_template, request, send_file, url_for
 from os import getenv
-from io import BufferedWriter
+from io import BufferedRandom, BufferedWriter
+import atexit
+import base64
 import csv
+import fcntl
+import gzip
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import sqlite3
 import subprocess
 import myconsts
 from subprocess import CompletedProcess
 from pathlib import PurePath
-from lxml import html, etree
-from datetime import datetime
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 import threading 
 import socketserver
+import asyncio
+import queue
+import re
+import shutil
+import signal
+import socket
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterator, NamedTuple
+
+# Optional receipt compressions (ESCPOS_RECEIPT_COMPRESSION), when their modules are installed
+try:
+    import brotli  # python3-brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard  # python3-zstandard
+except ImportError:
+    zstandard = None
+# Optional production web server (ESCPOS_WEB_SERVER=gunicorn)
+try:
+    import gunicorn.app.base  # python3-gunicorn
+except ImportError:
+    gunicorn = None
+
+
+# Shared by all the connections (and the web app) to serialize the writes in the conversion log
+conversion_log_lock = threading.Lock()
 
 
 #Network ESC/pos printer server
@@ -23,29 +65,1246 @@ class ESCPOSServer(socketserver.TCPServer):
         return super().handle_timeout()
 
 
+#Concurrent network ESC/pos printer server
+class ThreadedESCPOSServer(socketserver.ThreadingMixIn, ESCPOSServer):
+    """
+        Serve each connection in its own thread, with at most max_connections at the same time.
+        When all the connection slots are taken, the next connections wait in the listen queue.
+    """
+    DEFAULT_MAX_CONNECTIONS = 16
+    daemon_threads = True  # Do not wait for the connections in progress when stopping
+    request_queue_size = 64  # Let a whole store's worth of POS terminals wait for a slot
+
+    def __init__(self, server_address, RequestHandlerClass, max_connections:int = DEFAULT_MAX_CONNECTIONS, bind_and_activate:bool = True):
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+    def process_request(self, request, client_address) -> None:
+        # Wait for a free connection slot before starting the thread
+        self.connection_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except:
+            self.connection_slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
+
+
+
+#Print job accumulation buffer
+class JobSpool:
+    """
+        Accumulate the data of one print job in linear time.
+        The data stays in memory up to max_memory bytes, then spills to a temporary file in web/tmp.
+    """
+    DEFAULT_MAX_MEMORY = 1048576  # 1 MiB
+
+    def __init__(self, max_memory:int = DEFAULT_MAX_MEMORY):
+        self.spool = tempfile.SpooledTemporaryFile(max_size=max_memory, mode='w+b', dir=PurePath('web', 'tmp'))
+        self.size:int = 0
+
+    def __enter__(self) -> 'JobSpool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, data:bytes) -> None:
+        """Append data at the end of the job
+
+        Args:
+            data (bytes): the data to append
+        """        
+        self.spool.write(data)
+        self.size = self.size + len(data)
+
+    def getvalue(self) -> bytes:
+        """Read back the whole job (for debugging:  this makes a copy in memory)
+
+        Returns:
+            bytes: the job data
+        """        
+        self.spool.seek(0)
+        data:bytes = self.spool.read()
+        self.spool.seek(0, os.SEEK_END)
+        return data
+
+    def save(self, destination:BufferedWriter) -> None:
+        """Copy the whole job in a file
+
+        Args:
+            destination (BufferedWriter): the destination file
+        """        
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, destination)
+        self.spool.seek(0, os.SEEK_END)
+
+    def truncate(self, size:int) -> None:
+        """Forget everything appended after the first size bytes
+
+        Args:
+            size (int): the size to go back to
+        """        
+        self.spool.seek(size)
+        self.spool.truncate()
+        self.size = size
+
+    def close(self) -> None:
+        self.spool.close()
+
+
+#Directory of the published receipts
+class ReceiptCatalog:
+    """
+        The receipt directory, in a SQLite database:  the IDs are allocated by the database, 
+        and a receipt is found by its ID or listed by date without reading the whole directory.
+        The database is in WAL mode, so the web app reads it while the receipts are published.
+        Each thread gets its own connection, and so does each process:  the web workers of gunicorn share the catalog with the print services.
+    """
+    DEFAULT_PATH = PurePath('web', 'receipts.db')
+    LEGACY_DIRECTORY = PurePath('web', 'receipt_list.csv')
+    # The statements that bring the catalog to each version (PRAGMA user_version)
+    MIGRATIONS:list[list[str]] = [
+        # 1: the receipts
+        ["""CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL UNIQUE,
+                received_at TEXT NOT NULL,
+                source TEXT NOT NULL
+            )""",
+         "CREATE INDEX IF NOT EXISTS receipts_received_at ON receipts (received_at)",
+         "CREATE INDEX IF NOT EXISTS receipts_source ON receipts (source, received_at)"],
+        # 2: the receipts published from now on already have their title, page wrapper and footer
+        ["ALTER TABLE receipts ADD COLUMN finalized INTEGER NOT NULL DEFAULT 0"],
+        # 3: the validator of each receipt file, and a version of the catalog that changes with each receipt added, changed or removed
+        ["ALTER TABLE receipts ADD COLUMN etag TEXT",
+         "CREATE TABLE IF NOT EXISTS catalog_version (version INTEGER NOT NULL)",
+         "INSERT INTO catalog_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version)",
+         "CREATE TRIGGER IF NOT EXISTS receipts_inserted AFTER INSERT ON receipts BEGIN UPDATE catalog_version SET version = version + 1; END",
+         "CREATE TRIGGER IF NOT EXISTS receipts_updated AFTER UPDATE OF filename, received_at, source ON receipts BEGIN UPDATE catalog_version SET version = version + 1; END",
+         "CREATE TRIGGER IF NOT EXISTS receipts_deleted AFTER DELETE ON receipts BEGIN UPDATE catalog_version SET version = version + 1; END"],
+        # 4: the compressed variants the receipt is stored as (receipt<time>.html.gz, ...), or '' if it is stored as it is
+        ["ALTER TABLE receipts ADD COLUMN encodings TEXT NOT NULL DEFAULT ''"],
+        # 5: the receipts that link to the shared stylesheet instead of inlining it
+        ["ALTER TABLE receipts ADD COLUMN linked_stylesheet INTEGER NOT NULL DEFAULT 0"],
+        # 6: the bytes stored for each receipt (NULL until measured), and the files of the receipts removed from the catalog but not yet deleted
+        ["ALTER TABLE receipts ADD COLUMN size INTEGER",
+         """CREATE TABLE IF NOT EXISTS pending_deletions (
+                filename TEXT NOT NULL,
+                received_at TEXT NOT NULL,
+                encodings TEXT NOT NULL
+            )"""],
+        # 7: where each archived receipt is in the archive segments (web/archive/receipts-<n>.tar), as a gzip member
+        ["ALTER TABLE receipts ADD COLUMN archive_segment INTEGER",
+         "ALTER TABLE receipts ADD COLUMN archive_offset INTEGER",
+         "ALTER TABLE receipts ADD COLUMN archive_length INTEGER",
+         "CREATE INDEX IF NOT EXISTS receipts_archive_segment ON receipts (archive_segment)",
+         "ALTER TABLE pending_deletions ADD COLUMN archive_segment INTEGER"],
+        # 8: the virtual printer that received each JetDirect receipt (ESCPOS_PRINTERS), NULL for the other sources and the previous versions
+        ["ALTER TABLE receipts ADD COLUMN printer TEXT",
+         "CREATE INDEX IF NOT EXISTS receipts_printer ON receipts (printer, id)"],
+    ]
+
+    def __init__(self, path:PurePath = DEFAULT_PATH):
+        self.path = path
+        self.connections = threading.local()
+        self.schema_ready:bool = False  # The schema is checked by the first connection only
+
+    def connection(self) -> sqlite3.Connection:
+        """ Get this thread's connection to the catalog, and create the catalog if needed
+
+        Returns:
+            sqlite3.Connection: the connection, in autocommit mode
+        """        
+        db:sqlite3.Connection|None = getattr(self.connections, 'db', None)
+        if db is None or self.connections.pid != os.getpid():
+            # A connection is never used by a forked process
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            if not self.schema_ready:
+                db.execute("PRAGMA journal_mode=WAL")  # WAL mode is kept in the database file
+                self.migrate(db)
+                self.schema_ready = True
+            self.connections.db = db
+            self.connections.pid = os.getpid()
+        return db
+
+    def migrate(self, db:sqlite3.Connection) -> None:
+        # Bring the catalog to the last version, in one transaction so two processes never migrate at the same time
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            version:int = db.execute("PRAGMA user_version").fetchone()[0]
+            for number, statements in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {number}")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def add(self, filename:str, heureRecept:datetime, source:str = "JetDirect", etag:str|None = None, encodings:str = '', 
+            linked_stylesheet:bool = False, size:int|None = None, printer:str|None = None) -> int:
+        """ Add a published receipt
+
+        Args:
+            filename (str): the receipt's file in web/receipts
+            heureRecept (datetime): the reception time
+            source (str): where the print comes from (JetDirect, CUPS or LPD)
+            etag (str|None): the validator of the receipt's file (see receipt_etag)
+            encodings (str): the compressed variants the receipt is stored as, separated by commas, or '' if it is stored as it is
+            linked_stylesheet (bool): True if the receipt links to the shared stylesheet instead of inlining it
+            size (int|None): the bytes stored for the receipt, or None if unknown
+            printer (str|None): the name of the virtual printer that received the print, or None
+
+        Returns:
+            int: the receipt's ID
+        """        
+        cursor = self.connection().execute("""INSERT INTO receipts (filename, received_at, source, finalized, etag, encodings, linked_stylesheet, size, printer) 
+                                              VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)""",
+                                           (filename, heureRecept.isoformat(), source, etag, encodings, int(linked_stylesheet), size, printer))
+        return cursor.lastrowid
+
+    def flat_receipts(self, after:int = 0, limit:int = 100) -> list[sqlite3.Row]:
+        """ List the receipts still stored in the flat layout (web/receipts/<filename>), in the order of their IDs
+
+        Args:
+            after (int): list the receipts after this ID
+            limit (int): the maximum number of receipts
+
+        Returns:
+            list[sqlite3.Row]: the id, filename, received_at and encodings of each receipt
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("SELECT id, filename, received_at, encodings FROM receipts WHERE instr(filename, '/') = 0 AND archive_segment IS NULL AND id > ? ORDER BY id LIMIT ?", 
+                              (after, limit)).fetchall()
+
+    def set_filename(self, fileID:int, filename:str) -> None:
+        self.connection().execute("UPDATE receipts SET filename = ? WHERE id = ?", (filename, fileID))
+
+    def set_etag(self, fileID:int, etag:str) -> None:
+        # For the receipts imported without a validator, computed the first time they are shown
+        self.connection().execute("UPDATE receipts SET etag = ? WHERE id = ?", (etag, fileID))
+
+    def receipt(self, fileID:int) -> sqlite3.Row|None:
+        """ Find a receipt by its ID
+
+        Args:
+            fileID (int): the receipt's ID
+
+        Returns:
+            sqlite3.Row|None: the receipt's filename in web/receipts, if it is finalized, its etag, its received_at time, 
+                              its stored encodings and its place in the archive (archive_segment is None if it is not archived), 
+                              or None if there is no such receipt
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("""SELECT filename, finalized, etag, received_at, encodings, archive_segment, archive_offset, archive_length 
+                                 FROM receipts WHERE id = ?""", (fileID,)).fetchone()
+
+    def inline_stylesheets(self, after:int = 0, limit:int = 100) -> list[sqlite3.Row]:
+        """ List the receipts that still inline the stylesheet, in the order of their IDs
+
+        Args:
+            after (int): list the receipts after this ID
+            limit (int): the maximum number of receipts
+
+        Returns:
+            list[sqlite3.Row]: the id, filename, received_at and encodings of each receipt
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("SELECT id, filename, received_at, encodings FROM receipts WHERE linked_stylesheet = 0 AND archive_segment IS NULL AND id > ? ORDER BY id LIMIT ?", 
+                              (after, limit)).fetchall()
+
+    def set_linked_stylesheet(self, fileID:int, etag:str|None, size:int|None) -> None:
+        # The receipt file was rewritten:  it has a new validator and a new size
+        self.connection().execute("UPDATE receipts SET linked_stylesheet = 1, etag = coalesce(?, etag), size = coalesce(?, size) WHERE id = ?", 
+                                  (etag, size, fileID))
+
+    def page(self, before:int|None = None, limit:int = 50, printer:str|None = None) -> list[sqlite3.Row]:
+        """ List one page of receipts, the most recent first.  The page is read from the primary key, 
+            or from the printer's index, so its cost does not depend on the number of receipts.
+
+        Args:
+            before (int|None): list the receipts older than this ID, or the most recent ones if None
+            limit (int): the maximum number of receipts
+            printer (str|None): list only the receipts of this virtual printer, or the receipts of all the sources if None
+
+        Returns:
+            list[sqlite3.Row]: the id, filename, received_at, source and printer of each receipt
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        conditions:list[str] = []
+        parameters:list = []
+        if printer is not None:
+            conditions.append("printer = ?")
+            parameters.append(printer)
+        if before is not None:
+            conditions.append("id < ?")
+            parameters.append(before)
+        where:str = '' if not conditions else 'WHERE ' + ' AND '.join(conditions)
+        return cursor.execute(f"SELECT id, filename, received_at, source, printer FROM receipts {where} ORDER BY id DESC LIMIT ?", 
+                              (*parameters, limit)).fetchall()
+
+    def count(self) -> int:
+        return self.connection().execute("SELECT count(*) FROM receipts").fetchone()[0]
+
+    def totals(self) -> tuple[int, int]:
+        # The number of receipts and the bytes stored for them (the receipts not yet measured count for nothing)
+        count, size = self.connection().execute("SELECT count(*), coalesce(sum(size), 0) FROM receipts").fetchone()
+        return count, size
+
+    def unmeasured(self, limit:int = 100) -> list[sqlite3.Row]:
+        # The receipts stored without their size, by the previous versions
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("SELECT id, filename, received_at, encodings FROM receipts WHERE size IS NULL AND archive_segment IS NULL ORDER BY id LIMIT ?", 
+                              (limit,)).fetchall()
+
+    def set_size(self, fileID:int, size:int) -> None:
+        self.connection().execute("UPDATE receipts SET size = ? WHERE id = ?", (size, fileID))
+
+    def oldest(self, limit:int = 100, received_before:datetime|None = None) -> list[sqlite3.Row]:
+        """ List the oldest receipts
+
+        Args:
+            limit (int): the maximum number of receipts
+            received_before (datetime|None): only list the receipts received before this time
+
+        Returns:
+            list[sqlite3.Row]: the id and size of each receipt, the oldest first
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        if received_before is None:
+            return cursor.execute("SELECT id, size FROM receipts ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return cursor.execute("SELECT id, size FROM receipts WHERE received_at < ? ORDER BY id LIMIT ?", 
+                              (received_before.isoformat(), limit)).fetchall()
+
+    def delete(self, fileIDs:list[int]) -> None:
+        """ Remove receipts from the catalog, and keep their files in pending_deletions until they are deleted:  
+            in one transaction, so a receipt is never listed without its files, and its files are never forgotten
+
+        Args:
+            fileIDs (list[int]): the receipts' IDs
+        """        
+        db = self.connection()
+        placeholders = ','.join('?' * len(fileIDs))
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(f"""INSERT INTO pending_deletions (filename, received_at, encodings, archive_segment) 
+                           SELECT filename, received_at, encodings, archive_segment FROM receipts WHERE id IN ({placeholders})""", 
+                       fileIDs)
+            db.execute(f"DELETE FROM receipts WHERE id IN ({placeholders})", fileIDs)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def pending_deletions(self) -> list[sqlite3.Row]:
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("SELECT rowid, filename, received_at, encodings, archive_segment FROM pending_deletions").fetchall()
+
+    def forget_deletion(self, rowid:int) -> None:
+        # The files of the receipt are deleted
+        self.connection().execute("DELETE FROM pending_deletions WHERE rowid = ?", (rowid,))
+
+    def archivable(self, received_before:datetime, after:int = 0, limit:int = 100) -> list[sqlite3.Row]:
+        """ List the receipts not yet archived that were received before a time, in the order of their IDs
+
+        Args:
+            received_before (datetime): only list the receipts received before this time
+            after (int): list the receipts after this ID
+            limit (int): the maximum number of receipts
+
+        Returns:
+            list[sqlite3.Row]: the id, filename, received_at, encodings, etag and finalized of each receipt
+        """        
+        cursor = self.connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("""SELECT id, filename, received_at, encodings, etag, finalized FROM receipts 
+                                 WHERE archive_segment IS NULL AND received_at < ? AND id > ? ORDER BY id LIMIT ?""", 
+                              (received_before.isoformat(), after, limit)).fetchall()
+
+    def set_archived(self, members:list[tuple[int, int, int, int, str]]) -> None:
+        """ Record where receipts are in the archive, and keep their previous files in pending_deletions until they are deleted:  
+            in one transaction, like delete.  An archived receipt is stored as gzip, and keeps its ID.
+
+        Args:
+            members (list[tuple[int, int, int, int, str]]): the ID, segment, offset, length and etag of each receipt
+        """        
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("""INSERT INTO pending_deletions (filename, received_at, encodings) 
+                              SELECT filename, received_at, encodings FROM receipts WHERE id = ?""", 
+                           [(member[0],) for member in members])
+            db.executemany("""UPDATE receipts SET archive_segment = ?, archive_offset = ?, archive_length = ?, size = ?, 
+                                                  encodings = 'gzip', etag = ? WHERE id = ?""",
+                           [(segment, offset, length, length, etag, fileID) for fileID, segment, offset, length, etag in members])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def archive_end(self) -> tuple[int|None, int]:
+        # The last archive segment, and the end of its last receipt:  what is after was not recorded, and is written over
+        segment, end = self.connection().execute("""SELECT archive_segment, max(archive_offset + archive_length) FROM receipts 
+                                                    WHERE archive_segment = (SELECT max(archive_segment) FROM receipts)""").fetchone()
+        return segment, end or 0
+
+    def segment_in_use(self, segment:int) -> bool:
+        return self.connection().execute("SELECT 1 FROM receipts WHERE archive_segment = ? LIMIT 1", (segment,)).fetchone() is not None
+
+    def version(self) -> int:
+        # Changes each time a receipt is added, changed or removed (see the triggers of migration 3)
+        return self.connection().execute("SELECT version FROM catalog_version").fetchone()[0]
+
+    def import_legacy_directory(self, receipts_directory:PurePath = PurePath('web', 'receipts')) -> int:
+        """ Import the receipts of the CSV directory (web/receipt_list.csv) with their IDs, 
+            then the receipt files that are in no directory.  Only done when the catalog is empty.
+
+        Args:
+            receipts_directory (PurePath): where the receipt files are
+
+        Returns:
+            int: the number of receipts imported
+        """        
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if self.count() > 0:
+                db.execute("COMMIT")
+                return 0
+
+            imported:int = 0
+            try:
+                with open(self.LEGACY_DIRECTORY, mode='r') as fileDirectory:
+                    for row in csv.reader(fileDirectory):
+                        if row[0] == 'next_fileID':
+                            continue # Skip the header
+                        db.execute("INSERT OR IGNORE INTO receipts (id, filename, received_at, source) VALUES (?, ?, ?, ?)",
+                                   (int(row[0]), row[1], self.legacy_reception_time(receipts_directory, row[1]), "JetDirect"))
+                        imported = imported + 1
+            except FileNotFoundError:
+                pass  # No CSV directory, only the files
+
+            # The receipt files missing from the CSV directory get new IDs, in the order they were received
+            known = {row[0] for row in db.execute("SELECT filename FROM receipts")}
+            orphans = [name for name in os.listdir(receipts_directory) if name.endswith('.html') and name not in known]
+            for name in sorted(orphans, key=lambda name: self.legacy_reception_time(receipts_directory, name)):
+                db.execute("INSERT INTO receipts (filename, received_at, source) VALUES (?, ?, ?)",
+                           (name, self.legacy_reception_time(receipts_directory, name), "JetDirect"))
+                imported = imported + 1
+
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if imported > 0:
+            print(f"{imported} receipts imported in the catalog", flush=True)
+        return imported
+
+    @staticmethod
+    def dated_filename(name:str, received_at:datetime) -> str:
+        # The receipts are stored by reception date:  web/receipts/YYYY/MM/DD/<name>
+        return '{:%Y/%m/%d}/{}'.format(received_at, name)
+
+    def move_to_dated_layout(self, batch:int = 100) -> int:
+        """ Move the receipts of the flat layout to the dated layout, a batch at a time, so the server keeps running meanwhile.  
+            Each file is linked at its new place before the catalog is updated, and removed from its old place after, 
+            so the receipt is always where the catalog says.
+
+        Args:
+            batch (int): the number of receipts listed at a time
+
+        Returns:
+            int: the number of receipts moved
+        """        
+        moved:int = 0
+        last_id:int = 0
+        while (receipts := self.flat_receipts(last_id, batch)):
+            for receipt in receipts:
+                last_id = receipt['id']
+                encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+                dated = self.dated_filename(receipt['filename'], datetime.fromisoformat(receipt['received_at']))
+                moves = list(zip(stored_receipt_files(receipt['filename'], encodings), stored_receipt_files(dated, encodings)))
+                try:
+                    os.makedirs(moves[0][1].parent, exist_ok=True)
+                    for old_file, new_file in moves:
+                        try:
+                            os.link(old_file, new_file)
+                        except FileExistsError:
+                            pass  # Linked before an interruption
+                    self.set_filename(receipt['id'], dated)
+                    for old_file, new_file in moves:
+                        os.remove(old_file)
+                    moved = moved + 1
+                except OSError as err:
+                    # Left in the flat layout, where it is still found
+                    print(f"Receipt {receipt['filename']} not moved: {err}", flush=True)
+        return moved
+
+    @staticmethod
+    def legacy_reception_time(receipts_directory:PurePath, filename:str) -> str:
+        # The receipt files are named after their reception time:  receipt<ISO time>.html
+        try:
+            return datetime.fromisoformat(filename.removeprefix('receipt').removesuffix('.html')).isoformat()
+        except ValueError:
+            # Otherwise, use the time the file was written
+            return datetime.fromtimestamp(os.path.getmtime(receipts_directory.joinpath(filename)), tz=ZoneInfo(myconsts.UTC_ZONE)).isoformat()
+
+
+receipt_catalog = ReceiptCatalog()
+
+
+#Long tasks on the stored receipts, in the background
+class StorageMaintenance:
+    """
+        Runs the tasks that go through the stored receipts (the migrations of the storage) in one background thread, 
+        one task after the other, so two tasks never work on the same receipt at the same time.
+        Each task holds a lock on web/storage-maintenance.lock, so the tasks of the other processes wait for it too.
+    """
+    LOCK_FILE = PurePath('web', 'storage-maintenance.lock')
+
+    def __init__(self):
+        self.tasks:queue.Queue = queue.Queue()
+        self.thread:threading.Thread|None = None
+        self.start_lock = threading.Lock()
+
+    def submit(self, task:Callable[[], object], report:str|None = None) -> Future:
+        """ Run a task after the ones already submitted
+
+        Args:
+            task (Callable[[], object]): the task
+            report (str|None): for a task that returns the number of receipts it changed, printed with this number 
+                               when it is not 0, e.g. "{} receipts moved"
+
+        Returns:
+            Future: what the task returns
+        """        
+        future:Future = Future()
+        self.tasks.put((task, report, future))
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="storage-maintenance", daemon=True)
+                self.thread.start()
+        return future
+
+    def run(self) -> None:
+        while True:
+            task, report, future = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with open(self.LOCK_FILE, mode='a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)  # Released when the lock file is closed
+                    result = task()
+            except Exception as err:
+                print(f"Storage maintenance failed: {err}", flush=True)
+                future.set_exception(err)
+            else:
+                if report is not None and result:
+                    print(report.format(result), flush=True)
+                future.set_result(result)
+
+    def repeat(self, task:Callable[[], object], interval:float, name:str) -> threading.Thread:
+        """ Run a task every interval seconds, in a daemon thread that waits for each run, 
+            so the runs never pile up behind a long migration
+
+        Args:
+            task (Callable[[], object]): the task
+            interval (float): the seconds between the end of a run and the next one
+            name (str): the name of the thread
+
+        Returns:
+            threading.Thread: the thread, started
+        """        
+        def run_forever() -> None:
+            while True:
+                try:
+                    self.submit(task).result()
+                except Exception:
+                    pass  # Reported by run, tried again at the next run
+                time.sleep(interval)
+        thread = threading.Thread(target=run_forever, name=name, daemon=True)
+        thread.start()
+        return thread
+
+
+storage_maintenance = StorageMaintenance()
+
+
+def receipt_etag(page:bytes) -> str:
+    # A strong validator for a receipt file:  the files never change once published, so their content hash identifies them
+    return hashlib.sha256(page).hexdigest()[:32]
+
+
+RECEIPTS_DIRECTORY = PurePath('web', 'receipts')
+
+#How a receipt can be stored compressed, and sent as it is stored to the clients that accept the encoding
+class ReceiptEncoding(NamedTuple):
+    compress:Callable[[bytes], bytes]
+    decompress:Callable[[bytes], bytes]
+
+RECEIPT_ENCODINGS:dict[str, ReceiptEncoding] = {
+    # mtime=0:  the same receipt always gives the same file
+    'gzip': ReceiptEncoding(lambda page: gzip.compress(page, compresslevel=9, mtime=0), gzip.decompress),
+}
+if brotli is not None:
+    RECEIPT_ENCODINGS['br'] = ReceiptEncoding(lambda page: brotli.compress(page, quality=11), brotli.decompress)
+if zstandard is not None:
+    RECEIPT_ENCODINGS['zstd'] = ReceiptEncoding(lambda page: zstandard.ZstdCompressor(level=19).compress(page), 
+                                                lambda data: zstandard.ZstdDecompressor().decompress(data))
+# When a client accepts several encodings as much, send the smallest
+RECEIPT_ENCODING_PREFERENCE:list[str] = ['br', 'zstd', 'gzip']
+# The suffixes added to the receipt's filename for its stored variants, known even when the module of the encoding is not installed
+RECEIPT_ENCODING_SUFFIXES:dict[str, str] = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+
+def stored_receipt_files(filename:str, encodings:list[str]) -> list[PurePath]:
+    """ The files of a receipt:  the receipt as it is, or its compressed variants
+
+    Args:
+        filename (str): the receipt's filename in web/receipts, as in the catalog
+        encodings (list[str]): the encodings the receipt is stored as (gzip first), or [] if it is stored as it is
+
+    Returns:
+        list[PurePath]: the files, in the order of the encodings
+    """    
+    if not encodings:
+        return [RECEIPTS_DIRECTORY.joinpath(filename)]
+    return [RECEIPTS_DIRECTORY.joinpath(filename + RECEIPT_ENCODING_SUFFIXES[encoding]) for encoding in encodings]
+
+
+def locate_receipt(filename:str, received_at:str, encodings:list[str]) -> str:
+    """ Find where a receipt is stored:  where the catalog says, or else in the other layout, 
+        in case the receipt was moved between the flat and the dated layouts without the catalog
+
+    Args:
+        filename (str): the receipt's filename in web/receipts, as in the catalog
+        received_at (str): the reception time, in ISO format
+        encodings (list[str]): the encodings the receipt is stored as
+
+    Returns:
+        str: the receipt's filename in web/receipts
+    """    
+    if os.path.exists(stored_receipt_files(filename, encodings)[0]):
+        return filename
+    name = PurePath(filename).name
+    other = name if filename != name else ReceiptCatalog.dated_filename(name, datetime.fromisoformat(received_at))
+    return other if os.path.exists(stored_receipt_files(other, encodings)[0]) else filename
+
+
+def delete_pending_files(catalog:'ReceiptCatalog') -> int:
+    """ Delete the files the catalog no longer refers to (see pending_deletions):  the files of the deleted or archived receipts, 
+        the dated directories left empty, and the archive segments left without receipts
+
+    Args:
+        catalog (ReceiptCatalog): the catalog of the receipts
+
+    Returns:
+        int: the bytes reclaimed
+    """    
+    reclaimed:int = 0
+    for receipt in catalog.pending_deletions():
+        encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+        for receipt_file in stored_receipt_files(locate_receipt(receipt['filename'], receipt['received_at'], encodings), encodings):
+            try:
+                reclaimed = reclaimed + os.path.getsize(receipt_file)
+                os.remove(receipt_file)
+            except FileNotFoundError:
+                pass  # Already deleted, or archived
+        directory = stored_receipt_files(receipt['filename'], encodings)[0].parent
+        while directory != RECEIPTS_DIRECTORY:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break  # Not empty
+            directory = directory.parent
+        if receipt['archive_segment'] is not None and not catalog.segment_in_use(receipt['archive_segment']):
+            reclaimed = reclaimed + ReceiptArchive.remove_segment(receipt['archive_segment'])
+        catalog.forget_deletion(receipt['rowid'])
+    return reclaimed
+
+
+#Images of the receipts, stored once whatever the number of receipts that show them
+class ImageStore:
+    """
+        esc2html.php puts the images (logos, QR codes, barcodes) in the receipts as base64 data URLs.  
+        When the receipts are published, the store writes each image in web/images, named after the hash of its content, 
+        and the receipt links to it at /image/<name>:  the same logo in every receipt is one file, sent once to each browser.
+    """
+    DIRECTORY = PurePath('web', 'images')
+    URL_PATH = '/image/'
+    # src="data:image/<type>;base64,<data>" as written by esc2html.php
+    DATA_URL_SEARCH:re.Pattern = re.compile(r'src="data:image/(png|jpeg|gif|svg\+xml);base64,([A-Za-z0-9+/=]+)"')
+    EXTENSIONS:dict[str, str] = {'png': 'png', 'jpeg': 'jpg', 'gif': 'gif', 'svg+xml': 'svg'}
+    # The names of the stored images:  <sha256>.<extension>
+    NAME_MATCH:re.Pattern = re.compile(r'[0-9a-f]{64}\.(png|jpg|gif|svg)')
+
+    def __init__(self, directory:PurePath = DIRECTORY):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def extract(self, recu:str) -> str:
+        """ Store the images of a receipt, and replace them by links to the stored images
+
+        Args:
+            recu (str): the receipt in HTML, with its images as data URLs
+
+        Returns:
+            str: the receipt, with links to /image/<name>
+        """        
+        return self.DATA_URL_SEARCH.sub(self.store_image, recu)
+
+    def store_image(self, data_url:re.Match) -> str:
+        image:bytes = base64.b64decode(data_url.group(2))
+        name = '{}.{}'.format(hashlib.sha256(image).hexdigest(), self.EXTENSIONS[data_url.group(1)])
+        image_file = self.directory.joinpath(name)
+        if not os.path.exists(image_file):
+            # Write a temporary file and rename it, so a concurrent publication or the web app never sees a partial image
+            temporary_file = self.directory.joinpath(f'.{name}.{os.getpid()}.{threading.get_ident()}')
+            with open(temporary_file, mode='wb') as newImage:
+                newImage.write(image)
+            os.replace(temporary_file, image_file)
+        return 'src="{}{}"'.format(self.URL_PATH, name)
+
+
+#Stylesheet of the receipts, shared instead of inlined in each receipt
+class ReceiptStylesheet:
+    """
+        esc2html.php inlines src/resources/esc2html.css in each receipt.  With ESCPOS_STYLESHEET=linked, 
+        the receipts link to /style/esc2html.<version>.css instead, where the version is the hash of the stylesheet:  
+        the browsers keep it for good, and a new stylesheet gets a new URL.
+    """
+    FILE = PurePath('src', 'resources', 'esc2html.css')
+    # The stylesheet inlined by esc2html.php:  the first <style> block of the head, with the esc- classes
+    INLINE_SEARCH:re.Pattern = re.compile(r'<style>(?:(?!</style>).)*?\.esc-.*?</style>', re.DOTALL)
+
+    def __init__(self, file:PurePath = FILE):
+        self.file = file
+        with open(self.file, mode='rb') as stylesheet:
+            self.version:str = hashlib.sha256(stylesheet.read()).hexdigest()[:12]
+        self.href = '/style/esc2html.{}.css'.format(self.version)
+
+    def link(self, recu:str) -> str:
+        """ Replace the inlined stylesheet of a receipt by a link to the shared stylesheet
+
+        Args:
+            recu (str): the receipt in HTML
+
+        Returns:
+            str: the receipt, as it was if it does not inline the stylesheet
+        """        
+        style = self.INLINE_SEARCH.search(recu, 0, max(recu.find('</head>'), 0))
+        if style is None:
+            return recu
+        return ''.join([recu[:style.start()], '<link rel="stylesheet" href="{}">'.format(self.href), recu[style.end():]])
+
+    def link_stored_receipts(self, catalog:'ReceiptCatalog', batch:int = 100) -> int:
+        """ Remove the inlined stylesheet from the receipts already stored, a batch at a time, so the server keeps running meanwhile
+
+        Args:
+            catalog (ReceiptCatalog): the catalog of the receipts
+            batch (int): the number of receipts listed at a time
+
+        Returns:
+            int: the number of receipt files rewritten
+        """        
+        rewritten:int = 0
+        last_id:int = 0
+        while (receipts := catalog.inline_stylesheets(last_id, batch)):
+            for receipt in receipts:
+                last_id = receipt['id']
+                encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+                filename = locate_receipt(receipt['filename'], receipt['received_at'], encodings)
+                try:
+                    with open(stored_receipt_files(filename, encodings)[0], mode='rb') as stored:
+                        page = stored.read() if not encodings else RECEIPT_ENCODINGS[encodings[0]].decompress(stored.read())
+                    linked = self.link(page.decode('utf-8')).encode('utf-8')
+                    etag:str|None = None
+                    size:int|None = None
+                    if linked != page:
+                        _, size = ESCPOSHandler.write_receipt(filename, linked, encodings)
+                        etag = receipt_etag(linked)
+                        rewritten = rewritten + 1
+                    catalog.set_linked_stylesheet(receipt['id'], etag, size)
+                except (OSError, UnicodeDecodeError, KeyError) as err:
+                    # Left as it is:  the receipt still shows with its own stylesheet
+                    print(f"Stylesheet of {receipt['filename']} not linked: {err}", flush=True)
+        return rewritten
+
+
+#Budgets of the receipt storage
+class RetentionPolicy(NamedTuple):
+    max_age_days:float = 0  # Delete the receipts older than this.  0:  no limit
+    max_receipts:int = 0  # Keep at most this number of receipts.  0:  no limit
+    max_bytes:int = 0  # Keep at most this number of bytes of receipts.  0:  no limit
+    log_max_bytes:int = 0  # Start a new conversion log when it is larger than this.  0:  no limit
+
+
+#Deletion of the oldest receipts, within the budgets of a retention policy
+class ReceiptRetention:
+    """
+        Deletes the oldest receipts when they are older than the policy's age, more than its number of receipts 
+        or larger than its bytes, and starts a new conversion log (web/tmp/esc2html_log.1 keeps the previous one) 
+        when it is larger than the policy's log size.
+        Each tick deletes at most batch receipts, so the pruning is spread across ticks in the storage maintenance thread.
+    """
+    LOG_FILE = PurePath('web', 'tmp', 'esc2html_log')
+
+    def __init__(self, catalog:'ReceiptCatalog', policy:RetentionPolicy, batch:int = 100):
+        self.catalog = catalog
+        self.policy = policy
+        self.batch = batch
+        self.deleted_total:int = 0  # Since the start
+        self.reclaimed_total:int = 0  # Bytes, since the start
+        self.reclaimed:int = 0  # Bytes, by the last tick
+
+    def tick(self) -> int:
+        """ Delete at most one batch of receipts beyond the budgets, and rotate the conversion log if needed
+
+        Returns:
+            int: the number of receipts deleted
+        """        
+        # The files left by an interrupted tick first
+        self.reclaimed = self.delete_pending()
+        if self.policy.max_bytes > 0:
+            self.measure()
+        expired = self.expired()
+        if expired:
+            self.catalog.delete(expired)
+            self.reclaimed = self.reclaimed + self.delete_pending()
+        self.reclaimed = self.reclaimed + self.rotate_log()
+
+        self.deleted_total = self.deleted_total + len(expired)
+        self.reclaimed_total = self.reclaimed_total + self.reclaimed
+        if expired or self.reclaimed > 0:
+            print(f"Retention: {len(expired)} receipts deleted, {self.reclaimed} bytes reclaimed", flush=True)
+        return len(expired)
+
+    def prune(self) -> tuple[int, int]:
+        """ Delete the receipts beyond the budgets, one batch after the other, until the receipts are within the budgets
+
+        Returns:
+            tuple[int, int]: the number of receipts deleted, and the bytes reclaimed
+        """        
+        deleted:int = self.tick()
+        reclaimed:int = self.reclaimed
+        while (batch_deleted := self.tick()) > 0:
+            deleted = deleted + batch_deleted
+            reclaimed = reclaimed + self.reclaimed
+        return deleted, reclaimed + self.reclaimed
+
+    def expired(self) -> list[int]:
+        # The oldest receipts beyond one of the budgets, at most one batch
+        expired:set[int] = set()
+        if self.policy.max_age_days > 0:
+            received_before = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE)) - timedelta(days=self.policy.max_age_days)
+            expired.update(receipt['id'] for receipt in self.catalog.oldest(self.batch, received_before))
+        count, size = self.catalog.totals()
+        if 0 < self.policy.max_receipts < count:
+            expired.update(receipt['id'] for receipt in self.catalog.oldest(min(self.batch, count - self.policy.max_receipts)))
+        if 0 < self.policy.max_bytes < size:
+            excess:int = size - self.policy.max_bytes
+            for receipt in self.catalog.oldest(self.batch):
+                if excess <= 0:
+                    break
+                expired.add(receipt['id'])
+                excess = excess - (receipt['size'] or 0)
+        return sorted(expired)[:self.batch]
+
+    def measure(self) -> None:
+        # Measure a batch of the receipts stored without their size, for the bytes budget
+        for receipt in self.catalog.unmeasured(self.batch):
+            size:int = 0
+            encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+            for receipt_file in stored_receipt_files(locate_receipt(receipt['filename'], receipt['received_at'], encodings), encodings):
+                try:
+                    size = size + os.path.getsize(receipt_file)
+                except OSError:
+                    pass  # Already gone
+            self.catalog.set_size(receipt['id'], size)
+
+    def delete_pending(self) -> int:
+        # Delete the files of the receipts removed from the catalog
+        return delete_pending_files(self.catalog)
+
+    def rotate_log(self) -> int:
+        # Start a new conversion log when it is too large:  the previous log replaces the one before it
+        if self.policy.log_max_bytes <= 0:
+            return 0
+        previous_log = self.LOG_FILE.with_name(self.LOG_FILE.name + '.1')
+        with conversion_log_lock:
+            try:
+                if os.path.getsize(self.LOG_FILE) <= self.policy.log_max_bytes:
+                    return 0
+                reclaimed = os.path.getsize(previous_log) if os.path.exists(previous_log) else 0
+                os.replace(self.LOG_FILE, previous_log)
+            except FileNotFoundError:
+                return 0  # No conversion yet
+        return reclaimed
+
+
+#Archive segments of the old receipts
+class ReceiptArchive:
+    """
+        Compacts the receipts older than ESCPOS_ARCHIVE_AFTER_DAYS into large archive segments (web/archive/receipts-<n>.tar), 
+        so the old receipts are a few large files instead of one file per receipt.  Each receipt is a gzip member of a tar segment, 
+        and the catalog keeps its offset and length:  the web app reads the member straight from the segment, without unpacking it, 
+        and sends it as it is to the clients that accept gzip.  The receipts keep their IDs.
+        The segments are only appended to, and a segment is deleted when the retention deleted all its receipts.
+    """
+    DIRECTORY = PurePath('web', 'archive')
+    SEGMENT_NAME = 'receipts-{:06d}.tar'
+    DEFAULT_SEGMENT_BYTES = 256 * 1024 * 1024
+    # The end of a tar file:  two empty blocks
+    END_OF_ARCHIVE = tarfile.NUL * 2 * tarfile.BLOCKSIZE
+
+    def __init__(self, catalog:'ReceiptCatalog', after_days:float, segment_bytes:int = DEFAULT_SEGMENT_BYTES, batch:int = 500):
+        self.catalog = catalog
+        self.after_days = after_days
+        self.segment_bytes = segment_bytes
+        self.batch = batch
+        self.last_id:int = 0  # The receipts up to this ID are archived, or could not be read
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+
+    @classmethod
+    def segment_file(cls, segment:int) -> PurePath:
+        return cls.DIRECTORY.joinpath(cls.SEGMENT_NAME.format(segment))
+
+    @classmethod
+    def read_member(cls, segment:int, offset:int, length:int) -> bytes:
+        """ Read an archived receipt, straight from its place in the segment
+
+        Args:
+            segment (int): the receipt's segment
+            offset (int): where the receipt's gzip member starts in the segment
+            length (int): the member's length
+
+        Returns:
+            bytes: the receipt, compressed with gzip
+        """        
+        with open(cls.segment_file(segment), mode='rb') as archive:
+            archive.seek(offset)
+            return archive.read(length)
+
+    @classmethod
+    def remove_segment(cls, segment:int) -> int:
+        # Delete a segment without receipts, and return its size
+        try:
+            size = os.path.getsize(cls.segment_file(segment))
+            os.remove(cls.segment_file(segment))
+        except FileNotFoundError:
+            return 0  # Already deleted
+        return size
+
+    def tick(self) -> int:
+        """ Archive at most one batch of the receipts older than the archive age.  The segments are synced to the disk 
+            before the catalog records the receipts, and the receipt files are deleted after, so a receipt is always where the catalog says.
+
+        Returns:
+            int: the number of receipts archived
+        """        
+        received_before = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE)) - timedelta(days=self.after_days)
+        receipts = self.catalog.archivable(received_before, self.last_id, self.batch)
+        if not receipts:
+            return 0
+
+        segment, end = self.catalog.archive_end()
+        segment = segment or 1
+        position:int = self.block_end(end)
+        members:list[tuple[int, int, int, int, str]] = []
+        archive:BufferedRandom|None = None
+        try:
+            for receipt in receipts:
+                self.last_id = receipt['id']
+                try:
+                    member, etag = self.archive_member(receipt)
+                except (OSError, KeyError, gzip.BadGzipFile) as err:
+                    # Left as it is:  the receipt is still shown from its file
+                    print(f"Receipt {receipt['filename']} not archived: {err}", flush=True)
+                    continue
+                if archive is None or (position > 0 and position + tarfile.BLOCKSIZE + len(member) > self.segment_bytes):
+                    if archive is not None:
+                        # The segment is full:  continue in the next one
+                        self.close_segment(archive, position)
+                        archive = None
+                        segment, position = segment + 1, 0
+                    archive = self.open_segment(segment)
+                header = tarfile.TarInfo(receipt['filename'] + RECEIPT_ENCODING_SUFFIXES['gzip'])
+                header.size = len(member)
+                header.mtime = int(datetime.fromisoformat(receipt['received_at']).timestamp())
+                header.mode = 0o644
+                archive.seek(position)
+                archive.write(header.tobuf())
+                offset = archive.tell()
+                archive.write(member)
+                position = self.block_end(offset + len(member))
+                archive.write(tarfile.NUL * (position - offset - len(member)))
+                members.append((receipt['id'], segment, offset, len(member), etag))
+        finally:
+            if archive is not None:
+                self.close_segment(archive, position)
+
+        if members:
+            self.catalog.set_archived(members)
+            delete_pending_files(self.catalog)
+            print(f"Archive: {len(members)} receipts archived in {self.segment_file(segment)}", flush=True)
+        return len(members)
+
+    def archive_member(self, receipt:'sqlite3.Row') -> tuple[bytes, str]:
+        # The receipt compressed with gzip, as stored or compressed now, and its validator
+        encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+        with open(stored_receipt_files(locate_receipt(receipt['filename'], receipt['received_at'], encodings), encodings)[0], mode='rb') as stored:
+            data = stored.read()
+        if encodings:
+            return data, receipt['etag'] or receipt_etag(RECEIPT_ENCODINGS['gzip'].decompress(data))  # gzip is always stored first
+        return RECEIPT_ENCODINGS['gzip'].compress(data), receipt['etag'] or receipt_etag(data)
+
+    def open_segment(self, segment:int) -> BufferedRandom:
+        return os.fdopen(os.open(self.segment_file(segment), os.O_RDWR | os.O_CREAT, 0o644), mode='r+b')
+
+    def close_segment(self, archive:BufferedRandom, position:int) -> None:
+        # End the segment after its last receipt, so it is a tar file, and sync it before the catalog refers to it
+        archive.seek(position)
+        archive.write(self.END_OF_ARCHIVE)
+        archive.truncate()
+        archive.flush()
+        os.fsync(archive.fileno())
+        archive.close()
+
+    @staticmethod
+    def block_end(position:int) -> int:
+        # The tar members start on a block
+        return -(-position // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
 
 #Network ESC/pos printer request handling
+#How the JetDirect scanner consumes one command
+class CommandSpec(NamedTuple):
+    """
+        name:  the command, for the logs and the benchmarks
+        arguments:  number of fixed argument bytes after the two command bytes
+        payload:  for commands followed by a length-prefixed payload, computes the payload size from the fixed arguments.  
+                  The payload goes straight to the receive buffer.
+        responder:  name of the handler method that reads the rest of the command, responds to it if needed, and returns the bytes it read
+        streamer:  name of the handler method that gets the command so far, sends it and its data straight to the receive buffer, 
+                   and returns what is left to forward
+        content:  what the command puts on the receipt (graphics, barcode or cut), or None for the settings and the status requests
+        splits:  the receipt boundary the command marks in a stream of receipts:  'cut' ends a receipt after the command, 
+                 'init' starts a new receipt with the command
+    """
+    name:str
+    arguments:int = 0
+    payload:Callable[[bytes], int]|None = None
+    responder:str|None = None
+    streamer:str|None = None
+    content:str|None = None
+    splits:str|None = None
+
+
+def little_endian(size_bytes:bytes) -> int:
+    # The sizes in ESC/POS commands are sent low byte first
+    return int.from_bytes(size_bytes, "little")
+
+
+#One virtual printer of the instance (ESCPOS_PRINTERS)
+class PrinterProfile(NamedTuple):
+    """
+        port:  the JetDirect port of the printer
+        name:  the name of the printer, that tags its receipts in the catalog and answers the model-specific GS I requests
+        paper_width:  the width of the receipts, in mm, also reported by FS ( L and GS ( E
+        maker, model, serial, firmware, font:  the identity strings sent in response to GS I
+    """
+    port:int
+    name:str
+    paper_width:int = 80
+    maker:str = 'ESCPOS-netprinter'
+    model:str = 'ESCPOS-netprinter'
+    serial:str = 'netprinter_1'
+    firmware:str = 'release 2.3'
+    font:str = 'PC850 Multilingual'
+
+    STYLESHEET_PAPER_WIDTH = 80  # The width of .esc-receipt in esc2html.css
+
+    @property
+    def paper_width_dots(self) -> int:
+        # The printable width at 180 DPI:  512 dots for 80 mm paper, like the EPSON TM-T88V
+        return self.paper_width * 512 // 80
+
+
+def configured_printers() -> list[PrinterProfile]:
+    """ Get the virtual printers of ESCPOS_PRINTERS, a JSON list of objects with the fields of PrinterProfile, e.g.
+        [{"port": 9100, "name": "lane-1"}, {"port": 9101, "name": "kitchen", "paper_width": 58, "model": "TM-T20II"}].  
+        Without ESCPOS_PRINTERS, the instance is one printer on PRINTER_PORT.
+
+    Raises:
+        ValueError: ESCPOS_PRINTERS is not a list of printers, or two printers have the same port or name
+
+    Returns:
+        list[PrinterProfile]: the printers, each with its own serial number unless it is given
+    """    
+    declared = getenv('ESCPOS_PRINTERS', "")
+    if not declared:
+        return [PrinterProfile(int(getenv('PRINTER_PORT', '9100')), 'Netprinter')]
+    printers:list[PrinterProfile] = []
+    for number, fields in enumerate(json.loads(declared), start=1):
+        try:
+            printers.append(PrinterProfile(**({'serial': f'netprinter_{number}'} | fields)))
+        except TypeError as err:
+            raise ValueError(f"ESCPOS_PRINTERS: printer {number}: {err}") from err
+    if len({printer.port for printer in printers}) < len(printers) or len({printer.name for printer in printers}) < len(printers):
+        raise ValueError("ESCPOS_PRINTERS: each printer needs its own port and name")
+    return printers
+
+
+# The receipts are shown with the footer at the bottom of the window
+RECEIPT_PAGE_START = '<body style="display: flex;flex-direction: column;min-height: 100vh;"><div id="page" style="flex-grow: 1;">'
+
+
 class ESCPOSHandler(socketserver.StreamRequestHandler):
     
     """
         Voir l'APG Epson section "Processing the Data Received from the Printer"
     """
     timeout = 10  #On abandonne une réception après 10 secondes - un compromis pour assurer que tout passe sans se bourrer de connections zombies.
+    rbufsize = 65536  #Read the socket in large chunks:  the chunked scanner looks for commands directly in this buffer.
     netprinter_debugmode = "false"
+    netprinter_scanmode = "chunked"
+    netprinter_jobsplit = "cut,init"
+    conversion_queue:'ConversionQueue|None' = None  #When set, the received jobs are converted by the queue's workers instead of the connection's thread.
+    php_workers:'PHPWorkerPool|None' = None  #When set, esc2html runs in resident PHP workers instead of a new PHP process per receipt.
+    receipt_encodings:list[str] = []  #When set, the receipts are stored in these compressed encodings instead of as they are (ESCPOS_RECEIPT_COMPRESSION).
+    image_store:'ImageStore|None' = None  #When set, the images of the receipts are stored apart and linked instead of inlined (ESCPOS_IMAGE_STORE).
+    linked_stylesheet:'ReceiptStylesheet|None' = None  #When set, the receipts link to the shared stylesheet instead of inlining it (ESCPOS_STYLESHEET).
+    listener_stats:'ListenerStats|None' = None  #In the listener processes of ESCPOS_LISTENER_PROCESSES, where the connections and receipts are counted.
+    printer:PrinterProfile = PrinterProfile(9100, 'Netprinter')  #The virtual printer of the connection, given by its server (ESCPOS_PRINTERS).
+    receipt_numbers:Iterator[int] = itertools.count(1)  #Numbers the receipts published by this process, so each one gets its own file.
+
+    # The first bytes of all the commands that could lead to a status request:  DLE, ESC, FS and GS
+    COMMAND_PREFIXES:bytes = b'\x10\x1B\x1C\x1D'
+    COMMAND_PREFIX_SEARCH:re.Pattern = re.compile(b'[\x10\x1B\x1C\x1D]')
+    # Printable characters, in ASCII and in the upper half of the code pages
+    PRINTABLE_SEARCH:re.Pattern = re.compile(b'[\x20-\x7E\x80-\xFF]')
+
+    # How to consume each command, by its first two bytes
+    COMMAND_SPECS:dict[bytes, CommandSpec] = {
+        # GS
+        b'\x1D\x72': CommandSpec('GS r', responder='respond_gs_r'),
+        b'\x1D\x49': CommandSpec('GS I', responder='respond_gs_i'),
+        b'\x1D\x67': CommandSpec('GS g', responder='respond_gs_g'),
+        b'\x1D\x28': CommandSpec('GS (', responder='respond_gs_parens'),
+        b'\x1D\x6A': CommandSpec('GS j', responder='respond_gs_j'),
+        b'\x1D\x61': CommandSpec('GS a', responder='respond_gs_a'),
+        b'\x1D\x3A': CommandSpec('GS :'),
+        b'\x1D\x63': CommandSpec('GS c'),
+        b'\x1D\x21': CommandSpec('GS !', 1),
+        b'\x1D\x42': CommandSpec('GS B', 1),
+        b'\x1D\x62': CommandSpec('GS b', 1),
+        b'\x1D\x2F': CommandSpec('GS /', 1, content='graphics'),
+        b'\x1D\x48': CommandSpec('GS H', 1),
+        b'\x1D\x54': CommandSpec('GS T', 1),
+        b'\x1D\x66': CommandSpec('GS f', 1),
+        b'\x1D\x68': CommandSpec('GS h', 1),
+        b'\x1D\x77': CommandSpec('GS w', 1),
+        b'\x1D\x56': CommandSpec('GS V', responder='consume_gs_V', content='cut', splits='cut'),
+        b'\x1D\x4C': CommandSpec('GS L', 2),
+        b'\x1D\x50': CommandSpec('GS P', 2),
+        b'\x1D\x57': CommandSpec('GS W', 2),
+        b'\x1D\x5C': CommandSpec('GS \\', 2),
+        b'\x1D\x7A': CommandSpec('GS z', 3),
+        b'\x1D\x5E': CommandSpec('GS ^', 3),
+        b'\x1D\x43': CommandSpec('GS C', responder='consume_gs_C'),
+        b'\x1D\x6B': CommandSpec('GS k', responder='consume_barcode', content='barcode'),
+        b'\x1D\x44': CommandSpec('GS D', streamer='stream_gs_D'),
+        # GS Q 0 m xL xH yL yH:  (xL + xH × 256) × (yL + yH × 256) × 8 bytes
+        b'\x1D\x51': CommandSpec('GS Q 0', 6, payload=lambda a: little_endian(a[2:4]) * little_endian(a[4:6]) * 8, content='graphics'),
+        # GS * x y:  x × y × 8 bytes
+        b'\x1D\x2A': CommandSpec('GS *', 2, payload=lambda a: a[0] * a[1] * 8 if len(a) == 2 else 0),
+        # GS v 0 m xL xH yL yH:  (xL + xH × 256) bytes per line, for (yL + yH × 256) lines
+        b'\x1D\x76': CommandSpec('GS v 0', 6, payload=lambda a: little_endian(a[2:4]) * little_endian(a[4:6]), content='graphics'),
+        # GS 8 L p1 p2 p3 p4:  (p1 + p2 × 256 + p3 × 65536 + p4 × 16777216) bytes
+        b'\x1D\x38': CommandSpec('GS 8 L', 5, payload=lambda a: little_endian(a[1:5]) if a[:1] == b'\x4C' else 0, content='graphics'),
+        # DLE
+        b'\x10\x04': CommandSpec('DLE EOT', responder='respond_dle_eot'),
+        b'\x10\x14': CommandSpec('DLE DC4', responder='respond_dle_dc4'),
+        # ESC
+        b'\x1B\x76': CommandSpec('ESC v', responder='respond_esc_v'),
+        b'\x1B\x75': CommandSpec('ESC u', responder='respond_esc_u'),
+        b'\x1B\x40': CommandSpec('ESC @', splits='init'),
+        b'\x1B\x0C': CommandSpec('ESC FF'),
+        b'\x1B\x32': CommandSpec('ESC 2'),
+        b'\x1B\x4C': CommandSpec('ESC L'),
+        b'\x1B\x53': CommandSpec('ESC S'),
+        b'\x1B\x69': CommandSpec('ESC i'),
+        b'\x1B\x6D': CommandSpec('ESC m'),
+        b'\x1B\x24': CommandSpec('ESC $', 2),
+        b'\x1B\x5C': CommandSpec('ESC \\', 2),
+        b'\x1B\x63': CommandSpec('ESC c', 2),
+        b'\x1B\x70': CommandSpec('ESC p', 3),
+        b'\x1B\x57': CommandSpec('ESC W', 8),
+        b'\x1B\x44': CommandSpec('ESC D', responder='consume_tab_positions'),
+        b'\x1B\x26': CommandSpec('ESC &', responder='consume_user_characters'),
+        # ESC ( fn pL pH:  pL + pH × 256 parameter bytes
+        b'\x1B\x28': CommandSpec('ESC (', 3, payload=lambda a: little_endian(a[1:3])),
+        # ESC * m nL nH:  nL + nH × 256 columns, of 1 byte in the 8-dot modes (m = 0, 1) and of 3 bytes in the 24-dot modes (m = 32, 33)
+        b'\x1B\x2A': CommandSpec('ESC *', 3, payload=lambda a: little_endian(a[1:3]) * (3 if a[:1] in (b'\x20', b'\x21') else 1), content='graphics'),
+        # FS
+        b'\x1C\x28': CommandSpec('FS (', responder='respond_fs_parens'),
+        b'\x1C\x26': CommandSpec('FS &'),
+        b'\x1C\x2E': CommandSpec('FS .'),
+        b'\x1C\x21': CommandSpec('FS !', 1),
+        b'\x1C\x2D': CommandSpec('FS -', 1),
+        b'\x1C\x43': CommandSpec('FS C', 1),
+        b'\x1C\x57': CommandSpec('FS W', 1),
+        b'\x1C\x3F': CommandSpec('FS ?', 2),
+        b'\x1C\x53': CommandSpec('FS S', 2),
+        b'\x1C\x70': CommandSpec('FS p', 2, content='graphics'),
+        b'\x1C\x32': CommandSpec('FS 2', 4),  #FS 2 command has c1 c2 then k bits (arbitrarily decided by the printer.   We'll munch 32  as in the APG)
+        b'\x1C\x67': CommandSpec('FS g', responder='respond_fs_g'),
+        b'\x1C\x71': CommandSpec('FS q', 1, streamer='stream_fs_q'),
+    }
+    # The commands missing from COMMAND_SPECS, by their first byte.  All the other ESC commands have one n byte.
+    COMMAND_DEFAULTS:dict[bytes, CommandSpec] = {
+        b'\x10': CommandSpec('DLE'),
+        b'\x1B': CommandSpec('ESC', 1),
+        b'\x1C': CommandSpec('FS'),
+        b'\x1D': CommandSpec('GS'),
+    }
     
     # Receive the print data and dump it in a file.
     def handle(self):
         print (f"Address connected: {self.client_address}", flush=True)
+        self.printer = getattr(self.server, 'printer', self.printer)
+        if self.listener_stats is not None:
+            self.listener_stats.count('connections')
         self.netprinter_debugmode = getenv('ESCPOS_DEBUG', "false")
-        bin_filename = PurePath('web', 'tmp', "reception.bin")
-        with open(bin_filename, "wb") as binfile:
+        self.netprinter_scanmode = getenv('ESCPOS_SCAN_MODE', "chunked")
+        self.netprinter_jobsplit = getenv('ESCPOS_JOB_SPLIT', "cut,init")
+        spool_max_memory = int(getenv('ESCPOS_SPOOL_MAX_MEMORY', str(JobSpool.DEFAULT_MAX_MEMORY)))
+        self.job_content:set[str] = set()  # What was seen that goes on a receipt:  text, graphics, barcode or cut
+        self.finished_segments:list = []  # The receipts of this connection that are complete, but not printed yet
 
-            #Read everything until we get EOF, and keep everything in a receive buffer
-            receive_buffer:bytes = b''
+        #Read everything until we get EOF, and keep everything in a receive buffer
+        with JobSpool(spool_max_memory) as self.receive_buffer:
 
             try:
                 # Implement the "Real-time command processing" block described in the Epson APG.
-                # How:  Skim the received data byte by byte to respond to status checks as they come.   
+                # How:  Skim the received data to respond to status checks as they come.   
                 # We are making this as simple as possible so we do not slow down the print:  
                 #   1)  watch for ESC/POS commands that could lead to a status request               
                 #   2)  If this byte is none of those, send it forward without further processing
@@ -53,350 +1312,26 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                 #       a) Check a second byte for a status request
                 #       b) if the second byte does not indicate a status request, send the two bytes forward without further processing
                 #       c) if the second byte indicates a status request, reply appropriately then send all processed data bytes forward
+                # The scanner (see scan_received_data) hands us the processed data in pieces, in the order it was received.
                 
-                while (indata_statuscheck := self.rfile.read(1)):
-                    match indata_statuscheck:
-                        case  b'\x1D' :  # GS
-                            #This is potentially a status request.
-                            indata_statuscheck = indata_statuscheck + self.rfile.read(1) #Get the second command byte
-
-                            match indata_statuscheck:
-                                case b'\x1D\x72':
-                                    #Respond to GS r status requests
-                                    gs_r_data:bytes = self.respond_gs_r()
-                                    indata_statuscheck = indata_statuscheck + gs_r_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS r received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1D\x49':
-                                    # Respond to GS I printer ID request
-                                    gs_i_data:bytes = self.respond_gs_i()
-                                    indata_statuscheck = indata_statuscheck + gs_i_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS i received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1D\x67':
-                                    # Respond to GS g maintenance counter requests
-                                    gs_g2_data:bytes = self.respond_gs_g()
-                                    indata_statuscheck = indata_statuscheck + gs_g2_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS g received containing {len(indata_statuscheck)} bytes", flush=True)
-                                
-                                case b'\x1D\x28':
-                                    # Respond to GS ( E and GS ( H requests
-                                    gs_parens_data:bytes = self.respond_gs_parens()
-                                    indata_statuscheck = indata_statuscheck + gs_parens_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS ( received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1D\x6A':
-                                    # Respond to GS j request ASB for ink
-                                    gs_j_data:bytes = self.respond_gs_j()
-                                            
-                                    indata_statuscheck = indata_statuscheck + gs_j_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS j received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1D\x3A' | b'\x1D\x63':
-                                    #Requests with zero argument bytes
-                                    pass
-                                
-                                case b'\x1D\x21' | b'\x1D\x42' | b'\x1D\x62'| b'\x1D\x2F' | b'\x1D\x48' | b'\x1D\x54' | b'\x1D\x56' | b'\x1D\x62' | b'\x1D\x66' | b'\x1D\x68' | b'\x1D\x6A' | b'\x1D\x77':
-                                    #Requests with one argument byte
-                                    # NOTE: the GS V command has 1 or 2 arguments, but the second cannot be mistaken for a command so we wait next loop to read it in.
-                                    #Munch on it and pass it on
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(1)
-                                    
-                                case b'\x1D\x4C' | b'\x1D\x50' | b'\x1D\x57' | b'\x1D\x5C' :
-                                    #Requests with two argument bytes
-                                    #Munch on em and pass it on
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(2)
-                                    
-                                case b'\x1D\x7A' | b'\x1D\x5E' :
-                                    #Requests with three argument bytes
-                                    #Munch on em and pass it on
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(3)
-                                    
-                                case b'\x1D\x43' :
-                                    # GS C: obsolete commands
-                                    #Munch on it and pass it on
-                                    next_byte:bytes = self.rfile.read(1)
-                                    match next_byte:
-                                        case b'\x30':
-                                            # GS C 0 - counter print mode
-                                            next_byte = next_byte + self.rfile.read(2)
-                                            
-                                        case b'\x31':
-                                            # GS C 1 Select count mode
-                                            next_byte = next_byte + self.rfile.read(6)
-                                            
-                                        case b'\x32':
-                                            # GS C 2
-                                            next_byte = next_byte + self.rfile.read(2)
-                                            
-                                        case b'\x3B':
-                                            # GS C ; - 5 bytes with separators
-                                            next_byte = next_byte + self.rfile.read(10)
-                                    
-                                    indata_statuscheck = indata_statuscheck + next_byte
-                                
-                                case b'\x1D\x61':
-                                    # GS a - request enable automatic status back
-                                    n:bytes =  self.rfile.read(1)
-                                    indata_statuscheck = indata_statuscheck + n
-                                    # We send the ASB once, in case the client checks for it.
-                                    if n==b'\x00':
-                                        pass  #The request is disable ASB -> we send nothing back.
-                                    else:
-                                        self.send_basic_ASB_OK() 
-                                
-                                case b'\x1D\x44':
-                                    # GS D has 2 functions.
-                                    m:bytes = self.rfile.read(1)
-                                    fn:bytes = self.rfile.read(1)
-                                    indata_statuscheck = indata_statuscheck + m + fn
-                                    match fn:
-                                        case b'\x43':
-                                            # <fn=63> Define Windows BMP NV graphics data
-                                            # read the bytes before the BMP
-                                            indata_statuscheck = indata_statuscheck + self.rfile.read(5)
-                                            
-                                            #We are at the start of the BMP here.
-                                            indata_statuscheck = indata_statuscheck + self.consume_bmp_file()
-                                            
-                                            if self.netprinter_debugmode == True:
-                                                print(f"GS D <fn=63> BMP NV graphics data received: {indata_statuscheck}", flush=True)
-                                            
-                                        case b'\x53':
-                                            # <fn=83> Define Windows BMP download graphics data
-                                            # read the bytes before the BMP
-                                            indata_statuscheck = indata_statuscheck + self.rfile.read(5)
-                                            
-                                            #We are at the start of the BMP here.
-                                            indata_statuscheck = indata_statuscheck + self.consume_bmp_file()
-                                            
-                                            if self.netprinter_debugmode == True:
-                                                print(f"GS D <fn=83> BMP download data received: {indata_statuscheck}", flush=True)
-                                            
-                                        case _:
-                                            if self.netprinter_debugmode == True:
-                                                print(f"Unknown GS D command received : {indata_statuscheck}", flush=True)
-                                                
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS D command received containing {len(indata_statuscheck)} bytes", flush=True)
-                                
-                                case b'\x1D\x6B':
-                                    # GS k - print barcode request
-                                    
-                                    # Find out the function
-                                    m:bytes = self.rfile.read(1)
-                                    
-                                    # Read the barcode data.   There are 2 functions with different formats, depending on m
-                                    barcode_data:bytes = b''
-                                    match m:
-                                        case b'\x00':
-                                            # Function A - the data is null-terminated.
-                                            # Read one byte at a time until \x00 comes
-                                            while True:
-                                                chunk:bytes = self.rfile.read(1)
-                                                if not chunk: 
-                                                    break
-                                                barcode_data = barcode_data + chunk
-                                                if b'\x00' in chunk: 
-                                                    break
-
-                                        case b'\x65':
-                                            # Function B - the data length is specified
-                                            n:bytes = self.rfile.read(1)
-                                            barcode_data = n + self.rfile.read(int.from_bytes(n)) 
-                                    
-                                    # Now send all that data forward
-                                    indata_statuscheck = indata_statuscheck + m + barcode_data
-                                    
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS k received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                
-                                case b'\x1D\x51':
-                                    # GS Q 0 - print bit image
-                                    m:bytes = self.rfile.read(2) # the 0 plus the m
-                                    xL:bytes = self.rfile.read(1)
-                                    xH:bytes = self.rfile.read(1)
-                                    yL:bytes = self.rfile.read(1)
-                                    yH:bytes = self.rfile.read(1)
-                                    # Read the image then send it forward
-                                    indata_statuscheck = indata_statuscheck + m + xL + xH + yL + yH + self.consume_byte_array(xL, xH, yL, yH)
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS Q 0 received containing {len(indata_statuscheck)} bytes", flush=True)
-                                
-                                case b'\x1D\x2A':
-                                    # GS * define downloaded image
-                                    x:bytes = self.rfile.read(1)
-                                    y:bytes = self.rfile.read(1)
-                                    
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(int.from_bytes(x) * int.from_bytes(y) * 8)
-                                    if self.netprinter_debugmode == True:
-                                        print(f"GS * received containing {len(indata_statuscheck)} bytes", flush=True)
-                                    
-                                
-                                case _:
-                                    #This is not a status request
-                                    if self.netprinter_debugmode == True:
-                                        print(f"Almost-status bytes: {indata_statuscheck}", flush=True)
-                        
-                        case b'\x10' :  # DLE 
-                            #This is potentially a status request.
-                            indata_statuscheck = indata_statuscheck + self.rfile.read(1) #Get the second command byte
-
-                            match indata_statuscheck:
-                                case b'\x10\x04':
-                                    # Respond to DLE EOT status requests
-                                    dle_eot_data:bytes = self.respond_dle_eot()
-                                    indata_statuscheck = indata_statuscheck + dle_eot_data #append the DLE EOT bytes to the processed bytes
-                                    if self.netprinter_debugmode == True:
-                                        print(f"DLE EOT received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x10\x14':
-                                    # Respond to DLE DC4 
-                                    dle_dc4_data: bytes = self.respond_dle_dc4()
-                                    indata_statuscheck = indata_statuscheck + dle_dc4_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"DLE EOT received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case _:
-                                    #This is not a status request
-                                    if self.netprinter_debugmode == True:
-                                        print(f"Almost-status bytes: {indata_statuscheck}", flush=True)
-
-                        case b'\x1B' :  # ESC
-                            #This is potentially a status request.
-                            indata_statuscheck = indata_statuscheck + self.rfile.read(1) #Get the second command byte
-
-                            match indata_statuscheck:
-                                case b'\x1B\x76':
-                                    # Respond to ESC v request
-                                    self.wfile.write(b'\x00')  #Respond roll paper present and adequate
-                                    self.wfile.flush()
-                                    if self.netprinter_debugmode == True:
-                                        print(f"ESC v received containing {len(indata_statuscheck)} bytes", flush=True)
-                                
-                                case b'\x1B\x75':
-                                    #Respond to ESC u request
-                                    #Read the n byte
-                                    n:bytes = self.rfile.read(1)
-                                    self.wfile.write(b'\x00')  #Respond drawer kick-out LOW
-                                    self.wfile.flush()
-                                    indata_statuscheck = indata_statuscheck + n
-                                    if self.netprinter_debugmode == True:
-                                        print(f"ESC u received containing {len(indata_statuscheck)} bytes", flush=True)
-                                        
-                                case _:
-                                    # All other ESC commands have one n byte
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(1)
-                                    if self.netprinter_debugmode == True:
-                                        print(f"Non-blocking ESC command received: {indata_statuscheck}", flush=True)
-                        
-                        case b'\x1C':  #FS
-                            indata_statuscheck = indata_statuscheck + self.rfile.read(1) #Get the second command byte
-                            match indata_statuscheck:
-                                case b'\x1C\x28':
-                                    #This an FS ( request
-                                    fs_parens_data:bytes = self.respond_fs_parens()
-                                    indata_statuscheck = indata_statuscheck + fs_parens_data
-                                    if self.netprinter_debugmode == True:
-                                        print(f"FS ( received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1C\x26' | b'\x1C\x2E':
-                                    #Subrequests with zero argument bytes
-                                    pass
-                                
-                                case b'\x1C\x21' | b'\x1C\x2D' | b'\x1C\x43'| b'\x1C\x57':
-                                    #Subrequests with one argument byte
-                                    #Munch on it and pass it on
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(1)
-                                
-                                case b'\x1C\x3F' | b'\x1C\x53' | b'\x1C\x70':
-                                    #Subrequests with 2 argument bytes
-                                    #Munch on em and pass it on
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(2)
-
-                                case b'\x1C\x32':
-                                    #FS 2 command has c1 c2 then k bits (arbitrarily decided by the printer.   We'll munch 32  as in the APG)
-                                    indata_statuscheck = indata_statuscheck + self.rfile.read(4)  # Munch 4 bytes (32 bits)
-
-                                case b'\x1C\x67':
-                                    # FS g
-                                    
-                                    next_byte:bytes = self.rfile.read(1)
-                                    match next_byte:
-                                        case b'\x31':
-                                            # FS g 1 - write to NV memory
-                                            # FS g 1 has m then 4 a bytes then nl, ng then (nL + nH × 256) data bytes
-                                            next_byte = next_byte + self.rfile.read(5) #munch on unused bytes: m a1 a2 a3 a4
-                                            # then read pL and pH
-                                            nL:bytes = self.rfile.read(1)
-                                            nH:bytes = self.rfile.read(1)
-                                            
-                                            #send all that data forward
-                                            next_byte = next_byte + nL + nH + self.consume_parameter_data(nL, nH)
-                                            
-                                        case b'\x32':
-                                            # FS g 2 - read from NV user memory
-                                            # FS g 2 has m then 4 a bytes then nl, ng.  Must send back "header to NUL"
-                                            next_byte = next_byte + self.rfile.read(5) #munch on unused bytes: m a1 a2 a3 a4
-                                            # Get the expected number of bytes to send
-                                            nL:bytes = self.rfile.read(1)
-                                            nH:bytes = self.rfile.read(1)
-                                            nb_bytes = int.from_bytes(nL)  + (int.from_bytes(nH) * 256)
-                                            self.wfile.write(b'\x5f') #Send the header
-                                            self.wfile.write(b'\x0F' * nb_bytes) #Send the expected amount of "data"
-                                            self.wfile.write(b'\x00') #Send NULL
-                                            self.wfile.flush()
-                                            #send all the received data forward
-                                            next_byte = next_byte + nL + nH
-                                            
-                                    indata_statuscheck = indata_statuscheck + next_byte
-                                    if self.netprinter_debugmode == True:
-                                        print(f"FS g received containing {len(indata_statuscheck)} bytes", flush=True)
-
-                                case b'\x1C\x71':
-                                    # FS q - store non-volatile raster graphics.
-                                    # get n - the number if images to munch on
-                                    n:bytes = self.rfile.read(1)
-                                    indata_statuscheck = indata_statuscheck + n
-                                    
-                                    for i in range(int.from_bytes(n)):
-                                        # munch on one image and pass it on
-                                        xL = self.rfile.read(1)
-                                        xH = self.rfile.read(1)
-                                        yL = self.rfile.read(1)
-                                        yH = self.rfile.read(1)
-                                        
-                                        indata_statuscheck = indata_statuscheck + self.consume_byte_array(xL, xH, yL, yH)
-                                        
-                                    if self.netprinter_debugmode == True:
-                                        print(f"FS q received containing {len(indata_statuscheck)} bytes", flush=True)
-                                        
-
-                                case _:
-                                    if self.netprinter_debugmode == 'True':
-                                        print(f"Unknown FS request received: {indata_statuscheck}", flush=True)
-                        case _:
-                            #This byte is uninteresting data for this block's purposes, no processing necessary.
-                            pass
-
+                # NOTE: the helpers that consume large payloads (images, barcodes) append them to the receive buffer themselves.
+                # NOTE: when the client sends several receipts in a row, each receipt is printed as soon as it is complete (see close_segment).
+                
+                for indata_statuscheck in self.scan_received_data():
                     #Append the processed byte(s) to the receive buffer
-                    receive_buffer = receive_buffer + indata_statuscheck
+                    self.receive_buffer.append(indata_statuscheck)
+                    if self.finished_segments:
+                        self.print_finished_segments()
+
 
-        
             except TimeoutError:
                 print("Timeout while reading")
                 self.connection.close()
-                if len(receive_buffer) > 0:
-                    print(f"{len(receive_buffer)} bytes received.")
+                if len(self.receive_buffer) > 0:
+                    print(f"{len(self.receive_buffer)} bytes received.")
                     if self.netprinter_debugmode == 'True':
                         print("-----start of data-----\n", flush=True)
-                        print(receive_buffer, flush=True)
+                        print(self.receive_buffer.getvalue(), flush=True)
                         print("\n-----end of data-----", flush=True)
                 else: 
                     print("No data received!", flush=True)
@@ -407,56 +1342,406 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                     
             else:
                 #Quand on a reçu le signal de fin de transmission
-                print(f"{len(receive_buffer)} bytes received.", flush=True)
+                self.print_received_job()
+
+
+        self.wfile.write(b"ESCPOS-netprinter: All done!")  #A enlever plus tard?  On dit au client qu'on a fini.
+        self.wfile.flush()
+        self.connection.close()
+
+        print ("Data reception finished, signature sent.", flush=True)
+
+    def print_received_job(self) -> None:
+        """Save the last receipt of the receive buffer in a reception file and convert it.  Called once the client has finished sending.
+        """        
+        print(f"{len(self.receive_buffer)} bytes received.", flush=True)
+        self.close_segment()
+        self.print_finished_segments()
+
+    def close_segment(self) -> None:
+        """Close the receipt in the receive buffer:  save it in its own reception file, to be converted by print_finished_segments,
+            then empty the receive buffer for the next receipt.
+        """        
+        if self.netprinter_debugmode == 'True':
+            print("-----start of data-----\n", flush=True)
+            print(self.receive_buffer.getvalue(), flush=True)
+            print("\n-----end of data-----", flush=True)
+
+        #Les connexions qui ne font que des requêtes de statut n'ont rien à imprimer.
+        if len(self.receive_buffer) > 0 and not self.job_content:
+            print("Status requests only: nothing will be printed.", flush=True)
+
+        #Écrire les données reçues dans un fichier propre à ce reçu.
+        elif len(self.receive_buffer) > 0:
+            print(f"Job content: {', '.join(sorted(self.job_content))}", flush=True)
+            with self.open_reception_file() as binfile:
+                self.receive_buffer.save(binfile)
+            #The binfile is closed here.
+            self.finished_segments.append((binfile, datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE))))
+
+        elif self.netprinter_debugmode == 'True':
+                print("No data received: nothing will be printed.", flush=True)
+
+        self.receive_buffer.truncate(0)
+        self.job_content = set()
+
+    def print_finished_segments(self) -> None:
+        """Convert the receipts closed by close_segment, in the order they were received
+        """        
+        while self.finished_segments:
+            binfile, heureRecept = self.finished_segments.pop(0)
+            #traiter le fichier de réception pour en faire un HTML
+            bin_filename = PurePath(binfile.name)
+            if self.conversion_queue is not None:
+                #The conversion workers take it from here, we can go back to receiving.
+                self.conversion_queue.submit(bin_filename, heureRecept, self.netprinter_debugmode, printer=self.printer)
+                continue
+            self.print_toHTML(binfile, bin_filename)
+            if self.netprinter_debugmode != 'True':
+                os.remove(bin_filename)  #In debug mode, we keep the received data for inspection.
+
+    def splits_job_at(self, boundary:str) -> bool:
+        """Check if the stream is split into receipts at this boundary (ESCPOS_JOB_SPLIT) and if the current receipt has something to print.
+            A cut alone does not make a receipt.
+
+        Args:
+            boundary (str): 'cut' or 'init'
+
+        Returns:
+            bool: True if the current receipt ends here
+        """        
+        return boundary in self.netprinter_jobsplit.split(',') and len(self.job_content - {'cut'}) > 0
+
+    @staticmethod
+    def open_reception_file():
+        """Create a new, uniquely named reception file in web/tmp, so concurrent connections never write in the same file
+
+        Returns:
+            The reception file, open for writing
+        """        
+        return tempfile.NamedTemporaryFile(mode='wb', dir=PurePath('web', 'tmp'), prefix='reception-', suffix='.bin', delete=False)
+
+    def scan_received_data(self) -> Iterator[bytes]:
+        """ Choose the scanner for the received data according to the ESCPOS_SCAN_MODE setting
+
+        Returns:
+            Iterator[bytes]: the processed data, in the order it was received
+        """        
+        if self.netprinter_scanmode == 'bytewise':
+            return self.scan_bytewise()
+        else:
+            return self.scan_chunked()
+
+    def scan_bytewise(self) -> Iterator[bytes]:
+        """ Skim the received data one byte at a time.  This is the original scanner, kept for comparison purposes.
+
+        Yields:
+            Iterator[bytes]: one data byte or one processed command at a time
+        """        
+        while (indata_statuscheck := self.rfile.read(1)):
+            if indata_statuscheck in self.COMMAND_PREFIXES:
+                indata_statuscheck = self.process_command(indata_statuscheck)
+            else:
+                self.classify_text(indata_statuscheck)
+            yield indata_statuscheck
+
+    def scan_chunked(self) -> Iterator[bytes]:
+        """ Skim the received data one chunk at a time.
+            We look into the read buffer (without consuming it) for the next DLE, ESC, FS or GS byte:  
+            everything before it is plain data that is sent forward in one slice, and only the commands go through process_command.
+
+        Yields:
+            Iterator[bytes]: one run of plain data or one processed command at a time
+        """        
+        while (window := self.rfile.peek(self.rbufsize)):
+            candidate = self.COMMAND_PREFIX_SEARCH.search(window)
+            if candidate is None:
+                # No command in sight, send the whole window forward
+                plain_data = self.rfile.read(len(window))
+                self.classify_text(plain_data)
+                yield plain_data
+            elif candidate.start() > 0:
+                # Send forward the plain data up to the command
+                plain_data = self.rfile.read(candidate.start())
+                self.classify_text(plain_data)
+                yield plain_data
+            else:
+                # The command is at the start of the window
+                yield self.process_command(self.rfile.read(1))
+
+    def classify_text(self, plain_data:bytes) -> None:
+        # Plain data goes on the receipt if it has at least one printable character (line feeds alone only move the paper)
+        if 'text' not in self.job_content and self.PRINTABLE_SEARCH.search(plain_data):
+            self.job_content.add('text')
+
+    def process_command(self, indata_statuscheck:bytes) -> bytes:
+        """ Consume one command starting with a DLE, ESC, FS or GS byte, and respond to it if it is a status request.
+            The command is looked up in COMMAND_SPECS with its first two bytes;  unknown commands get the default of their first byte.
+
+        Args:
+            indata_statuscheck (bytes): the command's first byte, already received
+
+        Returns:
+            bytes: the consumed command, or what is left of it when its data went straight to the receive buffer
+        """        
+        default:CommandSpec|None = self.COMMAND_DEFAULTS.get(indata_statuscheck)
+        if default is None:
+            #This byte is uninteresting data for this block's purposes, no processing necessary.
+            return indata_statuscheck
+
+        indata_statuscheck = indata_statuscheck + self.rfile.read(1) #Get the second command byte
+        spec:CommandSpec = self.COMMAND_SPECS.get(indata_statuscheck, default)
+        if spec.splits == 'init' and self.splits_job_at('init'):
+            # This command starts the next receipt
+            self.close_segment()
+        if spec.content is not None:
+            self.job_content.add(spec.content)
+
+        #Munch on the fixed arguments
+        if spec.arguments > 0:
+            indata_statuscheck = indata_statuscheck + self.rfile.read(spec.arguments)
+
+        if spec.payload is not None:
+            # Send the command forward, then the payload goes straight to the receive buffer
+            self.receive_buffer.append(indata_statuscheck)
+            payload_size:int = self.consume_payload(spec.payload(indata_statuscheck[2:]))
+            if self.netprinter_debugmode == 'True':
+                print(f"{spec.name} received containing {payload_size} payload bytes", flush=True)
+            return b''
+
+        if spec.responder is not None:
+            # Read the rest of the command and respond to it if needed
+            indata_statuscheck = indata_statuscheck + getattr(self, spec.responder)()
+
+        if spec.streamer is not None:
+            # The command sends its data straight to the receive buffer
+            indata_statuscheck = getattr(self, spec.streamer)(indata_statuscheck)
+
+        if spec.splits == 'cut' and self.splits_job_at('cut'):
+            # This command ends the receipt
+            self.receive_buffer.append(indata_statuscheck)
+            indata_statuscheck = b''
+            self.close_segment()
+
+        if self.netprinter_debugmode == 'True':
+            print(f"{spec.name} received: {indata_statuscheck[:16]}", flush=True)
+        return indata_statuscheck
+
+    def respond_gs_a(self) -> bytes:
+        # GS a - request enable automatic status back
+        n:bytes =  self.rfile.read(1)
+        # We send the ASB once, in case the client checks for it.
+        if n==b'\x00':
+            pass  #The request is disable ASB -> we send nothing back.
+        else:
+            self.send_basic_ASB_OK() 
+        return n
+
+    def consume_gs_C(self) -> bytes:
+        # GS C: obsolete commands
+        next_byte:bytes = self.rfile.read(1)
+        match next_byte:
+            case b'\x30':
+                # GS C 0 - counter print mode
+                next_byte = next_byte + self.rfile.read(2)
+
+            case b'\x31':
+                # GS C 1 Select count mode
+                next_byte = next_byte + self.rfile.read(6)
+
+            case b'\x32':
+                # GS C 2
+                next_byte = next_byte + self.rfile.read(2)
+
+            case b'\x3B':
+                # GS C ; - 5 bytes with separators
+                next_byte = next_byte + self.rfile.read(10)
+
+        return next_byte
+
+    def consume_gs_V(self) -> bytes:
+        # GS V - cut paper.  Functions A and B (m = 0, 1, 48, 49) have only m, functions B, C and D (m = 65, 66, 97, 98, 103, 104) have m and n
+        m:bytes = self.rfile.read(1)
+        if m in (b'\x41', b'\x42', b'\x61', b'\x62', b'\x67', b'\x68'):
+            m = m + self.rfile.read(1)
+        return m
+
+    def consume_barcode(self) -> bytes:
+        # GS k - print barcode request
+
+        # Find out the function
+        m:bytes = self.rfile.read(1)
+
+        # Read the barcode data.   There are 2 functions with different formats, depending on m
+        barcode_data:bytes = b''
+        if m != b'' and m[0] <= 6:
+            # Function A (m = 0 to 6) - the data is null-terminated.
+            # Read one byte at a time until \x00 comes
+            barcode_data = bytearray()
+            while True:
+                chunk:bytes = self.rfile.read(1)
+                if not chunk: 
+                    break
+                barcode_data += chunk
+                if b'\x00' in chunk: 
+                    break
+
+        elif m != b'' and 65 <= m[0] <= 79:
+            # Function B (m = 65 to 79) - the data length is specified
+            n:bytes = self.rfile.read(1)
+            barcode_data = n + self.rfile.read(int.from_bytes(n)) 
+
+        return m + barcode_data
+
+    def respond_esc_v(self) -> bytes:
+        # Respond to ESC v request
+        self.wfile.write(b'\x00')  #Respond roll paper present and adequate
+        self.wfile.flush()
+        return b''
+
+    def respond_esc_u(self) -> bytes:
+        #Respond to ESC u request
+        #Read the n byte
+        n:bytes = self.rfile.read(1)
+        self.wfile.write(b'\x00')  #Respond drawer kick-out LOW
+        self.wfile.flush()
+        return n
+
+    def consume_user_characters(self) -> bytes:
+        # ESC & - define user-defined characters:  ESC & y c1 c2 [x1 d1...d(y × x1)]...[xk d1...d(y × xk)]
+        y:bytes = self.rfile.read(1)
+        c1:bytes = self.rfile.read(1)
+        c2:bytes = self.rfile.read(1)
+        definitions:bytes = y + c1 + c2
+        # Each character from c1 to c2 has its width x, then y × x bytes
+        for character in range(int.from_bytes(c1), int.from_bytes(c2) + 1):
+            x:bytes = self.rfile.read(1)
+            definitions = definitions + x + self.rfile.read(int.from_bytes(y) * int.from_bytes(x))
+        return definitions
+
+    def consume_tab_positions(self) -> bytes:
+        # ESC D - set horizontal tab positions:  ESC D n1...nk NUL, with at most 32 positions
+        positions = bytearray()
+        while len(positions) <= 32:
+            n:bytes = self.rfile.read(1)
+            positions += n
+            if n == b'\x00' or n == b'':
+                break
+        return bytes(positions)
+
+    def respond_fs_g(self) -> bytes:
+        # FS g
+        next_byte:bytes = self.rfile.read(1)
+        match next_byte:
+            case b'\x31':
+                # FS g 1 - write to NV memory
+                # FS g 1 has m then 4 a bytes then nl, ng then (nL + nH × 256) data bytes
+                next_byte = next_byte + self.rfile.read(5) #munch on unused bytes: m a1 a2 a3 a4
+                # then read pL and pH
+                nL:bytes = self.rfile.read(1)
+                nH:bytes = self.rfile.read(1)
+
+                #send all that data forward
+                next_byte = next_byte + nL + nH + self.consume_parameter_data(nL, nH)
+
+            case b'\x32':
+                # FS g 2 - read from NV user memory
+                # FS g 2 has m then 4 a bytes then nl, ng.  Must send back "header to NUL"
+                next_byte = next_byte + self.rfile.read(5) #munch on unused bytes: m a1 a2 a3 a4
+                # Get the expected number of bytes to send
+                nL:bytes = self.rfile.read(1)
+                nH:bytes = self.rfile.read(1)
+                nb_bytes = int.from_bytes(nL)  + (int.from_bytes(nH) * 256)
+                self.wfile.write(b'\x5f') #Send the header
+                self.wfile.write(b'\x0F' * nb_bytes) #Send the expected amount of "data"
+                self.wfile.write(b'\x00') #Send NULL
+                self.wfile.flush()
+                #send all the received data forward
+                next_byte = next_byte + nL + nH
+
+        return next_byte
+
+    def stream_gs_D(self, command:bytes) -> bytes:
+        """ GS D has 2 functions that define graphics with a Windows BMP file:  send the command and the BMP straight to the receive buffer
+
+        Args:
+            command (bytes): GS D, already received
+
+        Returns:
+            bytes: what is left to forward
+        """        
+        m:bytes = self.rfile.read(1)
+        fn:bytes = self.rfile.read(1)
+        command = command + m + fn
+        match fn:
+            case b'\x43' | b'\x53':
+                # <fn=67> Define Windows BMP NV graphics data, or <fn=83> Define Windows BMP download graphics data
+                # read the bytes before the BMP
+                self.receive_buffer.append(command + self.rfile.read(5))
+
+                #We are at the start of the BMP here:  it goes straight to the receive buffer.
+                bmp_size:int = self.consume_bmp_file()
 
                 if self.netprinter_debugmode == 'True':
-                    print("-----start of data-----\n", flush=True)
-                    print(receive_buffer, flush=True)
-                    print("\n-----end of data-----", flush=True)
+                    print(f"GS D <fn={int.from_bytes(fn)}> BMP graphics data received: {bmp_size} bytes", flush=True)
+                return b''
 
-                #Écrire les données reçues dans le fichier.
-                if len(receive_buffer) > 0:
-                    binfile.write(receive_buffer)
-                    binfile.close()  #Écrire le fichier et le fermer
-                    #traiter le fichier reception.bin pour en faire un HTML
-                    self.print_toHTML(binfile, bin_filename)
-                elif self.netprinter_debugmode == 'True':
-                        print("No data received: nothing will be printed.", flush=True)
+            case _:
+                if self.netprinter_debugmode == 'True':
+                    print(f"Unknown GS D command received : {command}", flush=True)
+                return command
 
-        #The binfile should auto-close here.
+    def stream_fs_q(self, command:bytes) -> bytes:
+        """ FS q - store non-volatile raster graphics:  send the command and the images straight to the receive buffer
 
-        self.wfile.write(b"ESCPOS-netprinter: All done!")  #A enlever plus tard?  On dit au client qu'on a fini.
-        self.wfile.flush()
-        self.connection.close()
+        Args:
+            command (bytes): FS q and n, the number of images, already received
 
-        print ("Data reception finished, signature sent.", flush=True)
+        Returns:
+            bytes: what is left to forward
+        """        
+        self.receive_buffer.append(command)
+
+        image_size:int = 0
+        for i in range(int.from_bytes(command[2:])):
+            # munch on one image and pass it on, straight to the receive buffer
+            xL = self.rfile.read(1)
+            xH = self.rfile.read(1)
+            yL = self.rfile.read(1)
+            yH = self.rfile.read(1)
+            self.receive_buffer.append(xL + xH + yL + yH)
+
+            image_size = image_size + self.consume_byte_array(xL, xH, yL, yH)
+
+        if self.netprinter_debugmode == 'True':
+            print(f"FS q received containing {image_size} image bytes", flush=True)
+        return b''
 
-    def consume_bmp_file(self) -> bytes:
-        """ Consume a BMP file for the GS D command
+    def consume_bmp_file(self) -> int:
+        """ Consume a BMP file for the GS D command and append it to the receive buffer
 
         Returns:
-            bytes: The complete BMP file
+            int: The size of the BMP file that was received
         """      
           
-        bmp_file:bytes = b''
-
         # BMP header has the size in byte
         # The first 2 bytes are supposed to be "BM" (\x42\x4D)        
         header_field:bytes = self.rfile.read(2)
-        bmp_file = bmp_file + header_field
+        self.receive_buffer.append(header_field)
+        received:int = len(header_field)
         if header_field == b'\x42\x4D': 
             #Confirmed BMP.  Get the size (4 bytes)
             bmp_size:bytes = self.rfile.read(4)
-            bmp_data:bytes = b''
+            self.receive_buffer.append(bmp_size)
+            received = received + len(bmp_size)
             if int.from_bytes(bmp_size) == 0:
                 print("Error:  zero-byte-long argument specified", flush=True)
             else:
-                bmp_data =  self.rfile.read(int.from_bytes(bmp_size)) # Send these bytes forward in all cases
-            bmp_file = bmp_file + bmp_size + bmp_data
+                received = received + self.consume_payload(int.from_bytes(bmp_size)) # Send these bytes forward in all cases
         else:
             if self.netprinter_debugmode == True:
                 print(f"GS D received non-BMP file - did not read the data", flush=True)
-        return bmp_file
+        return received
 
     def respond_gs_j(self) -> bytes:
         #Consume a GS j request and respond to the client if necessary
@@ -644,7 +1929,7 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                                 self.wfile.write(b'0\x1f')  #sm=0 This is a Receipt (no black mark)
                                 self.wfile.write(b'0\x1f')  #sa=0 Does not specify the distance from the print reference to the next print reference 
                                 self.wfile.write(b'\x1f'*4) #sb, sc, sd, se are omitted, not pertinent for sm=0
-                                self.wfile.write(b'800')  #The receipt width is 80mm (the unit is 0.1mm)
+                                self.wfile.write(str(self.printer.paper_width * 10).encode('ascii'))  #The receipt width (the unit is 0.1mm, 800 for 80mm)
                                 self.wfile.write(b'\x00')
                                 self.wfile.flush()  #Send the response back.
                                 if self.netprinter_debugmode == 'True': 
@@ -660,7 +1945,7 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                                 self.wfile.write(b'0\x1f')  #sm=0 This is a Receipt (no black mark)
                                 self.wfile.write(b'0\x1f')  #sa=0 Does not specify the distance from the print reference to the next print reference 
                                 self.wfile.write(b'\x1f'*4) #sb, sc, sd, se are omitted, not pertinent for sm=0
-                                self.wfile.write(b'512')  #The receipt width is 80mm (the unit is dots, we choose 512 dots @ 180 DPI like the EPSON TM-88V)
+                                self.wfile.write(str(self.printer.paper_width_dots).encode('ascii'))  #The receipt width (the unit is dots, we choose 512 dots for 80mm @ 180 DPI like the EPSON TM-88V)
                                 self.wfile.write(b'\x00')
                                 self.wfile.flush()  #Send the response back.     
                                 
@@ -815,25 +2100,31 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
 
             case b'\x41': # 65
                 #Transmit printer firmware version
-                send_gs_i_printer_info_B(b'release 2.3')  #TODO: put the version number somewhere central to facilitate releases
+                send_gs_i_printer_info_B(self.printer.firmware.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
                     print("Printer firmware version sent", flush=True) 
 
-            case b'\x42' | b'\x43':  # 66 or 67
-                #Transmit maker name or model name - could be different but not important.
-                send_gs_i_printer_info_B(b'ESCPOS-netprinter')
+            case b'\x42':  # 66
+                #Transmit maker name
+                send_gs_i_printer_info_B(self.printer.maker.encode('ascii', 'replace'))
+                if self.netprinter_debugmode == 'True':
+                    print("Printer maker name sent", flush=True) 
+
+            case b'\x43':  # 67
+                #Transmit model name
+                send_gs_i_printer_info_B(self.printer.model.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
-                    print("Printer maker or model name sent", flush=True) 
+                    print("Printer model name sent", flush=True) 
           
             case b'\x44': # 68
                 #Transmit printer serial number
-                send_gs_i_printer_info_B(b'netprinter_1') #TODO: create a serial number for each instance (??)
+                send_gs_i_printer_info_B(self.printer.serial.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
                     print("Printer serial sent", flush=True) 
 
             case b'\x45': # 69
                 #Transmit printer font of language
-                send_gs_i_printer_info_B(b'PC850 Multilingual')
+                send_gs_i_printer_info_B(self.printer.font.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
                     print("Printer language sent", flush=True) 
                     
@@ -844,14 +2135,14 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                     print("Model-specific Printer Info A sent", flush=True)   
                     
             case b'\x6F' :
-                #These are model-specific requests for Printer Information B
-                send_gs_i_printer_info_B(b'Netprinter')
+                #These are model-specific requests for Printer Information B:  send the printer name
+                send_gs_i_printer_info_B(self.printer.name.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
                     print("Model-specific Printer Info B sent", flush=True)  
                     
             case b'\x70':
-                #These are model-specific requests for Printer Information B
-                send_gs_i_printer_info_B(b'Netprinter')
+                #These are model-specific requests for Printer Information B:  send the printer name
+                send_gs_i_printer_info_B(self.printer.name.encode('ascii', 'replace'))
                 if self.netprinter_debugmode == 'True':
                     print("Model-specific Printer Info B sent", flush=True)
                 
@@ -931,8 +2222,16 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                 request = request + self.process_gs_parens_H()
 
             case _:
+                # All the other GS ( commands (graphics with GS ( L, 2D codes with GS ( k, ...) are pL pH followed by pL + pH × 256 parameter bytes
+                pL:bytes = self.rfile.read(1)
+                pH:bytes = self.rfile.read(1)
+                request = request + pL + pH + self.consume_parameter_data(pL, pH)
+                if request[:1] == b'\x4C':
+                    self.job_content.add('graphics')  # GS ( L
+                elif request[:1] == b'\x6B':
+                    self.job_content.add('barcode')  # GS ( k 2D codes
                 if self.netprinter_debugmode == 'True':
-                    print(f"Non-status GS ( request received: {request}", flush=True)
+                    print(f"Non-status GS ( request received: {request[:1]} with {len(request) - 3} parameter bytes", flush=True)
         
         return request
 
@@ -993,7 +2292,7 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
                                 
                     case 3:
                                 #Paper width
-                        response = b'80'
+                        response = str(self.printer.paper_width).encode('ascii')
                                 
                     case 5:
                                 #Print density
@@ -1367,8 +2666,8 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
 
         return num_bytes
 
-    def consume_byte_array(self, xL:bytes, xH:bytes, yL:bytes, yH:bytes) -> bytes:
-        """Consume a byte array of a size defined by xL, xH, yL and yH
+    def consume_byte_array(self, xL:bytes, xH:bytes, yL:bytes, yH:bytes) -> int:
+        """Consume a byte array of a size defined by xL, xH, yL and yH and append it to the receive buffer
 
         Args:
             xL (bytes): Low byte of x size
@@ -1377,20 +2676,38 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
             yH (bytes): High byte of y size
 
         Returns:
-            bytes: all the data for this array
+            int: the number of bytes received for this array
         """        
         num_x = self.calculate_param_size(xL, xH)
         num_y = self.calculate_param_size(yL, yH)
         
         num_bytes = num_x * num_y * 8
         
-        byte_array:bytes = b''
+        received:int = 0
         if num_bytes == 0:
             print("Error:  zero-byte-long argument specified", flush=True)
         else:
-            byte_array =  self.rfile.read(num_bytes) # Send these bytes forward in all cases
+            received = self.consume_payload(num_bytes) # Send these bytes forward in all cases
             
-        return byte_array
+        return received
+
+    def consume_payload(self, num_bytes:int) -> int:
+        """Consume a payload of num_bytes and append it to the receive buffer as it comes, 
+            so a large image never has to be held in memory in one piece.
+
+        WARNING:  if there are less than the expected number of bytes, less bytes will be received.
+
+        Args:
+            num_bytes (int): the payload size
+
+        Returns:
+            int: the number of bytes received
+        """        
+        remaining:int = num_bytes
+        while remaining > 0 and (chunk := self.rfile.read(min(remaining, self.rbufsize))):
+            self.receive_buffer.append(chunk)
+            remaining = remaining - len(chunk)
+        return num_bytes - remaining
         
 
 
@@ -1399,195 +2716,1738 @@ class ESCPOSHandler(socketserver.StreamRequestHandler):
     def print_toHTML(self, binfile:BufferedWriter, bin_filename:PurePath):
 
         print("Printing ", binfile.name)
+        recu:str|None = self.convert_toHTML(bin_filename, self.netprinter_debugmode)
+        if recu is not None:
+            self.publish_receipt(datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE)), recu, printer=self.printer)
+
+    @staticmethod
+    def convert_toHTML(bin_filename:PurePath, netprinter_debugmode:str = "false", source:str = "JetDirect", self=None) -> str|None:
+        """ Convert a reception file to HTML with esc2html.php, in a resident PHP worker if they are started
+
+        Args:
+            bin_filename (PurePath): the reception file
+            netprinter_debugmode (str): 'True' to run the conversion in debug mode
+            source (str): where the print comes from, for the log
+
+        Returns:
+            str|None: the receipt in HTML, or None if the conversion failed
+        """        
+        css_href:str|None = None if ESCPOSHandler.linked_stylesheet is None else ESCPOSHandler.linked_stylesheet.href
         try:
-            if self.netprinter_debugmode == 'True':
-                recu:CompletedProcess = subprocess.run(["php", "esc2html.php", "--debug", bin_filename.as_posix()], capture_output=True, text=True, check=True)
+            if ESCPOSHandler.php_workers is not None:
+                recu:CompletedProcess = ESCPOSHandler.php_workers.run(bin_filename, netprinter_debugmode, css_href)
             else:
-                recu:CompletedProcess = subprocess.run(["php", "esc2html.php", bin_filename.as_posix()], capture_output=True, text=True, check=True)
+                #Lier la feuille de style partagée au lieu de la copier dans le reçu
+                options:list[str] = [] if css_href is None else [f"--css-href={css_href}"]
+                if netprinter_debugmode == 'True':
+                    options.append("--debug")
+                recu:CompletedProcess = subprocess.run(["php", "esc2html.php", *options, bin_filename.as_posix()], capture_output=True, text=True, check=True)
 
         except subprocess.CalledProcessError as err:
             print(f"Error while converting receipt: {err.returncode}")
             # append the error output to the log file
-            with open(PurePath('web','tmp', 'esc2html_log'), mode='at') as log:
-                log.write(f"Error while converting a JetDirect print: {err.returncode}")
+            with conversion_log_lock, open(PurePath('web','tmp', 'esc2html_log'), mode='at') as log:
+                log.write(f"Error while converting a {source} print: {err.returncode}")
                 log.write(datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE)).isoformat())
                 log.write(err.stderr)
                 log.close()
             
             print("Error output:")
             print(err.stderr, flush=True)
+            return None
         
         else:
             #Si la conversion s'est bien passée, on devrait avoir le HTML
             print (f"Receipt decoded", flush=True)
-            with open(PurePath('web','tmp', 'esc2html_log'), mode='at') as log:
-                log.write("Successful JetDirect print\n")
+            with conversion_log_lock, open(PurePath('web','tmp', 'esc2html_log'), mode='at') as log:
+                log.write(f"Successful {source} print\n")
                 log.write(datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE)).isoformat())
                 log.write(recu.stderr)
                 log.close()
             #print(recu.stdout, flush=True)
+            return recu.stdout
+
+    @staticmethod
+    def publish_receipt(heureRecept:datetime, recu:str, source:str = "JetDirect", printer:PrinterProfile|None = None, self=None) -> int|None:
+        """ Publish a converted receipt in web/receipts and in the receipt directory
 
-            #Ajouter un titre au reçu
-            heureRecept = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE))
-            recuConvert = self.add_html_title(heureRecept, recu.stdout)
+        Args:
+            heureRecept (datetime): the reception time, used in the title and the filename
+            recu (str): the receipt in HTML
+            source (str): where the print comes from (JetDirect, CUPS or LPD)
+            printer (PrinterProfile|None): the virtual printer that received a JetDirect print
 
-            #print(etree.tostring(theHead), flush=True)
+        Returns:
+            int|None: the receipt's ID, or None if its file could not be written or added to the receipt directory
+        """        
+        #Ajouter le titre, la page et le pied de page au reçu
+        recuConvert = ESCPOSHandler.finalize_receipt(heureRecept, recu, printer).encode('utf-8')
 
-            try:
-                #Créer un nouveau fichier avec le nom du reçu
-                html_filename = 'receipt{}.html'.format(heureRecept.isoformat())
-                with open(PurePath('web', 'receipts', html_filename), mode='wt') as nouveauRecu:
-                    #Écrire le reçu dans le fichier.
-                    nouveauRecu.write(recuConvert)
-                    nouveauRecu.close()
-                    #Add receipt to receipts directory
-                    self.add_receipt_to_directory(html_filename)
-
-            except OSError as err:
-                print("File creation error:", err.errno, flush=True)
+        try:
+            #Créer un nouveau fichier avec le nom du reçu
+            html_filename = ESCPOSHandler.receipt_filename(heureRecept)
+            encodings, size = ESCPOSHandler.write_receipt(html_filename, recuConvert)
+            #Add receipt to receipts directory, with the validator the web app sends for it
+            fileID = ESCPOSHandler.add_receipt_to_directory(html_filename, heureRecept, source, receipt_etag(recuConvert), encodings,
+                                                            ESCPOSHandler.linked_stylesheet is not None, size, 
+                                                            None if printer is None else printer.name)
+            if ESCPOSHandler.listener_stats is not None:
+                ESCPOSHandler.listener_stats.count('published')
+            return fileID
+
+        except OSError as err:
+            print("File creation error:", err.errno, flush=True)
+            return None
+
+        except sqlite3.IntegrityError as err:
+            print(f"Receipt {html_filename} not added to the receipt directory: {err}", flush=True)
+            return None
+
+    @staticmethod
+    def receipt_filename(heureRecept:datetime, self=None) -> str:
+        # receipt<ISO time>_<process>-<number>.html, in the directory of its reception date:  
+        # the receipts received in the same microsecond, by several threads or processes, never share a file
+        name = 'receipt{}_{}-{}.html'.format(heureRecept.isoformat(), os.getpid(), next(ESCPOSHandler.receipt_numbers))
+        return ReceiptCatalog.dated_filename(name, heureRecept)
+
+    @staticmethod
+    def write_receipt(html_filename:str, page:bytes, encodings:list[str]|None = None, self=None) -> tuple[str, int]:
+        """ Write the finished receipt in web/receipts:  as it is, or only in the compressed encodings of ESCPOS_RECEIPT_COMPRESSION, 
+            which the web app sends as they are stored.  
+            Each file is written under a temporary name then renamed, so a receipt being rewritten is never sent half-written.
+
+        Args:
+            html_filename (str): the receipt's filename in web/receipts
+            page (bytes): the finished page, in UTF-8
+            encodings (list[str]|None): the encodings to store, or None for the ones of ESCPOS_RECEIPT_COMPRESSION
+
+        Returns:
+            tuple[str, int]: the encodings the receipt is stored as, separated by commas, or '' if it is stored as it is, 
+                             and the bytes stored
+        """        
+        if encodings is None:
+            encodings = ESCPOSHandler.receipt_encodings
+        variant_files = stored_receipt_files(html_filename, encodings)
+        variants:list[tuple[PurePath, bytes]] = [(variant_files[0], page)] if not encodings else \
+            [(variant_file, RECEIPT_ENCODINGS[encoding].compress(page)) for variant_file, encoding in zip(variant_files, encodings)]
+
+        os.makedirs(variant_files[0].parent, exist_ok=True)
+        for variant_file, content in variants:
+            temporary_file = variant_file.with_name('.{}.tmp'.format(variant_file.name))
+            with open(temporary_file, mode='wb') as nouveauRecu:
+                nouveauRecu.write(content)
+            os.replace(temporary_file, variant_file)
+        return ','.join(encodings), sum(len(content) for variant_file, content in variants)
 
     @staticmethod
-    def add_html_title(heureRecept:datetime, recu:str, self=None)->str:
-        """ Ajouter un titre au reçu """
-        recuConvert:etree.ElementTree  = html.fromstring(recu)
+    def finalize_receipt(heureRecept:datetime, recu:str, printer:PrinterProfile|None = None, self=None)->str:
+        """ Add the title, the page wrapper and the footer to the receipt, once, so the web app can send the file as it is.
+            With the image store and the linked stylesheet, the images and the stylesheet are also replaced by links.
 
-        theHead:etree.Element = recuConvert.head
-        newTitle = etree.Element("title")
-        newTitle.text = "Reçu imprimé le {}".format(heureRecept.isoformat())
-        theHead.append(newTitle)
+        Args:
+            heureRecept (datetime): the reception time, used in the title
+            recu (str): the receipt in HTML, as converted by esc2html.php
+            printer (PrinterProfile|None): the virtual printer, whose paper width is given to the receipt
 
-        return html.tostring(recuConvert).decode()
+        Returns:
+            str: the finished page
+        """        
+        if ESCPOSHandler.image_store is not None:
+            recu = ESCPOSHandler.image_store.extract(recu)
+        if ESCPOSHandler.linked_stylesheet is not None:
+            # The receipts converted by CUPS without the web app still inline the stylesheet
+            recu = ESCPOSHandler.linked_stylesheet.link(recu)
+
+        head_end:int = recu.find('</head>')
+        body_start:int = recu.find('<body>', head_end)
+        body_end:int = recu.rfind('</body>')
+        if head_end < 0 or body_start < 0 or body_end < body_start:
+            print("Unexpected receipt structure: published as converted", flush=True)
+            return recu
+
+        # The paper of the printer, when it is not the one of the stylesheet
+        paper_style:str = '' if printer is None or printer.paper_width == PrinterProfile.STYLESHEET_PAPER_WIDTH else \
+            "<style>.esc-receipt {{ width: {}mm; }}</style>".format(printer.paper_width)
+
+        # Cut the receipt at the end of the head and at the start and end of the body, and put it back together with the additions
+        return ''.join([recu[:head_end],
+                        "<title>Reçu imprimé le {}</title>".format(heureRecept.isoformat()),
+                        paper_style,
+                        recu[head_end:body_start],
+                        RECEIPT_PAGE_START,
+                        recu[body_start + len('<body>'):body_end],
+                        '</div>', app.jinja_env.get_template('footer.html').render(),
+                        recu[body_end:]])
     
     @staticmethod
-    def add_receipt_to_directory(new_filename: str, self=None) -> None:
-        # Add an entry in the reference file with the new filename and an unique ID.
-        # Open the CSV file in read mode to count the existing rows
+    def add_receipt_to_directory(new_filename: str, heureRecept:datetime, source:str = "JetDirect", etag:str|None = None, 
+                                 encodings:str = '', linked_stylesheet:bool = False, size:int|None = None, printer:str|None = None, 
+                                 self=None) -> int:
+        """ Add a published receipt in the receipt catalog, which gives it a unique ID
+
+        Args:
+            new_filename (str): the receipt's file in web/receipts
+            heureRecept (datetime): the reception time
+            source (str): where the print comes from (JetDirect, CUPS or LPD)
+            etag (str|None): the validator of the receipt's file
+            encodings (str): the compressed variants the receipt is stored as (see write_receipt)
+            linked_stylesheet (bool): True if the receipt links to the shared stylesheet
+            size (int|None): the bytes stored for the receipt
+            printer (str|None): the name of the virtual printer that received a JetDirect print
+
+        Returns:
+            int: the receipt's ID
+        """        
+        return receipt_catalog.add(new_filename, heureRecept, source, etag, encodings, linked_stylesheet, size, printer)
+
+
+#Conversion pipeline between the reception and the receipt directory
+class ConversionQueue:
+    """
+        The handlers submit their reception files here and go back to receiving right away.  
+        A pool of worker threads converts the files to HTML in parallel (each conversion is its own PHP process),
+        then the receipts are published in the directory in the order they were received.
+        The queue is bounded:  when it is full, the handlers wait before submitting.
+    """
+    DEFAULT_WORKERS = os.cpu_count() or 2
+    DEFAULT_DEPTH = 64
+
+    def __init__(self, workers:int = DEFAULT_WORKERS, depth:int = DEFAULT_DEPTH):
+        self.workers = workers
+        self.jobs:queue.Queue = queue.Queue(maxsize=depth)
+        self.submit_lock = threading.Lock()
+        self.publish_turn = threading.Condition()
+        self.next_job:int = 0  # Number of the next submitted job
+        self.next_to_publish:int = 0  # Number of the next job to publish
+        self.converting:int = 0  # Number of jobs taken by the workers but not yet published
+
+    def start(self) -> None:
+        for number in range(self.workers):
+            worker = threading.Thread(target=self.work, name=f"conversion-{number}", daemon=True)
+            worker.start()
+        print(f"{self.workers} conversion workers started", flush=True)
+
+    def submit(self, bin_filename:PurePath, heureRecept:datetime, netprinter_debugmode:str = "false", source:str = "JetDirect", 
+               published:Future|None = None, printer:PrinterProfile|None = None) -> None:
+        """ Queue a reception file for conversion.  Waits if the queue is full.
+
+        Args:
+            bin_filename (PurePath): the reception file.  It is removed after conversion, except in debug mode.
+            heureRecept (datetime): the reception time
+            netprinter_debugmode (str): 'True' to convert in debug mode
+            source (str): where the print comes from (JetDirect, CUPS or LPD)
+            published (Future|None): gets the ID of the published receipt, or None if nothing was published
+            printer (PrinterProfile|None): the virtual printer that received a JetDirect print
+        """        
+        # Number and queue the jobs in the same order, so the oldest unpublished job is always the first one taken by a worker.
+        with self.submit_lock:
+            self.jobs.put((self.next_job, bin_filename, heureRecept, netprinter_debugmode, source, published, printer))
+            self.next_job = self.next_job + 1
+        backlog = self.backlog()
+        print(f"Receipt queued for conversion: {backlog['queued']} waiting, {backlog['converting']} converting", flush=True)
+
+    def backlog(self) -> dict:
+        """ Get the state of the conversion queue
+
+        Returns:
+            dict: the number of jobs waiting and converting, and the queue's configuration
+        """        
+        return {'queued': self.jobs.qsize(), 'converting': self.converting, 'workers': self.workers, 'depth': self.jobs.maxsize}
+
+    def work(self) -> None:
+        # Convert jobs for the eternity
+        while True:
+            job_number, bin_filename, heureRecept, netprinter_debugmode, source, published, printer = self.jobs.get()
+            with self.publish_turn:
+                self.converting = self.converting + 1
+            recu:str|None = None
+            try:
+                print("Printing ", bin_filename, flush=True)
+                recu = ESCPOSHandler.convert_toHTML(bin_filename, netprinter_debugmode, source)
+            except Exception as err:
+                print(f"Unexpected {err=}, {type(err)=} while converting {bin_filename}", flush=True)
+            # Always take this job's turn, even if publishing fails, or the next jobs would never be published
+            try:
+                self.publish_in_order(job_number, heureRecept, recu, source, published, printer)
+            except Exception as err:
+                print(f"Unexpected {err=}, {type(err)=} while publishing {bin_filename}", flush=True)
+            finally:
+                self.jobs.task_done()
+            if netprinter_debugmode != 'True':
+                try:
+                    os.remove(bin_filename)  #In debug mode, we keep the received data for inspection.
+                except OSError as err:
+                    print(f"Could not remove {bin_filename}: {err}", flush=True)
+
+    def publish_in_order(self, job_number:int, heureRecept:datetime, recu:str|None, source:str = "JetDirect", 
+                         published:Future|None = None, printer:PrinterProfile|None = None) -> None:
+        # Wait for the previous jobs to be published, then publish this one (a failed conversion publishes nothing but still takes its turn).
+        with self.publish_turn:
+            while job_number != self.next_to_publish:
+                self.publish_turn.wait()
+            fileID:int|None = None
+            try:
+                if recu is not None:
+                    fileID = ESCPOSHandler.publish_receipt(heureRecept, recu, source, printer)
+            finally:
+                self.next_to_publish = self.next_to_publish + 1
+                self.converting = self.converting - 1
+                self.publish_turn.notify_all()
+                if published is not None:
+                    published.set_result(fileID)
+
+
+def spool_job(rfile, length:int|None) -> tuple[PurePath, int]:
+    """ Stream a print job to its own reception file, without holding it in memory
+
+    Args:
+        rfile: where the job is read from
+        length (int|None): the length of the job, or None to read until the end of the connection
+
+    Returns:
+        tuple[PurePath, int]: the reception file, and the bytes received
+    """    
+    received:int = 0
+    with ESCPOSHandler.open_reception_file() as binfile:
+        while length is None or received < length:
+            chunk = rfile.read(65536 if length is None else min(length - received, 65536))
+            if not chunk:
+                break
+            binfile.write(chunk)
+            received = received + len(chunk)
+    return PurePath(binfile.name), received
+
+
+def publish_job(bin_filename:PurePath, heureRecept:datetime, netprinter_debugmode:str, source:str, wait:bool = True) -> int|None:
+    """ Convert a reception file and publish its receipt, through the conversion queue when it is started
+
+    Args:
+        bin_filename (PurePath): the reception file.  It is removed after conversion, except in debug mode.
+        heureRecept (datetime): the reception time
+        netprinter_debugmode (str): 'True' to convert in debug mode
+        source (str): where the print comes from (CUPS or LPD)
+        wait (bool): wait until the receipt is published.  Without the conversion queue, the receipt is always published before returning.
+
+    Returns:
+        int|None: the receipt's ID, or None if nothing was published or if the publication was not waited for
+    """    
+    if ESCPOSHandler.conversion_queue is not None:
+        #The conversion workers take it from here, and tell us when the receipt is published.
+        published:Future|None = Future() if wait else None
+        ESCPOSHandler.conversion_queue.submit(bin_filename, heureRecept, netprinter_debugmode, source, published)
+        return None if published is None else published.result()
+    try:
+        recu:str|None = ESCPOSHandler.convert_toHTML(bin_filename, netprinter_debugmode, source)
+    finally:
+        if netprinter_debugmode != 'True':
+            os.remove(bin_filename)  #In debug mode, we keep the received data for inspection.
+    return None if recu is None else ESCPOSHandler.publish_receipt(heureRecept, recu, source)
+
+
+#Local handoff of the CUPS print jobs
+class CUPSHandoffHandler(socketserver.StreamRequestHandler):
+    """
+        Receives one print job from the CUPS backend (cups/esc2handoff.py) on the handoff socket.  
+        The request is "PRINT <debug> <length> <job id> <user> <title>\n" followed by the <length> bytes of the ESC/POS job, 
+        and the response is "OK <receipt id>\n" once the receipt is published, or "ERROR <reason>\n".
+        The job goes through the same conversion queue and publication as the JetDirect jobs, 
+        and each job has its own reception file, so the concurrent CUPS jobs never share a file.
+        The request "BACKLOG\n" gets the state of the conversion queue in JSON, for the web processes of gunicorn.
+    """
+
+    def handle(self) -> None:
+        try:
+            header = self.rfile.readline(4096).decode('utf-8').rstrip('\n').split(' ', 5)
+            if header[0] == 'BACKLOG':
+                self.respond(json.dumps(conversion_backlog()))
+                return
+            if header[0] != 'PRINT' or len(header) < 3:
+                raise ValueError("expected PRINT <debug> <length> <job id> <user> <title>")
+            netprinter_debugmode, length = header[1], int(header[2])
+            metadata = header[3:] + [''] * (6 - len(header))
+        except (ValueError, UnicodeDecodeError) as err:
+            self.respond(f"ERROR Bad request: {err}")
+            return
+        print(f"CUPS job {metadata[0]} from {metadata[1]}: {metadata[2]}", flush=True)
+
+        heureRecept = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE))
+        bin_filename, received = spool_job(self.rfile, length)
+        if received < length:
+            os.remove(bin_filename)
+            self.respond(f"ERROR Job truncated: {received} of {length} bytes received")
+            return
+
+        fileID:int|None = publish_job(bin_filename, heureRecept, netprinter_debugmode, "CUPS")
+        self.respond("ERROR Conversion failed" if fileID is None else f"OK {fileID}")
+
+    def respond(self, response:str) -> None:
+        self.wfile.write(response.encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class CUPSHandoffServer(socketserver.ThreadingUnixStreamServer):
+    """
+        The handoff socket of the CUPS backend, one thread per job.  
+        The socket can be used by the lp user CUPS runs the backends as.
+    """
+    DEFAULT_PATH = PurePath('web', 'tmp', 'cups.sock')
+    daemon_threads = True  # Do not wait for the jobs in progress when stopping
+
+    def server_bind(self) -> None:
         try:
-            with open(PurePath('web', 'receipt_list.csv'), mode='r') as fileDirectory:
-                reader = csv.reader(fileDirectory)
-                # Count the number of rows, starting from 1 (to include the header)
-                next_fileID = sum(1 for row in reader) + 1
-                fileDirectory.close()
+            os.remove(self.server_address)  # Left by the previous run
         except FileNotFoundError:
-            # Create the CSV file with the headers
-            with open(PurePath('web', 'receipt_list.csv'), mode='w', newline='') as fileDirectory:
-                writer = csv.writer(fileDirectory)
-                writer.writerow(['next_fileID', 'filename'])
-                fileDirectory.close()
-            next_fileID = 1  # If the file does not exist, start IDs is 1
-        # Now, id holds the next sequential ID
-
-        # Open the CSV file in append mode to add a new row
-        with open(PurePath('web', 'receipt_list.csv'), mode='a', newline='') as fileDirectory:
-            writer = csv.writer(fileDirectory)
-            # Append a new line to the CSV file with the new ID and filename
-            writer.writerow([next_fileID, new_filename])    
-               
+            pass
+        super().server_bind()
+        os.chmod(self.server_address, 0o666)
+
+    def remove_socket(self) -> None:
+        # Without the socket, the CUPS backend converts the jobs itself while the netprinter is stopped
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+#Native LPD printer (RFC 1179)
+class LPDHandler(socketserver.StreamRequestHandler):
+    """
+        Receives the print jobs of the LPD protocol (RFC 1179) without CUPS:  lpr, the POS systems and the CUPS of other hosts 
+        print to the netprinter directly.  Each data file is streamed to its own reception file and acknowledged, 
+        then goes through the same conversion queue and publication as the JetDirect jobs once its control file is received.  
+        All the queue names print to this printer.
+    """
+    ACK = b'\x00'
+    NACK = b'\x01'
+    # The daemon commands (RFC 1179, section 5)
+    PRINT_WAITING_JOBS = 0x01
+    RECEIVE_JOB = 0x02
+    QUEUE_STATE_SHORT = 0x03
+    QUEUE_STATE_LONG = 0x04
+    REMOVE_JOBS = 0x05
+    # The subcommands of RECEIVE_JOB (RFC 1179, section 6)
+    ABORT_JOB = 0x01
+    CONTROL_FILE = 0x02
+    DATA_FILE = 0x03
+    # The control file lines that print a data file:  the formats (RFC 1179, section 7)
+    PRINT_FORMATS = 'cdfglnoprtv'
+
+    def handle(self) -> None:
+        self.netprinter_debugmode = getenv('ESCPOS_DEBUG', "false")
+        line = self.rfile.readline(1024)
+        if not line:
+            return
+        command, operands = line[0], line[1:].rstrip(b'\n').decode('latin-1').split()
+        if command == self.RECEIVE_JOB:
+            self.wfile.write(self.ACK)
+            self.receive_jobs()
+        elif command in (self.QUEUE_STATE_SHORT, self.QUEUE_STATE_LONG):
+            queue_name = operands[0] if operands else 'lp'
+            conversion_queue:ConversionQueue|None = ESCPOSHandler.conversion_queue
+            waiting:int = 0 if conversion_queue is None else conversion_queue.backlog()['queued']
+            self.wfile.write(f"{queue_name}: ready, {waiting} jobs waiting for conversion\n".encode('latin-1'))
+        # PRINT_WAITING_JOBS and REMOVE_JOBS:  the jobs are printed as soon as they are received, there is nothing to start or remove
+
+    def receive_jobs(self) -> None:
+        # The subcommands of one or more jobs, until the sender closes the connection
+        data_files:dict[str, tuple[PurePath, datetime]] = {}  # The data files received, by name
+        control:dict[str, list[str]]|None = None  # The lines of the control file, by code
+        try:
+            while (line := self.rfile.readline(1024)):
+                subcommand, operands = line[0], line[1:].rstrip(b'\n').decode('latin-1').split(' ', 1)
+                if subcommand == self.ABORT_JOB:
+                    self.discard(data_files)
+                    control = None
+                    continue
+                if subcommand not in (self.CONTROL_FILE, self.DATA_FILE) or len(operands) != 2 or not operands[0].isdigit():
+                    self.wfile.write(self.NACK)
+                    return
+                length, name = int(operands[0]), operands[1]
+                self.wfile.write(self.ACK)
+
+                if subcommand == self.CONTROL_FILE:
+                    control = self.parse_control_file(self.rfile.read(length))
+                else:
+                    # A length of 0:  the data file goes to the end of the connection (an extension of LPRng)
+                    heureRecept = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE))
+                    bin_filename, received = spool_job(self.rfile, length or None)
+                    data_files[name] = (bin_filename, heureRecept)
+                    if length == 0:
+                        break
+                    if received < length:
+                        return  # Connection lost:  the job is discarded
+                # The sender ends each file with a 0 byte
+                if self.rfile.read(1) != b'\x00':
+                    self.wfile.write(self.NACK)
+                    return
+                self.wfile.write(self.ACK)
+
+                if control is not None and all(name in data_files for name in self.printed_files(control)):
+                    self.print_job(control, data_files)
+                    data_files = {}
+                    control = None
+            if data_files:
+                # The data files of a job without a control file are printed too
+                self.print_job(control or {}, data_files)
+                data_files = {}
+        finally:
+            self.discard(data_files)
+
+    @classmethod
+    def parse_control_file(cls, control_file:bytes) -> dict[str, list[str]]:
+        # Each line is a one-letter code and its operand:  H host, P user, J job name, and the print formats with their data file
+        control:dict[str, list[str]] = {}
+        for line in control_file.decode('latin-1').splitlines():
+            if line:
+                control.setdefault(line[0], []).append(line[1:])
+        return control
+
+    @classmethod
+    def printed_files(cls, control:dict[str, list[str]]) -> set[str]:
+        return {name for code in cls.PRINT_FORMATS for name in control.get(code, [])}
+
+    def print_job(self, control:dict[str, list[str]], data_files:dict[str, tuple[PurePath, datetime]]) -> None:
+        print(f"LPD job {control.get('J', [''])[0]} from {control.get('P', ['-'])[0]}@{control.get('H', ['-'])[0]}: "
+              f"{len(data_files)} data files", flush=True)
+        for bin_filename, heureRecept in data_files.values():
+            publish_job(bin_filename, heureRecept, self.netprinter_debugmode, "LPD", wait=False)
+
+    def discard(self, data_files:dict[str, tuple[PurePath, datetime]]) -> None:
+        # The data files of an aborted or interrupted job
+        for bin_filename, heureRecept in data_files.values():
+            os.remove(bin_filename)
+        data_files.clear()
+
+
+class LPDServer(socketserver.ThreadingTCPServer):
+    """
+        The LPD port (ESCPOS_LPD_PORT), one thread per connection.
+    """
+    daemon_threads = True  # Do not wait for the connections in progress when stopping
+    allow_reuse_address = True
+
+
+#Resident PHP converters
+class PHPWorker:
+    """
+        One esc2html-worker.php process.  It converts jobs sent on its stdin until its stdin is closed.
+        See esc2html-worker.php for the framing of the requests and responses.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(["php", "esc2html-worker.php"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.jobs:int = 0  # Number of jobs converted by this process
+
+    def convert(self, data:bytes, netprinter_debugmode:str, timeout:float, css_href:str|None = None) -> tuple[str, bytes, bytes]:
+        """ Convert one job
+
+        Args:
+            data (bytes): the ESC/POS data
+            netprinter_debugmode (str): 'True' to convert in debug mode
+            timeout (float): seconds before the worker is killed
+            css_href (str|None): the URL of the stylesheet to link the receipt to, or None to inline the stylesheet
+
+        Raises:
+            OSError: the worker died, or was killed after the timeout
+
+        Returns:
+            tuple[str, bytes, bytes]: the status (OK or ERROR), the HTML and the log of the conversion
+        """        
+        self.jobs = self.jobs + 1
+        debug = '1' if netprinter_debugmode == 'True' else '0'
+        # A stuck conversion is killed:  the reads below then end and the worker is replaced.
+        watchdog = threading.Timer(timeout, self.process.kill)
+        watchdog.start()
+        try:
+            stylesheet = '' if css_href is None else f" {css_href}"
+            self.process.stdin.write(f"CONVERT {debug} {len(data)}{stylesheet}\n".encode())
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().split()
+            if len(header) != 3 or header[0] not in (b'OK', b'ERROR'):
+                raise OSError(f"esc2html-worker.php stopped (exit code {self.process.poll()})")
+            html_length, log_length = int(header[1]), int(header[2])
+            recu = self.process.stdout.read(html_length)
+            log = self.process.stdout.read(log_length)
+            if len(recu) != html_length or len(log) != log_length:
+                raise OSError(f"esc2html-worker.php stopped during a response (exit code {self.process.poll()})")
+            return header[0].decode(), recu, log
+        finally:
+            watchdog.cancel()
+
+    def stop(self) -> None:
+        # Closing stdin ends the worker's loop
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class PHPWorkerPool:
+    """
+        A pool of resident esc2html-worker.php processes, so a conversion does not pay the startup of PHP, 
+        of the autoloader and of the stylesheet.
+        A worker is replaced after max_jobs conversions (to bound the leaks of a long-running PHP process), or when it dies.  
+        If PHP cannot be started, the pool keeps a None in its place, and the next conversion that gets it starts it again.
+    """
+    DEFAULT_MAX_JOBS = 500
+    DEFAULT_TIMEOUT = 60
+
+    def __init__(self, workers:int, max_jobs:int = DEFAULT_MAX_JOBS, timeout:float = DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.idle:queue.Queue = queue.Queue()
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            self.idle.put(PHPWorker())
+        print(f"{self.workers} PHP converters started", flush=True)
+
+    def run(self, bin_filename:PurePath, netprinter_debugmode:str = "false", css_href:str|None = None) -> CompletedProcess:
+        """ Convert a reception file in the first idle worker.  Waits if they are all busy.
+
+        Args:
+            bin_filename (PurePath): the reception file
+            netprinter_debugmode (str): 'True' to convert in debug mode
+            css_href (str|None): the URL of the stylesheet to link the receipt to, or None to inline the stylesheet
+
+        Raises:
+            subprocess.CalledProcessError: the conversion failed, like subprocess.run(check=True) would
+
+        Returns:
+            CompletedProcess: the HTML in stdout and the log in stderr, like subprocess.run(capture_output=True, text=True)
+        """        
+        with open(bin_filename, mode='rb') as binfile:
+            data = binfile.read()
+        args = ["esc2html-worker.php", bin_filename.as_posix()]
+        worker:PHPWorker|None = self.idle.get()
+        try:
+            if worker is None:
+                worker = PHPWorker()  # It could not be started before
+            status, recu, log = worker.convert(data, netprinter_debugmode, self.timeout, css_href)
+        except (OSError, ValueError) as err:
+            print(f"PHP converter failed: {err}, starting a new one", flush=True)
+            worker = self.replace(worker)
+            raise subprocess.CalledProcessError(-1, args, "", str(err))
+        finally:
+            if worker is not None and worker.jobs >= self.max_jobs:
+                worker = self.replace(worker)
+            # Always give a worker back, or the conversions would wait for good
+            self.idle.put(worker)
+
+        if status != 'OK':
+            raise subprocess.CalledProcessError(1, args, recu.decode(errors='replace'), log.decode(errors='replace'))
+        return CompletedProcess(args, 0, recu.decode(), log.decode(errors='replace'))
+
+    def replace(self, worker:'PHPWorker|None') -> 'PHPWorker|None':
+        """ Stop a worker and start a new one
+
+        Args:
+            worker (PHPWorker|None): the worker to stop, or None if it was not started
+
+        Returns:
+            PHPWorker|None: the new worker, or None if PHP could not be started
+        """        
+        if worker is not None:
+            worker.stop()
+        try:
+            return PHPWorker()
+        except OSError as err:
+            print(f"PHP converter could not be started: {err}", flush=True)
+            return None
+
+    def stop(self) -> None:
+        for _ in range(self.workers):
+            worker:PHPWorker|None = self.idle.get()
+            if worker is not None:
+                worker.stop()
+
+
+#Data received by the asyncio JetDirect server does not contain a whole command yet
+class IncompleteCommand(Exception):
+    def __init__(self, needed:int):
+        super().__init__(f"{needed} more bytes needed")
+        self.needed = needed
+
+
+#Replayable read buffer for the asyncio JetDirect server
+class ReplayReader:
+    """
+        Stand-in for the handler's rfile, filled by the event loop.
+        When a read asks for more than what has been received, IncompleteCommand is raised instead of blocking:  
+        the reader then goes back to the last complete command (rollback) and the command is processed again once more data has come.
+        After the end of the stream, reads return what is left, like a socket file does.
+    """
+    PEEK_SIZE = 4096
+
+    def __init__(self):
+        self.data = bytearray()
+        self.position:int = 0
+        self.at_eof:bool = False
+
+    def feed(self, data:bytes) -> None:
+        self.data.extend(data)
+
+    def feed_eof(self) -> None:
+        self.at_eof = True
+
+    def available(self) -> int:
+        return len(self.data) - self.position
+
+    def _take(self, size:int) -> bytes:
+        if size > self.available() and not self.at_eof:
+            raise IncompleteCommand(size - self.available())
+        data = bytes(self.data[self.position:self.position + size])
+        self.position = self.position + len(data)
+        return data
+
+    def read(self, size:int = -1) -> bytes:
+        if size is None or size < 0:
+            if not self.at_eof:
+                raise IncompleteCommand(1)
+            size = self.available()
+        return self._take(size)
+
+    def read1(self, size:int = -1) -> bytes:
+        if self.available() == 0:
+            return self._take(1)
+        return self._take(min(size, self.available()) if size > 0 else self.available())
+
+    def peek(self, size:int = 0) -> bytes:
+        if self.available() == 0 and not self.at_eof:
+            raise IncompleteCommand(1)
+        return bytes(self.data[self.position:self.position + min(max(size, 1), self.PEEK_SIZE)])
+
+    def commit(self) -> None:
+        # Everything before the current position has been processed:  forget it.
+        del self.data[:self.position]
+        self.position = 0
+
+    def rollback(self) -> None:
+        self.position = 0
+
+
+#Response buffer for the asyncio JetDirect server
+class ResponseBuffer:
+    """
+        Stand-in for the handler's wfile.  The responses to a command are only sent once the command is complete, 
+        so a command processed again after a rollback does not answer twice.
+    """
+    def __init__(self):
+        self.pending = bytearray()
+        self.ready = bytearray()
+
+    def write(self, data:bytes) -> int:
+        self.pending.extend(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass  # The event loop sends the committed responses
+
+    def commit(self) -> None:
+        self.ready.extend(self.pending)
+        self.pending.clear()
+
+    def rollback(self) -> None:
+        self.pending.clear()
+
+    def take(self) -> bytes:
+        data = bytes(self.ready)
+        self.ready.clear()
+        return data
+
+
+#One JetDirect connection served by the asyncio server
+class AsyncESCPOSSession(ESCPOSHandler):
+    """
+        Reuse all of ESCPOSHandler's command processing and status responses, on data received by the event loop.
+        The socket is never touched here:  rfile and wfile are in-memory buffers that AsyncESCPOSServer fills and empties.
+        An incomplete command is processed again from its start once more data has come, except for its payload (images, BMP files):  
+        the command is kept up to its payload, which is streamed to the receive buffer as it comes, so it is never held in memory.
+    """
+    def __init__(self, client_address, spool_max_memory:int, printer:PrinterProfile):
+        # NOTE: we do not call StreamRequestHandler.__init__, which would serve a socket right away.
+        self.client_address = client_address
+        self.printer = printer
+        self.netprinter_debugmode = getenv('ESCPOS_DEBUG', "false")
+        self.netprinter_scanmode = getenv('ESCPOS_SCAN_MODE', "chunked")
+        self.netprinter_jobsplit = getenv('ESCPOS_JOB_SPLIT', "cut,init")
+        self.rfile = ReplayReader()
+        self.wfile = ResponseBuffer()
+        self.receive_buffer = JobSpool(spool_max_memory)
+        self.job_content:set[str] = set()
+        self.finished_segments:list = []
+        self.committed_size:int = 0  # The size of the receive buffer when the last data was kept
+        self.resume:Callable[[], None]|None = None  # Continues the command interrupted after the last data kept, if any
+        self.payload_remaining:int = 0  # Bytes of the current payload not received yet
+        self.after_payload:Callable[[], None]|None = None  # What the command does after its payload, when it is resumed
+
+    def process_received_data(self) -> int:
+        """Process all the complete commands received so far.  An incomplete command is left for the next time.
+
+        Returns:
+            int: the number of bytes still needed to complete the current command (0 if all the data has been processed)
+        """        
+        self.committed_size = len(self.receive_buffer)
+        try:
+            if self.resume is not None:
+                #Finish the command interrupted in its payload
+                self.resume()
+                self.commit()
+            for indata_statuscheck in self.scan_received_data():
+                self.receive_buffer.append(indata_statuscheck)
+                #This command is complete:  keep it and release its responses
+                self.commit()
+        except IncompleteCommand as incomplete:
+            #Go back to the start of the incomplete command (or to the last payload bytes kept), and wait for more data
+            self.receive_buffer.truncate(self.committed_size)
+            self.rfile.rollback()
+            self.wfile.rollback()
+            return incomplete.needed
+        return 0
+
+    def commit(self) -> None:
+        # Keep everything processed so far, and release its responses:  it is not processed again
+        self.committed_size = len(self.receive_buffer)
+        self.rfile.commit()
+        self.wfile.commit()
+
+    def consume_payload(self, num_bytes:int) -> int:
+        """Consume a payload of num_bytes and append it to the receive buffer as it comes.  
+            The command is complete up to its payload:  it is kept, and if the payload is not all received yet, 
+            the next data resumes the payload where it stopped instead of processing the command again.
+
+        Args:
+            num_bytes (int): the payload size
+
+        Returns:
+            int: the number of bytes received
+        """        
+        after_payload, self.after_payload = self.after_payload, None
+        self.payload_remaining = num_bytes
+        self.resume = lambda: self.resume_payload(after_payload)
+        self.commit()
+        received:int = self.stream_payload()
+        self.resume = None
+        return received
+
+    def resume_payload(self, after_payload:Callable[[], None]|None) -> None:
+        self.stream_payload()
+        self.resume = None
+        if after_payload is not None:
+            after_payload()
+
+    def stream_payload(self) -> int:
+        # Append the payload bytes received so far, and keep them.  Raises IncompleteCommand until the whole payload is received.
+        received:int = 0
+        while self.payload_remaining > 0:
+            chunk:bytes = self.rfile.read1(min(self.payload_remaining, self.rbufsize))
+            if not chunk:
+                self.payload_remaining = 0  # The connection ended in the payload
+                break
+            self.receive_buffer.append(chunk)
+            self.payload_remaining = self.payload_remaining - len(chunk)
+            received = received + len(chunk)
+            self.commit()
+        return received
+
+    def stream_fs_q(self, command:bytes) -> bytes:
+        """ FS q - store non-volatile raster graphics:  send the command and the images straight to the receive buffer.  
+            Each image is kept once received, and the next ones are resumed from there.
+
+        Args:
+            command (bytes): FS q and n, the number of images, already received
+
+        Returns:
+            bytes: what is left to forward
+        """        
+        self.receive_buffer.append(command)
+        self.stream_fs_q_images(int.from_bytes(command[2:]))
+        return b''
+
+    def stream_fs_q_images(self, images:int) -> None:
+        for left in range(images - 1, -1, -1):
+            # xL xH yL yH, then the image
+            size:bytes = self.rfile.read(4)
+            self.receive_buffer.append(size)
+            self.after_payload = lambda left=left: self.stream_fs_q_images(left)
+            self.consume_byte_array(size[0:1], size[1:2], size[2:3], size[3:4])
+            self.after_payload = None
+            self.commit()
+            self.resume = lambda left=left: self.stream_fs_q_images(left)
+        self.resume = None
+
+
+#Network ESC/pos printer server based on asyncio
+class AsyncESCPOSServer:
+    """
+        Serve all the JetDirect connections in one event loop:  an idle or slow connection costs a coroutine instead of a blocked thread.
+        Each job has a deadline (ESCPOS_JOB_TIMEOUT seconds from the connection), and the conversion runs in a thread pool 
+        so the event loop never waits for PHP.
+    """
+    DEFAULT_JOB_TIMEOUT = 60
+
+    def __init__(self, server_address, job_timeout:float = DEFAULT_JOB_TIMEOUT, spool_max_memory:int = JobSpool.DEFAULT_MAX_MEMORY, 
+                 reuse_port:bool = False):
+        self.server_address = server_address
+        self.job_timeout = job_timeout
+        self.spool_max_memory = spool_max_memory
+        self.reuse_port = reuse_port
+        self.printer:PrinterProfile = ESCPOSHandler.printer
+        self.loop:asyncio.AbstractEventLoop|None = None
+        self.server:asyncio.Server|None = None
+
+    def __enter__(self) -> 'AsyncESCPOSServer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server_close()
+
+    def serve_forever(self) -> None:
+        asyncio.run(self.serve())
+
+    def server_close(self) -> None:
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        host, port = self.server_address
+        self.server = await asyncio.start_server(self.handle_connection, host, port, reuse_port=self.reuse_port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        client_address = writer.get_extra_info('peername')
+        print (f"Address connected: {client_address}", flush=True)
+        session = AsyncESCPOSSession(client_address, self.spool_max_memory, self.printer)
+        if session.listener_stats is not None:
+            session.listener_stats.count('connections')
+        try:
+            async with asyncio.timeout(self.job_timeout):
+                needed:int = 0
+                while True:
+                    #Wait for at least the bytes needed to complete the current command
+                    chunk:bytes = await reader.read(max(needed, ESCPOSHandler.rbufsize))
+                    if chunk:
+                        session.rfile.feed(chunk)
+                        if session.rfile.available() < needed:
+                            continue
+                    else:
+                        session.rfile.feed_eof()
+                    needed = session.process_received_data()
+                    #Send the status responses as soon as their command is complete
+                    writer.write(session.wfile.take())
+                    await writer.drain()
+                    #Convert the receipts completed so far, without blocking the event loop
+                    if session.finished_segments:
+                        await asyncio.get_running_loop().run_in_executor(None, session.print_finished_segments)
+                    if not chunk:
+                        break
+
+        except TimeoutError:
+            print("Timeout while reading")
+            if len(session.receive_buffer) > 0:
+                print(f"{len(session.receive_buffer)} bytes received.")
+            else: 
+                print("No data received!", flush=True)
+
+        except Exception as err:
+            print(f"Unexpected {err=}, {type(err)=}")
+            raise
+
+        else:
+            #Quand on a reçu le signal de fin de transmission:  convert without blocking the event loop
+            await asyncio.get_running_loop().run_in_executor(None, session.print_received_job)
+            writer.write(b"ESCPOS-netprinter: All done!")  #On dit au client qu'on a fini.
+            await writer.drain()
+            print ("Data reception finished, signature sent.", flush=True)
+
+        finally:
+            session.receive_buffer.close()
+            writer.close()
+
+
+def exit_on_signal(signum:int, frame) -> None:
+    # Exit through the atexit handlers, which stop the child processes.  The same signal sent again meanwhile (to the process group) is ignored.
+    signal.signal(signum, signal.SIG_IGN)
+    sys.exit(0)
+
+
+#Counters of the JetDirect listener processes
+class ListenerStats:
+    """
+        With ESCPOS_LISTENER_PROCESSES, each listener process counts its work in its own row of an array in shared memory, 
+        which the supervisor and the web app add up without asking the listeners.  
+        The listener writes its row, except the pid and the restarts, written by the supervisor.
+    """
+    FIELDS:tuple[str, ...] = ('pid', 'restarts', 'connections', 'published', 'queued', 'converting', 'workers', 'depth')
+    TOTALS:tuple[str, ...] = ('restarts', 'connections', 'published', 'queued', 'converting', 'workers', 'depth')
+
+    def __init__(self, listeners:int):
+        self.listeners = listeners
+        self.counters = multiprocessing.get_context('fork').RawArray('q', listeners * len(self.FIELDS))
+        self.listener:int|None = None  # In a listener process, the number of its row
+        self.lock = threading.Lock()  # The counters of this process are not incremented by two threads at the same time
+
+    def count(self, field:str, value:int = 1) -> None:
+        """ Add to a counter of this listener process.  Does nothing outside of the listener processes.
+
+        Args:
+            field (str): the counter, one of FIELDS
+            value (int): what to add
+        """        
+        if self.listener is not None:
+            self.add(self.listener, field, value)
+
+    def add(self, listener:int, field:str, value:int = 1) -> None:
+        with self.lock:
+            self.counters[listener * len(self.FIELDS) + self.FIELDS.index(field)] += value
+
+    def set(self, listener:int, field:str, value:int) -> None:
+        self.counters[listener * len(self.FIELDS) + self.FIELDS.index(field)] = value
+
+    def row(self, listener:int) -> dict:
+        start = listener * len(self.FIELDS)
+        return {'listener': listener} | dict(zip(self.FIELDS, self.counters[start:start + len(self.FIELDS)]))
+
+    def backlog(self, local_backlog:dict|None = None) -> dict:
+        """ Add up the counters of the listener processes
+
+        Args:
+            local_backlog (dict|None): the backlog of the conversion queue of this process (for CUPS and LPD), added to the totals
+
+        Returns:
+            dict: the totals, like the backlog of one conversion queue, and the counters of each listener in 'listeners'
+        """        
+        rows = [self.row(listener) for listener in range(self.listeners)]
+        totals = {field: sum(row[field] for row in rows) for field in self.TOTALS}
+        if local_backlog is not None:
+            for field in ('queued', 'converting', 'workers', 'depth'):
+                totals[field] = totals[field] + local_backlog[field]
+        return totals | {'listeners': rows}
+
+
+#Multi-process JetDirect listeners
+class ListenerSupervisor:
+    """
+        With ESCPOS_LISTENER_PROCESSES, the JetDirect ports are served by that many listener processes, each bound to the ports 
+        of all the virtual printers with SO_REUSEPORT:  the kernel spreads the connections over them, so the scanners run on as many cores.  
+        Each listener has its own conversion queue and PHP workers, and publishes in the shared catalog, 
+        where each process has its own connections.  Within a listener, the receipts are published in the order they were received.
+        The supervisor is a process of its own, forked before any other thread, that restarts the listeners that stop.
+    """
+    RESTART_DELAY = 1  # Seconds before restarting a listener that stopped right after its start
+
+    def __init__(self, host:str, printers:list[PrinterProfile], listeners:int):
+        self.host = host
+        self.printers = printers
+        self.stats = ListenerStats(listeners)
+        self.context = multiprocessing.get_context('fork')
+        self.process:multiprocessing.Process|None = None
+
+    def start(self) -> multiprocessing.Process:
+        """ Start the supervisor process, which starts the listeners
+
+        Returns:
+            multiprocessing.Process: the supervisor process.  It stops its listeners when it is terminated, 
+                                     and when this process stops without terminating it.
+        """        
+        # Not a daemon, which could not start the listeners:  this process terminates it when it exits
+        self.process = self.context.Process(target=self.supervise, name="listener-supervisor")
+        self.process.start()
+        atexit.register(self.process.terminate)
+        return self.process
+
+    def supervise(self) -> None:
+        # Ctrl-C stops the main process, which stops the supervisor, which stops its listeners on exit
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, exit_on_signal)
+        parent = os.getppid()
+        listeners:dict[int, multiprocessing.Process] = {}
+        started:dict[int, float] = {}
+        for number in range(self.stats.listeners):
+            listeners[number], started[number] = self.start_listener(number), time.monotonic()
+        print(f"{self.stats.listeners} JetDirect listeners started", flush=True)
+
+        while True:
+            stopped = multiprocessing.connection.wait([listener.sentinel for listener in listeners.values()], timeout=1)
+            if os.getppid() != parent:
+                sys.exit(0)  # The print services were killed
+            for number, listener in list(listeners.items()):
+                if listener.sentinel not in stopped:
+                    continue
+                listener.join()
+                print(f"JetDirect listener {number} stopped with exit code {listener.exitcode}:  restarted", flush=True)
+                if time.monotonic() - started[number] < self.RESTART_DELAY:
+                    time.sleep(self.RESTART_DELAY)  # Do not restart in a loop a listener that cannot start
+                self.stats.add(number, 'restarts')
+                listeners[number], started[number] = self.start_listener(number), time.monotonic()
+
+    def start_listener(self, number:int) -> multiprocessing.Process:
+        listener = self.context.Process(target=self.serve, args=(number,), name=f"jetdirect-{number}", daemon=True)
+        listener.start()
+        self.stats.set(number, 'pid', listener.pid)
+        return listener
+
+    def serve(self, number:int) -> None:
+        # The listener's counters start over, except the restarts
+        for field in ('connections', 'published', 'queued', 'converting', 'workers', 'depth'):
+            self.stats.set(number, field, 0)
+        self.stats.listener = number
+        ESCPOSHandler.listener_stats = self.stats
+
+        # The receipts are published like in the print services, whose storage maintenance migrates the receipts already stored
+        configure_receipt_compression()
+        if getenv('ESCPOS_STYLESHEET', "inline") == 'linked':
+            ESCPOSHandler.linked_stylesheet = ReceiptStylesheet()
+        if getenv('ESCPOS_IMAGE_STORE', "false") == 'True':
+            start_image_store()
+        if getenv('ESCPOS_SERVER_MODE', "threaded") != 'serial':
+            conversion_queue = start_conversion_queue()
+            self.stats.set(number, 'workers', conversion_queue.workers)
+            self.stats.set(number, 'depth', conversion_queue.jobs.maxsize)
+        if int(getenv('ESCPOS_PHP_WORKERS', "0")) > 0:
+            start_php_workers()
+        threading.Thread(target=self.report, args=(number, os.getppid()), name="listener-stats", daemon=True).start()
+
+        start_print_servers(self.host, self.printers, reuse_port=True)
+        while True:
+            signal.pause()  # Until the supervisor stops this listener
+
+    def report(self, number:int, supervisor:int) -> None:
+        # Copy the backlog of the conversion queue in the counters, and stop with the supervisor
+        while os.getppid() == supervisor:
+            if ESCPOSHandler.conversion_queue is not None:
+                backlog = ESCPOSHandler.conversion_queue.backlog()
+                self.stats.set(number, 'queued', backlog['queued'])
+                self.stats.set(number, 'converting', backlog['converting'])
+            time.sleep(1)
+        os._exit(0)
+
 
 app = Flask(__name__)
+# The largest request body accepted:  the CUPS backend posts whole print jobs to /convert
+app.config['MAX_CONTENT_LENGTH'] = int(getenv('ESCPOS_MAX_REQUEST_BYTES', str(64 * 1024 * 1024)))
+
+def request_from_loopback() -> bool:
+    """ Whether the request comes from this machine, like the CUPS backend's
+
+    Returns:
+        bool: True if the client address is a loopback address
+    """    
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
 
 @app.route("/")
 def accueil():
     return render_template('accueil.html.j2', host = request.host.split(':')[0], 
-                           jetDirectPort=getenv('PRINTER_PORT', '9100'),
-                            debug=getenv('FLASK_RUN_DEBUG', "false") )
+                           printers=app.config.get('PRINTERS') or configured_printers(),
+                            debug=getenv('FLASK_RUN_DEBUG', "false"),
+                            backlog=conversion_backlog() )
+
+@app.route("/queue")
+def show_conversion_queue():
+    """ Show the conversion backlog, for monitoring """
+    return jsonify(conversion_backlog())
+
+def conversion_backlog() -> dict|None:
+    # The conversion queue only exists when the print server runs in this process
+    local_backlog:dict|None = None if ESCPOSHandler.conversion_queue is None else ESCPOSHandler.conversion_queue.backlog()
+    # With the listener processes, add up their counters
+    listener_stats:ListenerStats|None = app.config.get('LISTENER_STATS')
+    if listener_stats is not None:
+        return listener_stats.backlog(local_backlog)
+    if local_backlog is not None:
+        return local_backlog
+    # In the web processes of gunicorn, ask the print services on the handoff socket
+    socket_path:str|None = app.config.get('PRINT_SERVICES_SOCKET')
+    if not socket_path:
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(2)
+            s.connect(socket_path)
+            s.sendall(b'BACKLOG\n')
+            with s.makefile('rb') as response:
+                return json.loads(response.readline())
+    except (OSError, ValueError):
+        return None  # The print services do not answer
 
 @app.route("/receipt")
 def list_receipts():
-    """ List all the receipts available """
-    try:
-        with open(PurePath('web', 'receipt_list.csv'), mode='r') as fileDirectory:
-            # Skip the header and get all the filenames in a list
-            reader = csv.reader(fileDirectory)
-            noms = list()
-            for row in reader:
-                if row[0] == 'next_fileID':
-                    continue # Skip the header
-                else:
-                    # Add the file id and filename to the list
-                    noms.append([row[0], row[1]])
-            # Since the file is found, render the template with the list of filenames
-            # in reverse chronological order (most recent at the top)
-            noms.reverse()
-            return render_template('receiptList.html.j2', receiptlist=noms)
-    except FileNotFoundError:
-        return redirect(url_for('accueil'))
+    """ List the receipts available, one page at a time:  the most recent first, or the ones older than ?before=<id>.  
+        ?printer=<name> lists only the receipts of that virtual printer. """
+    def render() -> str:
+        receipts, older = receipt_page()
+        return render_template('receiptList.html.j2', 
+                               receiptlist=[[receipt['id'], PurePath(receipt['filename']).name, receipt['printer']] for receipt in receipts],
+                               older=older, first_page=request.args.get('before') is None, printer=request.args.get('printer'),
+                               printers=[printer.name for printer in app.config.get('PRINTERS') or configured_printers()])
+    return cached_listing(render)
+
+@app.route("/receipt.json")
+def list_receipts_json():
+    """ List the receipts available in JSON, with the same pages as /receipt """
+    def render() -> Response:
+        receipts, older = receipt_page()
+        return jsonify(receipts=[{'id': receipt['id'], 'filename': receipt['filename'], 'received_at': receipt['received_at'], 
+                                  'source': receipt['source'], 'printer': receipt['printer'], 
+                                  'url': url_for('show_receipt', fileID=receipt['id'])} for receipt in receipts],
+                       next=None if older is None else url_for('list_receipts_json', before=older, limit=len(receipts), 
+                                                               printer=request.args.get('printer')))
+    return cached_listing(render)
+
+def cached_listing(render:Callable[[], str|Response]) -> Response:
+    """ Answer a listing of receipts, or 304 Not Modified if the client already has it.  
+        The listing's ETag is the catalog version, so it is checked without listing the receipts.
+
+    Args:
+        render (Callable[[], str|Response]): renders the listing, only called when the client does not have it
+
+    Returns:
+        Response: the listing, with its ETag, to revalidate on each use
+    """    
+    etag = 'receipts-{}'.format(receipt_catalog.version())
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    # Weak:  the same catalog version is rendered the same way, but not byte for byte in HTML and JSON
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+RECEIPT_PAGE_SIZE = 50
+RECEIPT_PAGE_MAX_SIZE = 500
+
+def receipt_page() -> tuple[list, int|None]:
+    """ Get the page of receipts asked by the ?before=<id>&limit=<count>&printer=<name> parameters
+
+    Returns:
+        tuple[list, int|None]: the receipts, and the ID to ask for the next (older) page, or None if this is the last page
+    """    
+    before:int|None = request.args.get('before', type=int)
+    limit:int = min(max(request.args.get('limit', RECEIPT_PAGE_SIZE, type=int), 1), RECEIPT_PAGE_MAX_SIZE)
+    # Ask for one more receipt to know if there is an older page
+    receipts = receipt_catalog.page(before, limit + 1, request.args.get('printer') or None)
+    if len(receipts) > limit:
+        return receipts[:limit], receipts[limit - 1]['id']
+    return receipts, None
     
 
+# A published receipt never changes:  the browsers and the proxies can keep it
+RECEIPT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 @app.route("/receipt/<int:fileID>")
 def show_receipt(fileID:int):
-    """ Show the receipt with the given ID """
-    # Open the CSV file in read mode
-    with open(PurePath('web', 'receipt_list.csv'), mode='r') as fileDirectory:
-        reader = csv.reader(fileDirectory)
-        # Find the row with the given ID
-        for row in reader:
-            if row[0] == 'next_fileID':
-                continue # Skip the header
-            elif int(row[0]) == fileID:
-                filename = row[1]
-                break
+    """ Show the receipt with the given ID, or answer 304 Not Modified from the catalog if the client already has it """
+    receipt = receipt_catalog.receipt(fileID)
+    if receipt is None:
+        # If the ID is not found, return a 404 error
+        return "Not found", 404
+
+    stored_encodings:list[str] = receipt['encodings'].split(',') if receipt['encodings'] else []
+    etag:str|None = receipt['etag']
+    if etag is None:
+        # Receipts published by the previous versions:  compute their validator once
+        with open(receipt_location(receipt, stored_encodings), mode='rb') as legacyReceipt:
+            etag = receipt_etag(legacyReceipt.read())
+        receipt_catalog.set_etag(fileID, etag)
+
+    # The receipts published by the previous versions are finished when they are shown, so they are never sent as stored
+    encoding:str|None = accepted_receipt_encoding(stored_encodings) if receipt['finalized'] else None
+    if encoding is not None:
+        etag = f'{etag}-{encoding}'  # Each encoding is a different representation, with its own validator
+    last_modified = datetime.fromisoformat(receipt['received_at'])
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+    elif receipt['archive_segment'] is not None:
+        # Archived receipt:  read its gzip member in the archive segment
+        member = ReceiptArchive.read_member(receipt['archive_segment'], receipt['archive_offset'], receipt['archive_length'])
+        if encoding is not None:
+            response = make_response(member)
+            response.headers['Content-Encoding'] = encoding
         else:
-            # If the ID is not found, return a 404 error
+            receipt_html = RECEIPT_ENCODINGS['gzip'].decompress(member)
+            response = make_response(receipt_html if receipt['finalized'] else finish_legacy_receipt(receipt_html.decode('utf-8')))
+        response.mimetype = 'text/html'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.make_conditional(request)
+    elif encoding is not None:
+        # Send the compressed file as it is stored
+        response = send_file(receipt_location(receipt, stored_encodings, encoding), mimetype='text/html', etag=etag, last_modified=last_modified)
+        response.headers['Content-Encoding'] = encoding
+    elif receipt['finalized'] and not stored_encodings:
+        # The receipt was finished when it was published:  send the file as it is
+        response = send_file(receipt_location(receipt, stored_encodings), mimetype='text/html', etag=etag, last_modified=last_modified)
+    else:
+        if stored_encodings:
+            # The client accepts none of the stored encodings:  decompress the receipt (gzip is always stored)
+            with open(receipt_location(receipt, stored_encodings), mode='rb') as compressedReceipt:
+                receipt_html = RECEIPT_ENCODINGS[stored_encodings[0]].decompress(compressedReceipt.read())
+        else:
+            # Receipts published by the previous versions:  add the footer from templates/footer.html
+            with open(receipt_location(receipt, stored_encodings), mode='rt') as legacyReceipt:
+                receipt_html = finish_legacy_receipt(legacyReceipt.read())
+        response = make_response(receipt_html)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.make_conditional(request)
+    response.headers['Cache-Control'] = RECEIPT_CACHE_CONTROL
+    if stored_encodings:
+        response.vary.add('Accept-Encoding')
+    return response
+
+def finish_legacy_receipt(receipt_html:str) -> str:
+    # Receipts published by the previous versions:  add the page wrapper, and the footer from templates/footer.html
+    receipt_html = receipt_html.replace('<body>', RECEIPT_PAGE_START)
+    return receipt_html.replace('</body>', '</div>' + render_template('footer.html') + '</body>')
+
+@app.route("/admin/prune", methods=['POST'])
+def prune_receipts():
+    """ Delete the receipts beyond the budgets of the retention policy now, and report the space reclaimed.  
+        The request needs an "Authorization: Bearer <token>" header with ESCPOS_ADMIN_TOKEN:  without it, pruning is refused. """
+    admin_token = getenv('ESCPOS_ADMIN_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    if not admin_token or not hmac.compare_digest(authorization.encode('utf-8'), f"Bearer {admin_token}".encode('utf-8')):
+        return "Forbidden", 403
+    retention:ReceiptRetention|None = app.config.get('RECEIPT_RETENTION')
+    if retention is None:
+        return jsonify(error="No retention policy:  set ESCPOS_RETENTION_MAX_AGE_DAYS, ESCPOS_RETENTION_MAX_RECEIPTS, "
+                             "ESCPOS_RETENTION_MAX_BYTES or ESCPOS_RETENTION_LOG_MAX_BYTES"), 409
+
+    # In the storage maintenance thread, after the tasks already running
+    deleted, reclaimed = storage_maintenance.submit(retention.prune).result()
+    receipts, size = receipt_catalog.totals()
+    return jsonify(deleted=deleted, reclaimed_bytes=reclaimed, receipts=receipts, bytes=size,
+                   deleted_since_start=retention.deleted_total, reclaimed_bytes_since_start=retention.reclaimed_total)
+
+@app.route("/style/esc2html.<version>.css")
+def show_stylesheet(version:str):
+    """ Send the stylesheet of the receipts.  The current version is kept for good, the previous ones are revalidated """
+    stylesheet:ReceiptStylesheet = app.config['STYLESHEET']
+    if request.if_none_match.contains(stylesheet.version):
+        response = make_response('', 304)
+        response.set_etag(stylesheet.version)
+    else:
+        response = send_file(os.path.abspath(stylesheet.file), mimetype='text/css', etag=stylesheet.version)
+    # The receipts linked to a previous stylesheet get the current one
+    response.headers['Cache-Control'] = RECEIPT_CACHE_CONTROL if version == stylesheet.version else 'no-cache'
+    return response
+
+@app.route("/image/<name>")
+def show_image(name:str):
+    """ Send an image of the image store.  Its name is the hash of its content, so it never changes """
+    if ImageStore.NAME_MATCH.fullmatch(name) is None:
+        return "Not found", 404
+    etag = name.partition('.')[0]
+    if request.if_none_match.contains(etag):
+        # The name is the validator:  no need to look at the file
+        response = make_response('', 304)
+        response.set_etag(etag)
+    else:
+        # The images stay available after the store is turned off, for the receipts that link to them
+        directory = ImageStore.DIRECTORY if ESCPOSHandler.image_store is None else ESCPOSHandler.image_store.directory
+        image_file = os.path.abspath(directory.joinpath(name))
+        if not os.path.exists(image_file):
             return "Not found", 404
-        
-        # If the ID is found, open the html rendering of the receipt and add the footer from templates/footer.html
-        with open(PurePath('web', 'receipts', filename), mode='rt') as receipt:
-            receipt_html = receipt.read()   # Read the file content
-            receipt_html = receipt_html.replace('<body>', '<body style="display: flex;flex-direction: column;min-height: 100vh;"><div id="page" style="flex-grow: 1;">')
-            receipt_html = receipt_html.replace('</body>', '</div>' + render_template('footer.html') + '</body>')  # Append the footer
-            return receipt_html
+        response = send_file(image_file, etag=etag)
+    response.headers['Cache-Control'] = RECEIPT_CACHE_CONTROL
+    return response
+
+def receipt_location(receipt:sqlite3.Row, stored_encodings:list[str], encoding:str|None = None) -> str:
+    """ The absolute path of a receipt's file, for send_file
+
+    Args:
+        receipt (sqlite3.Row): the receipt, from the catalog
+        stored_encodings (list[str]): the encodings the receipt is stored as
+        encoding (str|None): the stored encoding to send, or None for the first file (the receipt, or its gzip variant)
+
+    Returns:
+        str: the file
+    """    
+    filename = locate_receipt(receipt['filename'], receipt['received_at'], stored_encodings)
+    files = stored_receipt_files(filename, stored_encodings)
+    return os.path.abspath(files[0] if encoding is None else files[stored_encodings.index(encoding)])
+
+def accepted_receipt_encoding(stored_encodings:list[str]) -> str|None:
+    """ Choose the stored encoding to send the receipt in, from the request's Accept-Encoding
+
+    Args:
+        stored_encodings (list[str]): the encodings the receipt is stored as
+
+    Returns:
+        str|None: the encoding, or None to send the receipt uncompressed
+    """    
+    if not stored_encodings or 'Accept-Encoding' not in request.headers:
+        return None
+    return request.accept_encodings.best_match([name for name in RECEIPT_ENCODING_PREFERENCE if name in stored_encodings])
     
 
+def cups_temp_file(source_dir:PurePath, filename:str|None) -> PurePath|None:
+    """ Find a file written by the CUPS backend in the CUPS temp directory
+
+    Args:
+        source_dir (PurePath): the CUPS temp directory
+        filename (str|None): the name of the file, without directory
+
+    Returns:
+        PurePath|None: the file, or None if the name is not a plain file name in source_dir
+    """    
+    if not filename or filename in ('.', '..') or PurePath(filename).name != filename or '\0' in filename:
+        return None
+    source_file = source_dir.joinpath(filename)
+    if os.path.dirname(os.path.realpath(source_file)) != os.path.realpath(source_dir):
+        return None  # A link out of the temp directory
+    return source_file
+
+
 @app.route("/newReceipt")
 def publish_receipt_from_CUPS():
-    """ Get the receipt from the CUPS temp directory and publish it in the web/receipts directory and add the corresponding log to our permanent logfile"""
+    """ Get the receipt from the CUPS temp directory and publish it in the web/receipts directory and add the corresponding log to our permanent logfile.
+        The CUPS backend gives the names of the receipt and of its log in the "html" and "log" parameters.
+        Only used by the CUPS backend when the handoff socket is not open (see CUPSHandoffHandler). """
+    if not request_from_loopback():
+        return "Forbidden", 403
     heureRecept = datetime.now(tz=ZoneInfo(myconsts.UTC_ZONE))
     #NOTE: on set dans cups-files.conf le répertoire TempDir:   
     #Extraire le répertoire temporaire de CUPS de cups-files.conf
     source_dir=PurePath('/var', 'spool', 'cups', 'tmp')
     
-    # Get the source filename from the environment variable and create the full path
-    source_filename = os.environ['DEST_FILENAME']
-    source_file = source_dir.joinpath(source_filename)
+    # The files written by this print job, in the CUPS temp directory
+    source_file = cups_temp_file(source_dir, request.args.get('html'))
+    source_log = cups_temp_file(source_dir, request.args.get('log'))
+    if source_file is None or source_log is None:
+        return "The html and log parameters must be file names in the CUPS temp directory", 400
 
     # specify the destination filename
-    new_filename = 'receipt{}.html'.format(heureRecept.isoformat())
+    new_filename = ESCPOSHandler.receipt_filename(heureRecept)
 
-    # Create the full destination path with the new filename
-    destination_file = PurePath('web', 'receipts', new_filename)
-
-    # Read the source file, add the title and write it in the destination file
-    with open(source_file, mode='rt') as receipt:
+    # Read the source file, add the title, page wrapper and footer, and write it in web/receipts
+    with open(source_file, mode='rt', encoding='utf-8') as receipt:
         receipt_html = receipt.read()
-        receipt_html = ESCPOSHandler.add_html_title(heureRecept, receipt_html)
-        with open(destination_file, mode='wt') as newReceipt:
-            newReceipt.write(receipt_html)
-            newReceipt.close()
+        receipt_html = ESCPOSHandler.finalize_receipt(heureRecept, receipt_html).encode('utf-8')
+        encodings, size = ESCPOSHandler.write_receipt(new_filename, receipt_html)
 
-    # Add the new receipt to the directory
-    ESCPOSHandler.add_receipt_to_directory(new_filename)
+    # Add the new receipt to the directory, with its validator
+    ESCPOSHandler.add_receipt_to_directory(new_filename, heureRecept, "CUPS", receipt_etag(receipt_html), encodings,
+                                           ESCPOSHandler.linked_stylesheet is not None, size)
 
     #Load the log file from /var/spool/cups/tmp/ and append it in web/tmp/esc2html_log
-    logfile_filename = os.environ['LOG_FILENAME']
-    # print(logfile_filename)
-    log = open(PurePath('web','tmp', 'esc2html_log'), mode='a')
-    source_log = open(source_dir.joinpath(logfile_filename), mode='rt')
-    log.write(f"CUPS print received at {datetime.now(tz=ZoneInfo('Canada/Eastern')).isoformat()}\n")
-    log.write(source_log.read())
-    log.close()
-    source_log.close()
+    with conversion_log_lock:
+        log = open(PurePath('web','tmp', 'esc2html_log'), mode='a')
+        job_log = open(source_log, mode='rt')
+        log.write(f"CUPS print received at {datetime.now(tz=ZoneInfo('Canada/Eastern')).isoformat()}\n")
+        log.write(job_log.read())
+        log.close()
+        job_log.close()
 
     #send an http acknowledgement
     return "OK"
 
 
-def launchPrintServer(printServ:ESCPOSServer):
-    #Recevoir des connexions, une à la fois, pour l'éternité.  Émule le protocle HP JetDirect
-    """ NOTE: On a volontairement pris la version bloquante pour s'assurer que chaque reçu va être sauvegardé puis converti avant d'en accepter un autre.
+@app.route("/convert", methods=['POST'])
+def convert_from_CUPS():
+    """ Convert the ESC/POS data posted by the CUPS backend and send back the HTML, so CUPS uses the resident PHP converters too.  
+        Only the CUPS backend (cups/esc2file.sh) uses it:  the requests from other machines are refused. """
+    if not request_from_loopback():
+        return "Forbidden", 403
+    netprinter_debugmode = request.args.get('debug', "false")
+    with ESCPOSHandler.open_reception_file() as binfile:
+        binfile.write(request.get_data())
+        bin_filename = PurePath(binfile.name)
+    try:
+        recu:str|None = ESCPOSHandler.convert_toHTML(bin_filename, netprinter_debugmode, "CUPS")
+    finally:
+        if netprinter_debugmode != 'True':
+            os.remove(bin_filename)  #In debug mode, we keep the received data for inspection.
+    if recu is None:
+        return "Conversion failed", 500
+    return recu
+
+
+def start_cups_handoff() -> CUPSHandoffServer|None:
+    """ Receive the CUPS jobs on the handoff socket of ESCPOS_CUPS_SOCKET (web/tmp/cups.sock by default), in a background thread
+
+    Returns:
+        CUPSHandoffServer|None: the started server, or None if ESCPOS_CUPS_SOCKET is empty
+    """    
+    socket_path = getenv('ESCPOS_CUPS_SOCKET', str(CUPSHandoffServer.DEFAULT_PATH))
+    if not socket_path:
+        return None
+    handoff_server = CUPSHandoffServer(socket_path, CUPSHandoffHandler)
+    # Remove the socket when stopping, but not when a forked process (web, listener) exits
+    owner = os.getpid()
+    atexit.register(lambda: handoff_server.remove_socket() if os.getpid() == owner else None)
+    threading.Thread(target=handoff_server.serve_forever, name="cups-handoff", daemon=True).start()
+    print(f"CUPS handoff socket open: {socket_path}", flush=True)
+    return handoff_server
+
+
+def start_lpd_server() -> LPDServer|None:
+    """ Receive the LPD jobs on ESCPOS_LPD_PORT, without CUPS, in a background thread
+
+    Returns:
+        LPDServer|None: the started server, or None if ESCPOS_LPD_PORT is 0
+    """    
+    lpd_port = int(getenv('ESCPOS_LPD_PORT', "0"))
+    if lpd_port <= 0:
+        return None
+    lpd_server = LPDServer((getenv('FLASK_RUN_HOST', '0.0.0.0'), lpd_port), LPDHandler)
+    threading.Thread(target=lpd_server.serve_forever, name="lpd", daemon=True).start()
+    print(f"LPD port open: {lpd_port}", flush=True)
+    return lpd_server
+
+
+def start_conversion_queue() -> ConversionQueue:
+    """ Start the conversion workers (ESCPOS_CONVERSION_WORKERS) behind a queue of ESCPOS_CONVERSION_QUEUE_DEPTH jobs, 
+        and have the JetDirect handlers submit their jobs to it.
+
+    Returns:
+        ConversionQueue: the started queue
+    """    
+    workers = int(getenv('ESCPOS_CONVERSION_WORKERS', str(ConversionQueue.DEFAULT_WORKERS)))
+    depth = int(getenv('ESCPOS_CONVERSION_QUEUE_DEPTH', str(ConversionQueue.DEFAULT_DEPTH)))
+    conversion_queue = ConversionQueue(workers, depth)
+    conversion_queue.start()
+    ESCPOSHandler.conversion_queue = conversion_queue
+    return conversion_queue
+
+
+def start_php_workers() -> PHPWorkerPool:
+    """ Start ESCPOS_PHP_WORKERS resident PHP converters, each replaced after ESCPOS_PHP_WORKER_MAX_JOBS conversions
+
+    Returns:
+        PHPWorkerPool: the started pool
+    """    
+    workers = int(getenv('ESCPOS_PHP_WORKERS', "0"))
+    max_jobs = int(getenv('ESCPOS_PHP_WORKER_MAX_JOBS', str(PHPWorkerPool.DEFAULT_MAX_JOBS)))
+    php_workers = PHPWorkerPool(workers, max_jobs)
+    php_workers.start()
+    ESCPOSHandler.php_workers = php_workers
+    return php_workers
+
+
+def configure_receipt_compression() -> list[str]:
+    """ Store the receipts compressed in the encodings of ESCPOS_RECEIPT_COMPRESSION (gzip, br, zstd, separated by commas).  
+        gzip is always stored with the others, to decompress the receipts for the clients that accept no compression.
+
+    Returns:
+        list[str]: the encodings the receipts are stored as, or [] to store them as they are
+    """    
+    requested = [name.strip() for name in getenv('ESCPOS_RECEIPT_COMPRESSION', "").split(',') if name.strip() not in ('', 'none')]
+    encodings:list[str] = ['gzip'] if requested else []
+    for name in requested:
+        if name not in RECEIPT_ENCODINGS:
+            print(f"Receipt compression {name} is not available:  ignored", flush=True)
+        elif name not in encodings:
+            encodings.append(name)
+    ESCPOSHandler.receipt_encodings = encodings
+    return encodings
+
+
+def start_linked_stylesheet() -> ReceiptStylesheet:
+    """ Link the receipts to the shared stylesheet instead of inlining it (ESCPOS_STYLESHEET=linked), 
+        and remove the inlined stylesheet from the receipts already stored, in the background
+
+    Returns:
+        ReceiptStylesheet: the shared stylesheet
+    """    
+    stylesheet = ReceiptStylesheet()
+    ESCPOSHandler.linked_stylesheet = stylesheet
+    storage_maintenance.submit(lambda: stylesheet.link_stored_receipts(receipt_catalog), "Stylesheet linked in {} stored receipts")
+    return stylesheet
+
+
+def start_retention(background:bool = True) -> ReceiptRetention|None:
+    """ Prune the receipts every ESCPOS_RETENTION_INTERVAL seconds, at most ESCPOS_RETENTION_BATCH receipts at a time, 
+        within the budgets of ESCPOS_RETENTION_MAX_AGE_DAYS, ESCPOS_RETENTION_MAX_RECEIPTS, ESCPOS_RETENTION_MAX_BYTES 
+        and ESCPOS_RETENTION_LOG_MAX_BYTES
+
+    Args:
+        background (bool): False to only prune on request (POST /admin/prune), in the web processes of gunicorn
+
+    Returns:
+        ReceiptRetention|None: the retention, or None if there is no budget
+    """    
+    policy = RetentionPolicy(max_age_days=float(getenv('ESCPOS_RETENTION_MAX_AGE_DAYS', "0")),
+                             max_receipts=int(getenv('ESCPOS_RETENTION_MAX_RECEIPTS', "0")),
+                             max_bytes=int(getenv('ESCPOS_RETENTION_MAX_BYTES', "0")),
+                             log_max_bytes=int(getenv('ESCPOS_RETENTION_LOG_MAX_BYTES', "0")))
+    if not any(budget > 0 for budget in policy):
+        return None
+    retention = ReceiptRetention(receipt_catalog, policy, int(getenv('ESCPOS_RETENTION_BATCH', "100")))
+    app.config['RECEIPT_RETENTION'] = retention
+    if background:
+        storage_maintenance.repeat(retention.tick, float(getenv('ESCPOS_RETENTION_INTERVAL', "300")), "retention")
+        print(f"Retention started: {policy}", flush=True)
+    return retention
+
+
+def start_archive() -> ReceiptArchive|None:
+    """ Archive the receipts older than ESCPOS_ARCHIVE_AFTER_DAYS every ESCPOS_ARCHIVE_INTERVAL seconds, 
+        at most ESCPOS_ARCHIVE_BATCH receipts at a time, in segments of about ESCPOS_ARCHIVE_SEGMENT_BYTES
+
+    Returns:
+        ReceiptArchive|None: the archive, or None if the receipts are not archived
+    """    
+    after_days = float(getenv('ESCPOS_ARCHIVE_AFTER_DAYS', "0"))
+    if after_days <= 0:
+        return None
+    archive = ReceiptArchive(receipt_catalog, after_days, int(getenv('ESCPOS_ARCHIVE_SEGMENT_BYTES', str(ReceiptArchive.DEFAULT_SEGMENT_BYTES))),
+                             int(getenv('ESCPOS_ARCHIVE_BATCH', "500")))
+    storage_maintenance.repeat(archive.tick, float(getenv('ESCPOS_ARCHIVE_INTERVAL', "300")), "archive")
+    print(f"Archive started: receipts older than {after_days} days", flush=True)
+    return archive
+
+
+def start_image_store() -> ImageStore:
+    """ Store the images of the receipts in web/images, once for all the receipts that show them (ESCPOS_IMAGE_STORE)
+
+    Returns:
+        ImageStore: the image store
+    """    
+    image_store = ImageStore()
+    ESCPOSHandler.image_store = image_store
+    return image_store
+
+
+def start_web_process(host:str, port:int) -> multiprocessing.Process:
+    """ Serve the web app with gunicorn (ESCPOS_WEB_SERVER=gunicorn) in its own processes, while the print services keep this process:  
+        ESCPOS_WEB_WORKERS worker processes of ESCPOS_WEB_THREADS threads each.  The processes share the receipts through the catalog, 
+        where each process has its own connections, and their storage maintenance tasks take turns (see StorageMaintenance).
+        The web process is forked, so it is started before any other thread.
+
+    Args:
+        host (str): the address to listen to
+        port (int): the web port
+
+    Returns:
+        multiprocessing.Process: the web process, stopped with this process
+    """    
+    web_process = multiprocessing.get_context('fork').Process(target=serve_web, args=(host, port), name="web", daemon=True)
+    web_process.start()
+    return web_process
+
+
+def serve_web(host:str, port:int) -> None:
+    # The receipts published by /newReceipt, and the pruning of /admin/prune, are configured like in the print services
+    configure_receipt_compression()
+    if getenv('ESCPOS_STYLESHEET', "inline") == 'linked':
+        ESCPOSHandler.linked_stylesheet = ReceiptStylesheet()
+    app.config['STYLESHEET'] = ESCPOSHandler.linked_stylesheet or ReceiptStylesheet()
+    if getenv('ESCPOS_IMAGE_STORE', "false") == 'True':
+        start_image_store()
+    start_retention(background=False)
+    app.config['PRINT_SERVICES_SOCKET'] = getenv('ESCPOS_CUPS_SOCKET', str(CUPSHandoffServer.DEFAULT_PATH))
+
+    class WebServer(gunicorn.app.base.BaseApplication):
+        def load_config(self) -> None:
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', int(getenv('ESCPOS_WEB_WORKERS', str(os.cpu_count() or 2))))
+            self.cfg.set('threads', int(getenv('ESCPOS_WEB_THREADS', "4")))
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('accesslog', '-' if getenv('FLASK_RUN_DEBUG', "false") == 'True' else None)
+
+        def load(self) -> Flask:
+            return app
+
+    WebServer().run()
+
+
+def start_listener_processes(host:str, printers:list[PrinterProfile]) -> ListenerSupervisor|None:
+    """ Serve the JetDirect ports with ESCPOS_LISTENER_PROCESSES listener processes, restarted by their supervisor process.  
+        The supervisor is forked, so it is started before any other thread.
+
+    Args:
+        host (str): the address to listen to
+        printers (list[PrinterProfile]): the virtual printers, each served by all the listeners
+
+    Returns:
+        ListenerSupervisor|None: the started supervisor, or None to serve the JetDirect ports in this process
+    """    
+    listeners = int(getenv('ESCPOS_LISTENER_PROCESSES', "1"))
+    if listeners <= 1:
+        return None
+    listener_supervisor = ListenerSupervisor(host, printers, listeners)
+    listener_supervisor.start()
+    app.config['LISTENER_STATS'] = listener_supervisor.stats
+    return listener_supervisor
+
+
+def start_print_servers(host:str, printers:list[PrinterProfile], reuse_port:bool = False) -> list[ESCPOSServer|AsyncESCPOSServer]:
+    """ Serve the JetDirect port of each virtual printer, each in its own thread.  
+        The printers share the conversion queue, the PHP workers and the catalog of the process.
+
+    Args:
+        host (str): the address to listen to
+        printers (list[PrinterProfile]): the virtual printers
+        reuse_port (bool): bind with SO_REUSEPORT (see create_print_server)
+
+    Returns:
+        list[ESCPOSServer|AsyncESCPOSServer]: the started servers
+    """    
+    printServers = [create_print_server(host, printer, reuse_port) for printer in printers]
+    for printServer in printServers:
+        threading.Thread(target=launchPrintServer, args=[printServer], name=f"jetdirect-{printServer.printer.port}", daemon=True).start()
+    return printServers
+
+
+def create_print_server(host:str, printer:PrinterProfile, reuse_port:bool = False) -> ESCPOSServer|AsyncESCPOSServer:
+    """ Create the JetDirect server according to ESCPOS_SERVER_MODE:
+        - threaded (default):  up to ESCPOS_MAX_CONNECTIONS connections are served at the same time, each with its own reception file.
+        - serial:  one connection at a time, the next one waits until the previous receipt is converted.
+        - asyncio:  all the connections share one event loop, each job must finish within ESCPOS_JOB_TIMEOUT seconds.
+
+    Args:
+        host (str): the address to listen to
+        printer (PrinterProfile): the virtual printer, with its JetDirect port
+        reuse_port (bool): bind with SO_REUSEPORT, so several listener processes share the port (ESCPOS_LISTENER_PROCESSES)
+
+    Returns:
+        ESCPOSServer: the server, ready to serve
+    """    
+    serverMode = getenv('ESCPOS_SERVER_MODE', "threaded")
+    if serverMode == 'asyncio':
+        jobTimeout = float(getenv('ESCPOS_JOB_TIMEOUT', str(AsyncESCPOSServer.DEFAULT_JOB_TIMEOUT)))
+        spoolMaxMemory = int(getenv('ESCPOS_SPOOL_MAX_MEMORY', str(JobSpool.DEFAULT_MAX_MEMORY)))
+        asyncServer = AsyncESCPOSServer((host, printer.port), jobTimeout, spoolMaxMemory, reuse_port)
+        asyncServer.printer = printer
+        return asyncServer
+    elif serverMode == 'serial':
+        printServer = ESCPOSServer((host, printer.port), ESCPOSHandler, bind_and_activate=False)
+    else:
+        maxConnections = int(getenv('ESCPOS_MAX_CONNECTIONS', str(ThreadedESCPOSServer.DEFAULT_MAX_CONNECTIONS)))
+        printServer = ThreadedESCPOSServer((host, printer.port), ESCPOSHandler, maxConnections, bind_and_activate=False)
+    printServer.printer = printer  # Given to the handlers of its connections
+
+    #The socket option must be set before binding
+    printServer.allow_reuse_port = reuse_port
+    try:
+        printServer.server_bind()
+        printServer.server_activate()
+    except:
+        printServer.server_close()
+        raise
+    return printServer
+
+
+def launchPrintServer(printServ:ESCPOSServer|AsyncESCPOSServer):
+    #Recevoir des connexions pour l'éternité.  Émule le protocle HP JetDirect
+    """ NOTE: En mode "serial", on prend la version bloquante pour s'assurer que chaque reçu va être sauvegardé puis converti avant d'en accepter un autre.
         NOTE:  il est possible que ce soit le comportement attendu de n'accepter qu'une connection à la fois.  Voir p.6 de la spécification d'un module Ethernet
-                à l'adresse suivante:  https://files.cyberdata.net/assets/010748/ETHERNET_IV_Product_Guide_Rev_D.pdf  """
-    print (f"JetDirect port open", flush=True)
+                à l'adresse suivante:  https://files.cyberdata.net/assets/010748/ETHERNET_IV_Product_Guide_Rev_D.pdf  
+        NOTE:  En mode "threaded" (par défaut), chaque connexion a son propre fil d'exécution, son propre fichier de réception et sa propre conversion.  """
+    print (f"JetDirect port {printServ.printer.port} open: {printServ.printer.name}", flush=True)
     printServ.serve_forever()
 
 
@@ -1597,20 +4457,81 @@ if __name__ == "__main__":
     host = getenv('FLASK_RUN_HOST', '0.0.0.0')  #By default, listen to all source addresses
     port = getenv('FLASK_RUN_PORT', '5000')
     flask_debugmode = getenv('FLASK_RUN_DEBUG', "false")
-    printPort = getenv('PRINTER_PORT', '9100')
+
+    #Les imprimantes virtuelles de l'instance, ou une seule sur PRINTER_PORT
+    printers = configured_printers()
+    app.config['PRINTERS'] = printers
 
     print("Starting ESCPOS-netprinter", flush=True)
 
-    #Lancer le service d'impression TCP
-    with ESCPOSServer((host, int(printPort)), ESCPOSHandler) as printServer:
-        t = threading.Thread(target=launchPrintServer, args=[printServer])
-        t.daemon = True
-        t.start()
-    
-        #Lancer l'application Flask
-        if flask_debugmode == 'True': 
-            startDebug:bool = True
-        else:
-            startDebug:bool = False
+    #Reprendre les reçus de l'ancien répertoire CSV, la première fois
+    receipt_catalog.import_legacy_directory()
+
+    #En mode gunicorn, l'application web a ses propres processus, lancés avant tout autre fil d'exécution
+    web_server = getenv('ESCPOS_WEB_SERVER', "flask")
+    if web_server == 'gunicorn' and gunicorn is None:
+        print("gunicorn is not installed:  the web app is served by Flask", flush=True)
+        web_server = 'flask'
+    if web_server == 'gunicorn':
+        start_web_process(host, int(port))
+
+    #Avec plusieurs processus d'écoute JetDirect, leur superviseur est lui aussi lancé avant tout autre fil d'exécution
+    listener_supervisor = start_listener_processes(host, printers)
+
+    #Ranger les reçus de l'ancien répertoire unique par date de réception, en arrière-plan
+    storage_maintenance.submit(receipt_catalog.move_to_dated_layout, "{} receipts moved to web/receipts/YYYY/MM/DD")
+
+    #Supprimer les plus vieux reçus au-delà des limites de rétention, si demandé
+    start_retention()
+
+    #Compacter les vieux reçus dans les segments d'archive, si demandé
+    start_archive()
+
+    #Enregistrer les reçus compressés, si demandé
+    configure_receipt_compression()
+
+    #Lier les reçus à la feuille de style partagée, si demandé
+    if getenv('ESCPOS_STYLESHEET', "inline") == 'linked':
+        start_linked_stylesheet()
+    app.config['STYLESHEET'] = ESCPOSHandler.linked_stylesheet or ReceiptStylesheet()
+
+    #Enregistrer les images des reçus une seule fois, si demandé
+    if getenv('ESCPOS_IMAGE_STORE', "false") == 'True':
+        start_image_store()
+
+    #Lancer les conversions en parallèle de la réception, sauf en mode "serial" où chaque reçu est converti avant d'accepter le suivant.
+    if getenv('ESCPOS_SERVER_MODE', "threaded") != 'serial':
+        start_conversion_queue()
+
+    #Garder des convertisseurs PHP résidents au lieu de démarrer PHP à chaque reçu
+    if int(getenv('ESCPOS_PHP_WORKERS', "0")) > 0:
+        start_php_workers()
+
+    #Recevoir les impressions de CUPS par le socket local
+    start_cups_handoff()
+
+    #Recevoir les impressions LPD directement, sans CUPS, si demandé
+    start_lpd_server()
+
+    #Lancer le service d'impression TCP de chaque imprimante virtuelle, sauf s'il est servi par les processus d'écoute
+    if listener_supervisor is None:
+        start_print_servers(host, printers)
+
+    #À l'arrêt, les processus web et d'écoute sont arrêtés aussi, et le socket de CUPS est retiré.
+    signal.signal(signal.SIGTERM, exit_on_signal)
+
+    if web_server == 'gunicorn':
+        #Le service d'impression garde ce processus.
+        if listener_supervisor is not None:
+            listener_supervisor.process.join()
+            sys.exit("The JetDirect listener supervisor stopped")
+        while True:
+            signal.pause()
+
+    #Lancer l'application Flask
+    if flask_debugmode == 'True': 
+        startDebug:bool = True
+    else:
+        startDebug:bool = False
 
-        app.run(host=host, port=int(port), debug=startDebug, use_reloader=False) #On empêche le reloader parce qu'il repart "main" au complet et le service d'imprimante n'est pas conçue pour ça.
\ No newline at end of file
+    app.run(host=host, port=int(port), debug=startDebug, use_reloader=False) #On empêche le reloader parce qu'il repart "main" au complet et le service d'imprimante n'est pas conçue pour ça.
\ No newline at end of file
@@ -1,8 +1,10 @@
 #!/bin/bash
 
-# Start CUPS
-/usr/sbin/cupsd
-lpadmin -p lpd_escpos -v $DEVICE_URI -E -o printer-is-shared=true
+# Start CUPS, unless the built-in LPD listener replaces it (ESCPOS_CUPS=false)
+if [ "${ESCPOS_CUPS:-True}" == "True" ]; then
+    /usr/sbin/cupsd
+    lpadmin -p lpd_escpos -v $DEVICE_URI -E -o printer-is-shared=true
+fi
 
 # Start Flask
 python3 ${FLASK_APP}
@@ -0,0 +1,55 @@
+import socket
+import argparse
+
+#This test script verifies escpos-netprinter consumes the arguments of commands with variable lengths,
+#so argument bytes that look like a DLE EOT status request do not get a response.
+
+#get printer host and port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100)
+args = parser.parse_args()
+
+HOST = args.host  #The IP adress or hostname of the printer
+PORT = args.port  #A printer should always listen to port 9100, but the Epson printers can be configured so also will we.
+
+print(f"Request status to: {HOST}:{PORT}")
+
+# Each command has a DLE EOT 1 hidden in its arguments or its data
+commands = {
+    'ESC $': b'\x1b\x24\x10\x04',
+    'ESC D': b'\x1b\x44\x08\x10\x04\x01\x00',
+    'ESC (': b'\x1b\x28\x41\x04\x00\x10\x04\x01\x00',
+    'ESC p': b'\x1b\x70\x10\x04\x01',
+    'GS V': b'\x1d\x56\x42\x10',
+    'GS k': b'\x1d\x6b\x41\x03\x10\x04\x01',
+    'GS v 0': b'\x1d\x76\x30\x00\x01\x00\x03\x00\x10\x04\x01',
+    'ESC *': b'\x1b\x2a\x00\x03\x00\x10\x04\x01',
+}
+
+with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+    s.connect((HOST, int(PORT)))
+
+    print("Test start")
+    for name, command in commands.items():
+        s.sendall(command)
+        print(f"{name} sent")
+
+    # Then a real DLE EOT 1:  it must get the only response
+    s.sendall(b'\x10\x04\x01')
+    response = s.recv(1)
+    assert response == b'\x16', f"Printer returned unexpected data to DLE EOT 1: {response}"
+
+    #Send a printable string for this receipt.
+    s.send(b'Test command lengths complete.\n')
+
+    s.shutdown(socket.SHUT_WR) #Indiquer qu'on a fini de transmettre, et qu'on est prêt à recevoir.
+    data = b''
+    while (chunk := s.recv(1024)):
+        data = data + chunk
+
+assert data == b'ESCPOS-netprinter: All done!', f"Printer sent responses to argument bytes: {data!r}"
+
+print("Test finished without exceptions")
+
+print(f"Received {data!r}")
@@ -0,0 +1,54 @@
+import socket
+import argparse
+import threading
+import time
+
+#This test script verifies escpos-netprinter serves several JetDirect connections at the same time (ESCPOS_SERVER_MODE=threaded).
+#A slow client keeps its connection open while other clients print:  they must not wait for it.
+
+#get printer host and port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100)
+parser.add_argument('--clients', help='Number of fast clients printing at the same time', default=14, type=int)
+args = parser.parse_args()
+
+HOST = args.host  #The IP adress or hostname of the printer
+PORT = args.port  #A printer should always listen to port 9100, but the Epson printers can be configured so also will we.
+SLOW_CLIENT_DELAY = 5  #Seconds the slow client waits before finishing its print.  Must stay under the printer's 10 seconds timeout.
+
+print(f"Print to: {HOST}:{PORT}")
+
+def print_receipt(lane:int, delay:float, results:dict) -> None:
+    #Print one small receipt, waiting delay seconds in the middle of it
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.connect((HOST, int(PORT)))
+        s.sendall(f"Lane {lane}: concurrent print test\n".encode())
+        time.sleep(delay)
+        s.sendall(b'\x1D\x56\x41\x03')  #Cut the paper
+        s.shutdown(socket.SHUT_WR) #Indiquer qu'on a fini de transmettre, et qu'on est prêt à recevoir.
+        data:bytes = s.recv(1024)
+        results[lane] = (time.monotonic(), data)
+
+results:dict = {}
+start = time.monotonic()
+
+# Start the slow client first, so it gets its connection before the others.
+slow_client = threading.Thread(target=print_receipt, args=[0, SLOW_CLIENT_DELAY, results])
+slow_client.start()
+time.sleep(0.5)
+
+fast_clients = [threading.Thread(target=print_receipt, args=[lane, 0, results]) for lane in range(1, args.clients + 1)]
+for client in fast_clients:
+    client.start()
+for client in fast_clients:
+    client.join()
+slow_client.join()
+
+for lane, (finished, data) in sorted(results.items()):
+    print(f"Lane {lane} finished after {finished - start:.2f}s: {data!r}")
+    assert b"All done" in data, f"Lane {lane} did not get the end of print signature: {data!r}"
+
+slowest_fast_client = max(finished for lane, (finished, data) in results.items() if lane != 0)
+assert slowest_fast_client < results[0][0], "The fast clients waited for the slow client to finish"
+print("Test finished without exceptions")
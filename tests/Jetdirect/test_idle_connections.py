@@ -0,0 +1,43 @@
+import socket
+import argparse
+import time
+
+#This test script verifies escpos-netprinter keeps printing while many idle JetDirect connections are open (ESCPOS_SERVER_MODE=asyncio).
+
+#get printer host and port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100)
+parser.add_argument('--idle', help='Number of idle connections to open', default=500, type=int)
+args = parser.parse_args()
+
+HOST = args.host  #The IP adress or hostname of the printer
+PORT = args.port  #A printer should always listen to port 9100, but the Epson printers can be configured so also will we.
+
+print(f"Print to: {HOST}:{PORT}")
+
+#Open the idle connections:  they send nothing and wait.
+idle_connections:list[socket.socket] = []
+for i in range(args.idle):
+    idle_connections.append(socket.create_connection((HOST, int(PORT))))
+print(f"{len(idle_connections)} idle connections open")
+
+#Now print while they are all waiting
+start = time.monotonic()
+with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+    s.connect((HOST, int(PORT)))
+    s.sendall(b'\x10\x04\x01')  #DLE EOT 1 - printer status
+    data:bytes = s.recv(1)
+    assert data == b'\x16', f"Printer returned unexpected status to DLE EOT 1: {data}"
+    s.sendall(b"Test idle connections - complete.\n")
+    s.shutdown(socket.SHUT_WR) #Indiquer qu'on a fini de transmettre, et qu'on est prêt à recevoir.
+    data = s.recv(1024)
+elapsed = time.monotonic() - start
+
+for connection in idle_connections:
+    connection.close()
+
+assert b"All done" in data, f"The print did not get the end of print signature: {data!r}"
+print(f"Printed in {elapsed:.2f}s with {args.idle} idle connections open")
+print("Test finished without exceptions")
+print(f"Received {data!r}")
@@ -0,0 +1,54 @@
+import socket
+import argparse
+import time
+import json
+import urllib.request
+
+#This test script verifies escpos-netprinter splits a connection that sends several receipts into one receipt per cut or initialisation,
+#and publishes each receipt while the connection is still open.
+
+#get printer host and port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100)
+parser.add_argument('--web-port', help='Port of the web application', default=80)
+parser.add_argument('--wait', help='Seconds to wait for the conversion', default=5, type=float)
+args = parser.parse_args()
+
+HOST = args.host  #The IP adress or hostname of the printer
+PORT = args.port  #A printer should always listen to port 9100, but the Epson printers can be configured so also will we.
+
+
+def count_receipts() -> int:
+    # The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+    with urllib.request.urlopen(f"http://{HOST}:{args.web_port}/receipt.json?limit=1") as listing:
+        receipts = json.load(listing)['receipts']
+        return receipts[0]['id'] if receipts else 0
+
+
+print(f"Printing to: {HOST}:{PORT}")
+print("Test start")
+receipts_before = count_receipts()
+
+with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+    s.connect((HOST, int(PORT)))
+
+    # First receipt, ended by a partial cut (GS V 66 n)
+    s.sendall(b'\x1b\x40' + b'Test multi-receipt: receipt 1\n' + b'\x1d\x56\x42\x03')
+    time.sleep(args.wait)
+    assert count_receipts() == receipts_before + 1, "The first receipt was not published while the connection is open"
+
+    # Second receipt, ended by a full cut (GS V 0), then a third one ended by the next initialisation (ESC @)
+    s.sendall(b'\x1b\x40' + b'Test multi-receipt: receipt 2\n' + b'\x1d\x56\x00')
+    s.sendall(b'\x1b\x40' + b'Test multi-receipt: receipt 3\n')
+    s.sendall(b'\x1b\x40' + b'Test multi-receipt complete.\n')
+
+    s.shutdown(socket.SHUT_WR) #Indiquer qu'on a fini de transmettre, et qu'on est prêt à recevoir.
+    data = s.recv(1024)
+
+time.sleep(args.wait)
+assert count_receipts() == receipts_before + 4, f"{count_receipts() - receipts_before} receipts published instead of 4"
+
+print("Test finished without exceptions")
+
+print(f"Received {data!r}")
@@ -0,0 +1,54 @@
+import socket
+import argparse
+import time
+import json
+import urllib.request
+
+#This test script verifies escpos-netprinter does not publish a receipt for a connection that only requests statuses,
+#and still publishes one for a connection that prints.
+
+#get printer host and port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100)
+parser.add_argument('--web-port', help='Port of the web application', default=80)
+parser.add_argument('--wait', help='Seconds to wait for the conversion', default=5, type=float)
+args = parser.parse_args()
+
+HOST = args.host  #The IP adress or hostname of the printer
+PORT = args.port  #A printer should always listen to port 9100, but the Epson printers can be configured so also will we.
+
+
+def count_receipts() -> int:
+    # The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+    with urllib.request.urlopen(f"http://{HOST}:{args.web_port}/receipt.json?limit=1") as listing:
+        receipts = json.load(listing)['receipts']
+        return receipts[0]['id'] if receipts else 0
+
+
+def send(job:bytes, expected_response:bytes) -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.connect((HOST, int(PORT)))
+        s.sendall(job)
+        s.shutdown(socket.SHUT_WR) #Indiquer qu'on a fini de transmettre, et qu'on est prêt à recevoir.
+        data = b''
+        while (chunk := s.recv(1024)):
+            data = data + chunk
+    assert data == expected_response + b'ESCPOS-netprinter: All done!', f"Printer returned unexpected data: {data!r}"
+
+
+print(f"Request status to: {HOST}:{PORT}")
+print("Test start")
+receipts_before = count_receipts()
+
+# DLE EOT 1 and GS r 1 probes, then a line feed:  nothing to print
+send(b'\x10\x04\x01' + b'\x1d\x72\x01' + b'\n', b'\x16' + b'\x00')
+time.sleep(args.wait)
+assert count_receipts() == receipts_before, "A receipt was published for a status-only connection"
+
+# The same probes with text:  one receipt
+send(b'\x10\x04\x01' + b'\x1d\x72\x01' + b'Test status only complete.\n', b'\x16' + b'\x00')
+time.sleep(args.wait)
+assert count_receipts() == receipts_before + 1, "The receipt was not published"
+
+print("Test finished without exceptions")
@@ -0,0 +1,63 @@
+import argparse
+import json
+import socket
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+#This benchmark measures the JetDirect throughput of a netprinter:  it sends jobs on concurrent connections, 
+#and measures the time until they are all received, then until their receipts are all published.
+#Run it against ESCPOS_LISTENER_PROCESSES=1, then against one listener process per core, to measure what the listener processes add.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='Port of the printer', default=9100, type=int)
+parser.add_argument('--web-port', help='Port of the web application', default=80)
+parser.add_argument('--file', help='ESC/POS job to print', default='receipt-with-logo.bin')
+parser.add_argument('--jobs', help='Number of jobs', default=50, type=int)
+parser.add_argument('--connections', help='Number of jobs sent at the same time', default=8, type=int)
+parser.add_argument('--timeout', help='Seconds to wait for the receipts', default=120, type=float)
+args = parser.parse_args()
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+job = (REPO_ROOT / args.file).read_bytes()
+
+
+def count_receipts() -> int:
+    # The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+    with urllib.request.urlopen(f"http://{args.host}:{args.web_port}/receipt.json?limit=1") as listing:
+        receipts = json.load(listing)['receipts']
+        return receipts[0]['id'] if receipts else 0
+
+
+def send_job(number:int) -> None:
+    # One job per connection, finished when the printer sends its signature
+    with socket.create_connection((args.host, args.port)) as s:
+        s.sendall(job)
+        s.shutdown(socket.SHUT_WR)
+        assert b"All done" in s.recv(1024), f"Job {number} not received"
+
+
+print(f"{args.jobs} jobs of {len(job)} bytes to {args.host}:{args.port}, {args.connections} at a time")
+receipts_before = count_receipts()
+
+start = time.perf_counter()
+with ThreadPoolExecutor(args.connections) as executor:
+    list(executor.map(send_job, range(args.jobs)))
+received = time.perf_counter() - start
+
+while count_receipts() < receipts_before + args.jobs:
+    assert time.perf_counter() - start < args.timeout, f"{count_receipts() - receipts_before} of {args.jobs} receipts published"
+    time.sleep(0.05)
+published = time.perf_counter() - start
+
+print(f"{'received':>12}: {received:8.2f} s  {args.jobs / received:8.1f} jobs/s  {args.jobs * len(job) / received / 1048576:8.1f} MiB/s")
+print(f"{'published':>12}: {published:8.2f} s  {args.jobs / published:8.1f} jobs/s")
+
+# The counters of the listener processes, when there are some
+with urllib.request.urlopen(f"http://{args.host}:{args.web_port}/queue") as queue:
+    backlog = json.load(queue) or {}
+for listener in backlog.get('listeners', []):
+    print(f"listener {listener['listener']}: {listener['connections']} connections, {listener['published']} receipts, {listener['restarts']} restarts")
@@ -0,0 +1,68 @@
+import argparse
+import json
+import socket
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+#This benchmark measures the LPD throughput of a netprinter:  it sends jobs with the LPD protocol (RFC 1179), like lpr does,
+#and measures the time until they are all acknowledged, then until their receipts are all published.
+#Run it against the built-in listener (ESCPOS_LPD_PORT), and compare with tests/lpd/test_lpd.sh, which prints through CUPS and the esc2file backend.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', help='IP adress or hostname of the printer', default='localhost')
+parser.add_argument('--port', help='LPD port of the printer', default=515, type=int)
+parser.add_argument('--queue', help='LPD queue name', default='lpd_escpos')
+parser.add_argument('--web-port', help='Port of the web application', default=80)
+parser.add_argument('--file', help='ESC/POS job to print', default='receipt-with-logo.bin')
+parser.add_argument('--jobs', help='Number of jobs', default=50, type=int)
+parser.add_argument('--connections', help='Number of jobs sent at the same time', default=4, type=int)
+parser.add_argument('--timeout', help='Seconds to wait for the receipts', default=120, type=float)
+args = parser.parse_args()
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+job = (REPO_ROOT / args.file).read_bytes()
+
+
+def count_receipts() -> int:
+    # The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+    with urllib.request.urlopen(f"http://{args.host}:{args.web_port}/receipt.json?limit=1") as listing:
+        receipts = json.load(listing)['receipts']
+        return receipts[0]['id'] if receipts else 0
+
+
+def send_file(s:socket.socket, subcommand:int, name:str, content:bytes) -> None:
+    # The subcommand, the file and its 0 byte, each acknowledged by the printer
+    s.sendall(bytes([subcommand]) + f"{len(content)} {name}\n".encode('ascii'))
+    assert s.recv(1) == b'\x00', f"{name} refused"
+    s.sendall(content + b'\x00')
+    assert s.recv(1) == b'\x00', f"{name} not acknowledged"
+
+
+def send_job(number:int) -> None:
+    # One job per connection:  the data file, then the control file that prints it, as lpr sends them
+    job_name = f"{number % 1000:03d}bench"
+    with socket.create_connection((args.host, args.port)) as s:
+        s.sendall(b'\x02' + args.queue.encode('ascii') + b'\n')
+        assert s.recv(1) == b'\x00', f"Queue {args.queue} refused"
+        send_file(s, 0x03, f"dfA{job_name}", job)
+        send_file(s, 0x02, f"cfA{job_name}", f"Hbench\nPbench\nJLPD benchmark {number}\nldfA{job_name}\nN{args.file}\n".encode('ascii'))
+
+
+print(f"{args.jobs} jobs of {len(job)} bytes to {args.host}:{args.port}, {args.connections} at a time")
+receipts_before = count_receipts()
+
+start = time.perf_counter()
+with ThreadPoolExecutor(args.connections) as executor:
+    list(executor.map(send_job, range(args.jobs)))
+received = time.perf_counter() - start
+
+while count_receipts() < receipts_before + args.jobs:
+    assert time.perf_counter() - start < args.timeout, f"{count_receipts() - receipts_before} of {args.jobs} receipts published"
+    time.sleep(0.05)
+published = time.perf_counter() - start
+
+print(f"{'acknowledged':>12}: {received:8.2f} s  {args.jobs / received:8.1f} jobs/s")
+print(f"{'published':>12}: {published:8.2f} s  {args.jobs / published:8.1f} jobs/s")
@@ -0,0 +1,58 @@
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path, PurePath
+
+#This benchmark compares the per-receipt conversion time of esc2html.php started for each receipt
+#with the resident converters of esc2html-worker.php (ESCPOS_PHP_WORKERS), and checks that both produce the same HTML.
+#It needs PHP and the composer dependencies, like the Docker image has.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--file', help='ESC/POS job to convert', default='receipt-with-qrcode.bin')
+parser.add_argument('--rounds', help='Number of conversions per mode', default=50, type=int)
+args = parser.parse_args()
+
+#Load the netprinter from the repository root (its filename is not importable as-is)
+REPO_ROOT = Path(__file__).resolve().parents[2]
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+spec = importlib.util.spec_from_file_location("escpos_netprinter", REPO_ROOT / "escpos-netprinter.py")
+netprinter = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(netprinter)
+
+bin_filename = PurePath(args.file)
+print(f"Job: {args.file}, {os.path.getsize(bin_filename)} bytes, {args.rounds} conversions per mode")
+
+
+def report(mode:str, timings:list[float]) -> None:
+    print(f"{mode:>9}: median {statistics.median(timings)*1000:8.1f} ms  best {min(timings)*1000:8.1f} ms")
+
+
+#One PHP process per receipt, as before
+timings = []
+for _ in range(args.rounds):
+    start = time.perf_counter()
+    recu = subprocess.run(["php", "esc2html.php", bin_filename.as_posix()], capture_output=True, text=True, check=True)
+    timings.append(time.perf_counter() - start)
+report("process", timings)
+process_html, process_median = recu.stdout, statistics.median(timings)
+
+#One resident worker, already started
+php_workers = netprinter.PHPWorkerPool(1)
+php_workers.start()
+php_workers.run(bin_filename)  # Warm up: the first job loads the classes
+timings = []
+for _ in range(args.rounds):
+    start = time.perf_counter()
+    recu = php_workers.run(bin_filename)
+    timings.append(time.perf_counter() - start)
+php_workers.stop()
+report("resident", timings)
+
+assert recu.stdout == process_html, "The resident converter produced a different HTML"
+print(f"Speedup: {process_median / statistics.median(timings):.1f}x, identical HTML")
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+#This benchmark measures what hosting several virtual printers in one instance (ESCPOS_PRINTERS) saves, 
+#against one instance per printer like one container per printer:  the memory of the processes, and the time until all the printers are ready.
+#The containers also run their own CUPS and their own system, which are not counted here:  the saving is at least what is measured.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--printers', help='Number of virtual printers', default=12, type=int)
+parser.add_argument('--first-port', help='JetDirect port of the first printer, the next ones follow', default=9300, type=int)
+parser.add_argument('--web-port', help='Web port of the first instance, the next ones follow', default=5300, type=int)
+parser.add_argument('--timeout', help='Seconds to wait for the printers', default=60, type=float)
+args = parser.parse_args()
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+(REPO_ROOT / 'web' / 'tmp').mkdir(parents=True, exist_ok=True)
+(REPO_ROOT / 'web' / 'receipts').mkdir(parents=True, exist_ok=True)
+
+
+def start_instance(web_port:int, environment:dict[str, str]) -> subprocess.Popen:
+    # The instances share web/, but not the CUPS handoff socket
+    return subprocess.Popen([sys.executable, 'escpos-netprinter.py'], cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            env=os.environ | {'FLASK_RUN_PORT': str(web_port), 'ESCPOS_CUPS_SOCKET': ''} | environment)
+
+
+def wait_until_ready(ports:list[int], web_ports:list[int], start:float) -> float:
+    # Ready when each JetDirect port accepts a connection (an empty job prints nothing) and each web app answers
+    pending = [('jetdirect', port) for port in ports] + [('web', port) for port in web_ports]
+    while pending:
+        assert time.perf_counter() - start < args.timeout, f"Not ready: {pending}"
+        kind, port = pending[0]
+        try:
+            if kind == 'jetdirect':
+                socket.create_connection(('localhost', port), timeout=1).close()
+            else:
+                urllib.request.urlopen(f"http://localhost:{port}/", timeout=1).close()
+            pending.pop(0)
+        except OSError:
+            time.sleep(0.02)
+    return time.perf_counter() - start
+
+
+def process_tree(pid:int) -> list[int]:
+    # The process and all its children (conversion, web and listener processes)
+    try:
+        children = Path(f'/proc/{pid}/task/{pid}/children').read_text().split()
+    except OSError:
+        return []
+    return [pid] + [descendant for child in children for descendant in process_tree(int(child))]
+
+
+def memory(pid:int) -> int:
+    # The proportional set size:  the pages shared by the processes (e.g. after a fork) are counted once in total
+    try:
+        fields = Path(f'/proc/{pid}/smaps_rollup').read_text()
+        label = 'Pss:'
+    except OSError:
+        fields = Path(f'/proc/{pid}/status').read_text()
+        label = 'VmRSS:'
+    return next(int(line.split()[1]) * 1024 for line in fields.splitlines() if line.startswith(label))
+
+
+def measure(name:str, instances:list[subprocess.Popen], ports:list[int], web_ports:list[int], start:float) -> tuple[float, int]:
+    try:
+        ready = wait_until_ready(ports, web_ports, start)
+        time.sleep(1)  # Let the background startup tasks finish
+        total = sum(memory(pid) for instance in instances for pid in process_tree(instance.pid))
+    finally:
+        for instance in instances:
+            instance.terminate()
+        for instance in instances:
+            instance.wait()
+    print(f"{name:>24}: {ready:8.2f} s  {total / 1048576:8.1f} MiB  {total / 1048576 / args.printers:8.1f} MiB per printer", flush=True)
+    return ready, total
+
+
+ports = [args.first_port + number for number in range(args.printers)]
+print(f"{args.printers} printers, on the ports {ports[0]} to {ports[-1]}")
+print(f"{'':>24}  {'ready in':>10}  {'memory':>12}")
+
+start = time.perf_counter()
+printers = json.dumps([{'port': port, 'name': f'printer-{port}'} for port in ports])
+one_instance = measure("one instance", [start_instance(args.web_port, {'ESCPOS_PRINTERS': printers})], ports, [args.web_port], start)
+
+start = time.perf_counter()
+web_ports = [args.web_port + number for number in range(args.printers)]
+instances = [start_instance(web_port, {'PRINTER_PORT': str(port)}) for port, web_port in zip(ports, web_ports)]
+one_per_printer = measure("one instance per printer", instances, ports, web_ports, start)
+
+print(f"{'saved':>24}: {one_per_printer[0] - one_instance[0]:8.2f} s  {(one_per_printer[1] - one_instance[1]) / 1048576:8.1f} MiB")
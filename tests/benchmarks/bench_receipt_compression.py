@@ -0,0 +1,67 @@
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+#This benchmark measures what the compressed receipt storage (ESCPOS_RECEIPT_COMPRESSION) saves:
+#the disk space of the stored receipts, and the bytes sent for a view by a client that accepts the encoding.
+#It also measures the compression time added to each publication, and checks that each encoding gives the receipt back.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--directory', help='Directory of published receipts (*.html)', default='web/receipts')
+parser.add_argument('--rounds', help='Number of compressions of each receipt, for the timings', default=5, type=int)
+args = parser.parse_args()
+
+#Load the netprinter from the repository root (its filename is not importable as-is)
+REPO_ROOT = Path(__file__).resolve().parents[2]
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+spec = importlib.util.spec_from_file_location("escpos_netprinter", REPO_ROOT / "escpos-netprinter.py")
+netprinter = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(netprinter)
+
+
+def sample_receipts() -> list[bytes]:
+    # The published receipts, or else the sample jobs of the repository converted like the netprinter does (needs PHP)
+    directory = Path(args.directory)
+    receipts = [receipt.read_bytes() for receipt in sorted(directory.glob('*.html'))] if directory.is_dir() else []
+    if receipts:
+        print(f"{len(receipts)} receipts from {directory}")
+        return receipts
+
+    print(f"No receipt in {directory}:  converting the sample jobs of the repository")
+    with netprinter.app.app_context():
+        for job in sorted(REPO_ROOT.glob('*.bin')):
+            recu = subprocess.run(["php", "esc2html.php", job.name], capture_output=True, text=True, check=True)
+            receipts.append(netprinter.ESCPOSHandler.finalize_receipt(datetime.now(), recu.stdout).encode('utf-8'))
+    return receipts
+
+
+receipts = sample_receipts()
+raw_size = sum(len(receipt) for receipt in receipts)
+print(f"{'stored as':>10}  {'bytes':>12}  {'saved':>6}  {'per receipt':>12}  {'compression':>12}")
+print(f"{'html':>10}  {raw_size:>12}  {'':>6}  {raw_size // len(receipts):>12}")
+
+for name, encoding in netprinter.RECEIPT_ENCODINGS.items():
+    compressed = [encoding.compress(receipt) for receipt in receipts]
+    for receipt, variant in zip(receipts, compressed):
+        assert encoding.decompress(variant) == receipt, f"{name} did not give the receipt back"
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for receipt in receipts:
+            encoding.compress(receipt)
+    compression_ms = (time.perf_counter() - start) * 1000 / (args.rounds * len(receipts))
+
+    size = sum(len(variant) for variant in compressed)
+    print(f"{name:>10}  {size:>12}  {100 - size * 100 / raw_size:>5.1f}%  {size // len(receipts):>12}  {compression_ms:>9.2f} ms")
+
+missing = [name for name in netprinter.RECEIPT_ENCODING_PREFERENCE if name not in netprinter.RECEIPT_ENCODINGS]
+if missing:
+    print(f"Not measured (module not installed): {', '.join(missing)}")
+print("The bytes sent for a view are the stored bytes:  the saving applies to the disk and to the bandwidth alike.")
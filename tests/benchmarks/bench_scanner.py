@@ -0,0 +1,127 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+#This benchmark compares the throughput of the JetDirect scanners (ESCPOS_SCAN_MODE=bytewise or chunked).
+#It feeds the same job to ESCPOSHandler through a socket pair, without conversion, and checks that both scanners agree.
+#It also counts the per-byte work of each scanner:  the commands dispatched to process_command and the reads on the socket file.
+
+#get the benchmark parameters from the command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--file', help='ESC/POS job to send', default='receipt-with-logo.bin')
+parser.add_argument('--size', help='Approximate job size in kilobytes (the file is repeated)', default=200, type=int)
+parser.add_argument('--rounds', help='Number of jobs sent per scanner', default=5, type=int)
+args = parser.parse_args()
+
+#Load the netprinter from the repository root (its filename is not importable as-is)
+REPO_ROOT = Path(__file__).resolve().parents[2]
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+spec = importlib.util.spec_from_file_location("escpos_netprinter", REPO_ROOT / "escpos-netprinter.py")
+netprinter = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(netprinter)
+
+
+class CountingReader:
+    # Count the reads made on the socket file
+    def __init__(self, rfile, server):
+        self.rfile = rfile
+        self.server = server
+
+    def read(self, size=-1):
+        self.server.reads = self.server.reads + 1
+        return self.rfile.read(size)
+
+    def read1(self, size=-1):
+        self.server.reads = self.server.reads + 1
+        return self.rfile.read1(size)
+
+    def peek(self, size=0):
+        return self.rfile.peek(size)
+
+    def close(self):
+        self.rfile.close()
+
+
+class BenchHandler(netprinter.ESCPOSHandler):
+    def setup(self):
+        super().setup()
+        if self.server.counting:
+            self.rfile = CountingReader(self.rfile, self.server)
+
+    def process_command(self, indata_statuscheck):
+        self.server.dispatches = self.server.dispatches + 1
+        if self.server.counting:
+            # Name the command like the scanner's command table does
+            spec = self.COMMAND_SPECS.get(indata_statuscheck + self.rfile.peek(1)[:1], self.COMMAND_DEFAULTS[indata_statuscheck])
+            self.server.commands[spec.name] = self.server.commands.get(spec.name, 0) + 1
+        return super().process_command(indata_statuscheck)
+
+    # Keep what was received instead of converting it
+    def print_toHTML(self, binfile, bin_filename):
+        with open(bin_filename, "rb") as received:
+            self.server.received = received.read()
+
+
+class FakeServer:
+    received:bytes = b''
+    counting:bool = False
+    dispatches:int = 0
+    reads:int = 0
+
+    def __init__(self):
+        self.commands:dict[str, int] = {}
+
+
+def send_job(job:bytes, scanmode:str, server:FakeServer|None = None) -> tuple[float, bytes, bytes]:
+    #Send one job and return the elapsed time, the status responses and the received data
+    os.environ['ESCPOS_SCAN_MODE'] = scanmode
+    if server is None:
+        server = FakeServer()
+    client, printer = socket.socketpair()
+    handler = threading.Thread(target=BenchHandler, args=[printer, ('benchmark', 0), server])
+    responses:bytes = b''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        handler.start()
+        client.sendall(job)
+        client.shutdown(socket.SHUT_WR)
+        while (chunk := client.recv(65536)):
+            responses = responses + chunk
+        handler.join()
+        elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed, responses, server.received
+
+
+sample:bytes = Path(args.file).read_bytes()
+job:bytes = sample * max(1, (args.size * 1024) // len(sample))
+print(f"Job: {args.file} x {len(job) // len(sample)} = {len(job)} bytes, {args.rounds} rounds")
+
+results = {}
+for scanmode in ['bytewise', 'chunked']:
+    timings = []
+    for _ in range(args.rounds):
+        elapsed, responses, received = send_job(job, scanmode)
+        timings.append(elapsed)
+    results[scanmode] = (min(timings), responses, received)
+    print(f"{scanmode:>8}: best {min(timings)*1000:8.1f} ms  {len(job) / min(timings) / 1e6:8.2f} MB/s")
+
+assert results['bytewise'][1] == results['chunked'][1], "The scanners sent different status responses"
+assert results['bytewise'][2] == results['chunked'][2], "The scanners received different data"
+print(f"Speedup: {results['bytewise'][0] / results['chunked'][0]:.1f}x, identical responses and received data")
+
+#Per-byte work on one copy of the file (the counting slows the scanners down, so it is not timed)
+for scanmode in ['bytewise', 'chunked']:
+    server = FakeServer()
+    server.counting = True
+    send_job(sample, scanmode, server)
+    print(f"{scanmode:>8}: {server.dispatches:6} commands dispatched, {server.reads:6} reads for {len(sample)} bytes")
+print("Commands: " + ", ".join(f"{name} x{count}" for name, count in sorted(server.commands.items())))
@@ -0,0 +1,57 @@
+import argparse
+import json
+import subprocess
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+#This test script verifies the CUPS backend client (cups/esc2handoff.py) hands the jobs to escpos-netprinter on its local socket,
+#and gets each receipt published once, also when several jobs are handed at the same time.
+
+#get the socket and web port from command line
+parser = argparse.ArgumentParser()
+parser.add_argument('--socket', help='Handoff socket of the netprinter', default='web/tmp/cups.sock')
+parser.add_argument('--web-port', help='Port of the web application', default=80)
+parser.add_argument('--jobs', help='Number of jobs handed at the same time', default=8, type=int)
+args = parser.parse_args()
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+CLIENT = REPO_ROOT / 'cups' / 'esc2handoff.py'
+
+
+def count_receipts() -> int:
+    # The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+    with urllib.request.urlopen(f"http://localhost:{args.web_port}/receipt.json?limit=1") as listing:
+        receipts = json.load(listing)['receipts']
+        return receipts[0]['id'] if receipts else 0
+
+
+def hand_job(number:int) -> subprocess.CompletedProcess:
+    # The job on stdin, like CUPS gives it to the backend with 5 arguments
+    job = b'\x1b\x40' + f'Test CUPS handoff: job {number}\n'.encode('ascii') + b'\x1d\x56\x00'
+    return subprocess.run([sys.executable, CLIENT, '--socket', args.socket, '--job-id', str(number), '--user', 'test', '--title', f'Job {number}'],
+                          input=job, capture_output=True)
+
+
+print(f"Handing jobs to: {args.socket}")
+print("Test start")
+receipts_before = count_receipts()
+
+# One job from a file, like CUPS gives it to the backend with 6 arguments
+result = subprocess.run([sys.executable, CLIENT, '--socket', args.socket, str(REPO_ROOT / 'receipt-with-logo.bin')], capture_output=True)
+assert result.returncode == 0, f"The job was not published: {result.stderr!r}"
+assert count_receipts() == receipts_before + 1, "The receipt is not listed once the client returns"
+
+# Then concurrent jobs on stdin
+with ThreadPoolExecutor(args.jobs) as executor:
+    results = list(executor.map(hand_job, range(args.jobs)))
+failed = [result.stderr for result in results if result.returncode != 0]
+assert not failed, f"{len(failed)} jobs were not published: {failed[0]!r}"
+assert count_receipts() == receipts_before + 1 + args.jobs, f"{count_receipts() - receipts_before} receipts published instead of {1 + args.jobs}"
+
+# A client without the netprinter
+result = subprocess.run([sys.executable, CLIENT, '--socket', 'web/tmp/no-such.sock', str(REPO_ROOT / 'receipt-with-logo.bin')], capture_output=True)
+assert result.returncode == 2, f"Unexpected exit status without the handoff socket: {result.returncode}"
+
+print("Test finished without exceptions")
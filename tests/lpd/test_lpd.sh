@@ -1,8 +1,28 @@
 #!/bin/bash
-<<<<<<< HEAD
-# This is a script to test the lpd backend with whole receipts
-=======
-# This is a script to test the lpd backend
->>>>>>> origin/1-deal-with-pre-print-requests-from-pos-systems
-lp -d lpd_escpos ../receipt-with-logo.bin
-lp -d lpd_escpos ../receipt-with-qrcode.bin
\ No newline at end of file
+# This is a script to test the lpd backend with whole receipts, and to time it until the receipts are published.
+# Usage:  test_lpd.sh [printer] [rounds]
+#   printer:  the CUPS printer, lpd_escpos (the esc2file backend) by default.  To compare with the built-in LPD listener (ESCPOS_LPD_PORT), 
+#             declare it to CUPS first:  lpadmin -p lpd_native -v lpd://localhost:${ESCPOS_LPD_PORT}/lp -E
+#   rounds:   the number of times both receipts are printed, 1 by default
+PRINTER=${1:-lpd_escpos}
+ROUNDS=${2:-1}
+WEB_PORT=${FLASK_RUN_PORT:-80}
+
+# The receipt IDs follow each other, so the most recent ID counts the receipts published so far
+count_receipts() {
+   curl -s "http://localhost:${WEB_PORT}/receipt.json?limit=1" | python3 -c "import json,sys; r=json.load(sys.stdin)['receipts']; print(r[0]['id'] if r else 0)"
+}
+
+before=$(count_receipts)
+expected=$((before + 2 * ROUNDS))
+start=$(date +%s.%N)
+for ((round = 0; round < ROUNDS; round++)); do
+   lp -d ${PRINTER} ../receipt-with-logo.bin
+   lp -d ${PRINTER} ../receipt-with-qrcode.bin
+done
+
+while [ "$(count_receipts)" -lt "${expected}" ]; do
+   sleep 0.1
+done
+end=$(date +%s.%N)
+echo "$((2 * ROUNDS)) receipts printed on ${PRINTER} and published in $(awk "BEGIN {print ${end} - ${start}}") s"